@@ -0,0 +1,23 @@
+# ASCII art banner printed when the program starts. It's rendered once
+# with pyfiglet and kept here, so pyfiglet doesn't have to be imported and
+# run on every start. To render it again:
+#     pyfiglet.figlet_format("Personal\nExpense\nTracker")
+BANNER = r''' ____                                 _
+|  _ \ ___ _ __ ___  ___  _ __   __ _| |
+| |_) / _ \ '__/ __|/ _ \| '_ \ / _` | |
+|  __/  __/ |  \__ \ (_) | | | | (_| | |
+|_|   \___|_|  |___/\___/|_| |_|\__,_|_|
+
+ _____
+| ____|_  ___ __   ___ _ __  ___  ___
+|  _| \ \/ / '_ \ / _ \ '_ \/ __|/ _ \
+| |___ >  <| |_) |  __/ | | \__ \  __/
+|_____/_/\_\ .__/ \___|_| |_|___/\___|
+           |_|
+ _____               _
+|_   _| __ __ _  ___| | _____ _ __
+  | || '__/ _` |/ __| |/ / _ \ '__|
+  | || | | (_| | (__|   <  __/ |
+  |_||_|  \__,_|\___|_|\_\___|_|
+
+'''
@@ -0,0 +1,233 @@
+# Offline benchmark - runs the screens of run.py against an in-memory
+# fake Google Sheets document (see fake_sheet.py) with scripted answers
+# to the prompts, and prints how long every operation took and how many
+# Sheets requests it made.
+#
+# Every storage backend and dataset size runs in its own Python process
+# and temporary directory, so settings read at import time, the replica
+# and the journal start fresh. Every request to the fake document waits
+# for the simulated latency. The request quota isn't applied, so the
+# timings show the work of the program and the requests only.
+#
+# Usage:
+#     python3 benchmark.py
+#     python3 benchmark.py --rows 1000 100000 --latency 0.2 \
+#         --backend sheets sorted --format json
+import argparse  # for reading command line arguments
+import builtins  # for answering the prompts of the screens
+import contextlib  # for hiding the output of the screens
+import io  # for the hidden output
+import json  # for passing results between processes and JSON output
+import os  # for the environment of the benchmark processes
+import random  # for synthetic expenses
+import subprocess  # for running every benchmark in a new process
+import sys  # for interacting with the system
+import tempfile  # for the files of every benchmark process
+import time  # for measuring time
+from datetime import datetime  # for dates of the synthetic expenses
+
+# Default dataset sizes and simulated seconds of every Sheets request
+ROWS = [1000, 10000, 100000, 1000000]
+LATENCY = 0.05
+
+# Storage backends which keep the expenses in Google Sheets
+BACKENDS = ['sheets', 'sorted', 'partitioned']
+
+# Name of the in-memory fake document
+FAKE_SHEET = 'benchmark'
+
+# Years of the synthetic expenses - the last full years, so every
+# month can be picked in the screens
+YEARS = 3
+
+# Directory of this file, the program modules are imported from there
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Operations in the order they are run, with the screen of run.py and
+# the scripted answers to its prompts. {year} is the last full year and
+# {previous} the year before it
+OPERATIONS = [
+    ('add', 'add_expense', ['1', '25', '{year}-06-15', 'y']),
+    ('edit', 'edit_expense', ['{year}', '6', '1', 'a', '30', 'n', 'y']),
+    ('year statement', 'year_statement', ['{year}', 'n']),
+    ('month statement', 'month_statement', ['{year}', '6', 'n']),
+    ('compare years', 'compare_year_expenses',
+     ['{previous}', '{year}', 'n']),
+    ('compare months', 'compare_month_expenses',
+     ['{year}', '6', '{year}', '7', 'y']),
+]
+
+
+# Read command line arguments
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Time the operations of the expense tracker against '
+                    'a fake Google Sheets document.')
+    parser.add_argument('--rows', nargs='+', type=int, default=ROWS,
+                        help='dataset sizes (default: 1000 10000 100000 '
+                             '1000000)')
+    parser.add_argument('--latency', type=float, default=LATENCY,
+                        help=f'seconds added to every Sheets request '
+                             f'(default: {LATENCY})')
+    parser.add_argument('--backend', nargs='+', choices=BACKENDS,
+                        default=['sheets'],
+                        help='storage backends (default: sheets)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the synthetic expenses (default: 1)')
+    parser.add_argument('--format', choices=['text', 'json'],
+                        default='text', help='output format (default: text)')
+    # Used by the benchmark processes started by this script
+    parser.add_argument('--run', nargs=2, metavar=('BACKEND', 'ROWS'),
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# Synthetic expenses spread over the last full years, in random order
+def make_rows(count, seed):
+    from validation import CATEGORIES  # for categories of the expenses
+
+    generator = random.Random(seed)
+    last_year = datetime.today().year - 1
+    return [
+        [str(generator.randint(1, 500)), generator.choice(CATEGORIES),
+         f'{generator.randint(last_year - YEARS + 1, last_year)}-'
+         f'{generator.randint(1, 12):02d}-{generator.randint(1, 28):02d}']
+        for _ in range(count)
+    ]
+
+
+# Worksheets of the fake document - one expenses worksheet, or one
+# worksheet per year for the partitioned backend
+def make_sheets(backend, rows):
+    from fake_sheet import HEADER  # for the header row
+
+    if backend != 'partitioned':
+        return {'expenses': [HEADER] + rows}
+    sheets = {}
+    for row in rows:
+        sheets.setdefault(f'expenses_{row[2][:4]}', [HEADER]).append(row)
+    return sheets
+
+
+# Answer the prompts of a screen from the script, fail when the screen
+# asks for more answers than the script has
+def scripted_input(name, answers):
+    answers = list(answers)
+
+    def answer(prompt=''):
+        if not answers:
+            raise RuntimeError(f'{name} asked for more input: {prompt!r}')
+        return answers.pop(0)
+    return answer, answers
+
+
+# Sheets requests made since the calls were copied, by method
+def new_calls(calls, before):
+    return {method: count - before.get(method, 0)
+            for method, count in sorted(calls.items())
+            if count > before.get(method, 0)}
+
+
+# Run all the operations in this process - called in a new process with
+# the environment set by run_benchmark(). Output of the screens is
+# hidden, results are printed as one JSON line
+def run_operations(backend, row_count, seed, latency):
+    import fake_sheet  # for the in-memory document
+
+    spreadsheet = fake_sheet.FakeSpreadsheet(
+        latency=latency,
+        sheets=make_sheets(backend, make_rows(row_count, seed)))
+    fake_sheet.OPENED[FAKE_SHEET] = spreadsheet
+
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        import run  # for the screens, starts loading the expenses
+        run.DATA_READY.wait()
+        if run.DATA_ERROR is not None:
+            raise run.DATA_ERROR
+        results.append(('load', time.perf_counter() - started,
+                        new_calls(spreadsheet.calls, {})))
+
+        year = datetime.today().year - 1
+        for name, screen, answers in OPERATIONS:
+            answers = [answer.format(year=year, previous=year - 1)
+                       for answer in answers]
+            builtins.input, left = scripted_input(name, answers)
+            before = dict(spreadsheet.calls)
+            started = time.perf_counter()
+            run.SCREENS[screen]()
+            # Writes kept in the journal are sent now, so they are
+            # counted with the operation which made them
+            run.STORE.flush()
+            duration = time.perf_counter() - started
+            if left:
+                raise RuntimeError(f'{name} didn\'t ask for {left}')
+            results.append((name, duration,
+                            new_calls(spreadsheet.calls, before)))
+    print(json.dumps(results))
+
+
+# Run the operations of one backend and dataset size in a new process
+def run_benchmark(backend, row_count, arguments):
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(
+            os.environ,
+            PYTHONPATH=HERE,
+            EXPENSE_STORAGE=backend,
+            EXPENSE_FAKE_SHEET=FAKE_SHEET,
+            EXPENSE_CACHE_SOCKET=os.path.join(directory, 'no-daemon.sock'),
+            EXPENSE_FLUSH_DELAY='3600',
+            SHEETS_READ_QUOTA='0',
+            SHEETS_WRITE_QUOTA='0')
+        environment.pop('EXPENSE_TRACKER_TIMING', None)
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--run', backend, str(row_count),
+             '--latency', str(arguments.latency),
+             '--seed', str(arguments.seed)],
+            cwd=directory, env=environment, capture_output=True, text=True)
+    if process.returncode:
+        sys.exit(f'Benchmark {backend} with {row_count} rows failed:\n'
+                 f'{process.stderr}')
+    return [{'backend': backend, 'rows': row_count, 'operation': name,
+             'seconds': round(duration, 4), 'calls': sum(calls.values()),
+             'calls_by_method': calls}
+            for name, duration, calls
+            in json.loads(process.stdout.splitlines()[-1])]
+
+
+# Print the results as a table or JSON
+def write_results(results, output_format):
+    if output_format == 'json':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print(f'{"Backend":<13}{"Rows":>9}  {"Operation":<17}{"Seconds":>9}'
+          f'{"Calls":>7}  Calls by method')
+    for result in results:
+        methods = ', '.join(f'{method}={count}' for method, count
+                            in result['calls_by_method'].items())
+        print(f'{result["backend"]:<13}{result["rows"]:>9}  '
+              f'{result["operation"]:<17}{result["seconds"]:>9.3f}'
+              f'{result["calls"]:>7}  {methods}')
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.run:
+        backend, row_count = arguments.run
+        run_operations(backend, int(row_count), arguments.seed,
+                       arguments.latency)
+        return
+
+    results = []
+    for backend in arguments.backend:
+        for row_count in arguments.rows:
+            results.extend(run_benchmark(backend, row_count, arguments))
+    write_results(results, arguments.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# Shared cache daemon - one process on the machine holds the expenses in
+# memory and serves them to all the terminal sessions over a Unix socket,
+# so sessions don't each download the sheet. Writes from all sessions go
+# through one writer thread, so there is one stream of API calls to
+# Google Sheets. New rows added to the sheet by others are picked up
+# every REFRESH_INTERVAL seconds.
+#
+# Start the daemon with:
+#     python3 cache_daemon.py
+#
+# Requests and responses are JSON objects, one per line:
+#     {"op": "year_totals", "args": [2024]}
+#     {"result": {"Food": 120, "Housing": 900}}
+# Errors are sent with the name of their type, so KeyError of an
+# unknown expense id is raised as KeyError in the session too:
+#     {"error": "12345", "type": "KeyError"}
+import json  # for encoding requests and responses
+import os  # for reading environment variables and removing old socket
+import queue  # for passing writes to the writer thread
+import socket  # for connecting to the daemon
+import socketserver  # for serving the sessions
+import sys  # for interacting with the system
+import threading  # for the writer and refresh threads
+import time  # for waiting between refreshes
+
+# Location of the socket, can be changed with environment variable
+SOCKET_PATH = os.environ.get('EXPENSE_CACHE_SOCKET', '.expense_cache.sock')
+
+# Seconds between downloads of rows added by others
+REFRESH_INTERVAL = int(os.environ.get('EXPENSE_CACHE_REFRESH', '60'))
+
+# Operations which read the expenses and which change them
+READ_OPERATIONS = ('month_records', 'year_totals', 'month_totals',
+                   'totals_by_year', 'range_totals', 'period_totals')
+WRITE_OPERATIONS = ('add_expenses', 'update_expense', 'refresh', 'flush')
+
+# Errors of the daemon raised with the same type in the session, others
+# are raised as RuntimeError
+ERROR_TYPES = {'KeyError': KeyError, 'ValueError': ValueError}
+
+# Times a session tries to connect again when the daemon is restarted,
+# one second apart, before it loads the expenses itself
+RECONNECT_ATTEMPTS = int(os.environ.get('EXPENSE_CACHE_RECONNECT', '5'))
+
+
+# Cache daemon - serves reads from the store in memory and passes
+# writes to the writer thread
+class CacheDaemon(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, store, path=SOCKET_PATH):
+        self.store = store
+        # Reads wait while the writer changes the data
+        self.lock = threading.Lock()
+        self.writes = queue.Queue()
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, CacheRequestHandler)
+        os.chmod(path, 0o600)
+        threading.Thread(target=self._writer, daemon=True).start()
+        threading.Thread(target=self._refresher, daemon=True).start()
+
+    # Run one operation requested by a session
+    def run_operation(self, operation, args):
+        if operation == 'ping':
+            return 'pong'
+        if operation in READ_OPERATIONS:
+            with self.lock:
+                result = getattr(self.store, operation)(*args)
+            if operation == 'totals_by_year':
+                # JSON object keys are text, years are sent as pairs
+                result = list(result.items())
+            return result
+        if operation in WRITE_OPERATIONS:
+            if operation == 'update_expense':
+                # Column numbers of the changes are sent as text keys
+                args = [args[0], {int(column): value
+                                  for column, value in args[1].items()}]
+            done = queue.Queue(maxsize=1)
+            self.writes.put((operation, args, done))
+            error = done.get()
+            if error is not None:
+                raise error
+            return None
+        raise ValueError(f'Unknown operation: {operation}')
+
+    # Writer thread - the only place where the daemon calls Google Sheets
+    def _writer(self):
+        while True:
+            operation, args, done = self.writes.get()
+            try:
+                with self.lock:
+                    getattr(self.store, operation)(*args)
+                done.put(None)
+            except Exception as error:
+                done.put(error)
+
+    # Refresh thread - asks the writer to download new rows regularly
+    def _refresher(self):
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            self.writes.put(('refresh', [], queue.Queue(maxsize=1)))
+
+
+# Handler of one session connection - reads requests line by line
+class CacheRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = self.server.run_operation(request['op'],
+                                                   request.get('args', []))
+                response = {'result': result}
+            except Exception as error:
+                response = {'error': str(error),
+                            'type': type(error).__name__}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+# Client of the cache daemon - has the same methods as store.LocalStore,
+# so the program doesn't have to know where the data is kept. When the
+# connection is lost (the daemon was restarted), the client connects
+# again, and when the daemon doesn't come back it loads the expenses
+# itself and uses its own store for the rest of the session
+class CacheClient:
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.local = None
+        self.lock = threading.Lock()
+        self._connect()
+
+    # Open the connection to the daemon
+    def _connect(self):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(self.path)
+        except OSError:
+            self.connection.close()
+            raise
+        self.stream = self.connection.makefile('rwb')
+
+    # Send one request to the daemon and wait for the response. Requests
+    # which didn't reach the daemon, and reads and writes which are safe
+    # to repeat, are sent again after the connection is lost. New
+    # expenses are not - the daemon may have saved them already
+    def _call(self, operation, *args):
+        if self.local is not None:
+            return self._call_local(operation, args)
+        request = json.dumps({'op': operation, 'args': list(args)})
+        sent = False
+        with self.lock:
+            try:
+                self.stream.write(request.encode('utf-8') + b'\n')
+                self.stream.flush()
+                sent = True
+                line = self.stream.readline()
+            except OSError:
+                line = b''
+            if not line:
+                self._reconnect()
+        if not line:
+            if sent and operation == 'add_expenses':
+                raise ConnectionError('Cache daemon closed the connection, '
+                                      'the expenses may not be saved')
+            return self._call(operation, *args)
+        response = json.loads(line)
+        if 'error' in response:
+            error_type = ERROR_TYPES.get(response.get('type'), RuntimeError)
+            raise error_type(f'Cache daemon: {response["error"]}')
+        return response['result']
+
+    # Connect to the restarted daemon, or load the expenses in this
+    # session when it isn't back after RECONNECT_ATTEMPTS seconds
+    def _reconnect(self):
+        try:
+            self.stream.close()
+        except OSError:
+            pass
+        self.connection.close()
+        for _ in range(RECONNECT_ATTEMPTS):
+            time.sleep(1)
+            try:
+                self._connect()
+                return
+            except OSError:
+                pass
+        from store import open_store  # for the configured storage backend
+        store = open_store()
+        store.load()
+        self.local = store
+
+    # Run the operation with the store of this session, results in the
+    # same form as from the daemon
+    def _call_local(self, operation, args):
+        if operation == 'ping':
+            return 'pong'
+        result = getattr(self.local, operation)(*args)
+        if operation == 'totals_by_year':
+            result = list(result.items())
+        return result
+
+    # Data is already loaded by the daemon, just check it's answering
+    def load(self):
+        self._call('ping')
+
+    # Nothing to do, the daemon downloads rows added by others itself
+    # every REFRESH_INTERVAL seconds - a refresh of every session would
+    # be one more request to Google Sheets for each of them
+    def refresh(self):
+        pass
+
+    def flush(self):
+        self._call('flush')
+
+    def add_expenses(self, rows):
+        self._call('add_expenses', rows)
+
+    def update_expense(self, row_id, changes):
+        self._call('update_expense', row_id, changes)
+
+    def month_records(self, year, month):
+        return self._call('month_records', year, month)
+
+    def year_totals(self, year):
+        return self._call('year_totals', year)
+
+    def month_totals(self, year, month):
+        return self._call('month_totals', year, month)
+
+    def totals_by_year(self):
+        return dict((year, totals)
+                    for year, totals in self._call('totals_by_year'))
+
+    def range_totals(self, start, end):
+        return self._call('range_totals', start, end)
+
+    def period_totals(self, periods):
+        return self._call('period_totals', periods)
+
+
+# Connect to the cache daemon, returns None when it isn't running
+def connect_to_daemon(path=SOCKET_PATH):
+    try:
+        client = CacheClient(path)
+        client.load()
+        return client
+    except OSError:
+        return None
+
+
+def main():
+    from store import open_store  # for the configured storage backend
+
+    store = open_store()
+    store.load()
+    server = CacheDaemon(store)
+    # Node.js app waits for this line before it starts the sessions
+    print(f'Cache daemon ready on {SOCKET_PATH}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        # Send writes which are still in the journal
+        with server.lock:
+            store.flush()
+        sys.exit()
+
+
+if __name__ == '__main__':
+    main()
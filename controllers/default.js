@@ -1,38 +1,168 @@
 const Pty = require('node-pty');
 const fs = require('fs');
+const childProcess = require('child_process');
+
+// Python sessions are started ahead of time, so a new connection gets
+// a session that is already authenticated and has the sheet open
+const POOL_SIZE = parseInt(process.env.PYTHON_POOL_SIZE || '2');
+// Idle sessions are restarted after this time, so they don't show data
+// loaded long before the user connected
+const POOL_MAX_IDLE = parseInt(process.env.PYTHON_POOL_MAX_IDLE || '600') * 1000;
+// Delay before a session which exited while waiting in the pool is replaced
+const POOL_RESPAWN_DELAY = 1000;
+
+// Shared cache daemon holds the expenses for all the sessions, it can be
+// turned off with EXPENSE_CACHE_DAEMON=0
+const CACHE_DAEMON = process.env.EXPENSE_CACHE_DAEMON !== '0';
+// Sessions are started without the daemon when it isn't ready in time
+const CACHE_DAEMON_TIMEOUT = 30000;
+const CACHE_DAEMON_RESPAWN_DELAY = 5000;
+
+const pool = [];
 
 exports.install = function () {
 
     ROUTE('/');
     WEBSOCKET('/', socket, ['raw']);
 
+    if (CACHE_DAEMON) {
+        startCacheDaemon(fillPool);
+    } else {
+        fillPool();
+    }
+
 };
 
-function socket() {
+// Start the cache daemon and call ready() once it accepts sessions,
+// the daemon is started again when it stops
+function startCacheDaemon(ready) {
 
-    this.encodedecode = false;
-    this.autodestroy();
+    let called = false;
+    const callReady = function () {
+        if (!called) {
+            called = true;
+            ready();
+        }
+    };
+    const timeout = setTimeout(callReady, CACHE_DAEMON_TIMEOUT);
 
-    this.on('open', function (client) {
+    const daemon = childProcess.spawn('python3', ['cache_daemon.py'], {
+        cwd: process.env.PWD,
+        env: process.env,
+        stdio: ['ignore', 'pipe', 'inherit']
+    });
+
+    daemon.stdout.on('data', function (data) {
+        process.stdout.write(data);
+        if (data.toString().indexOf('Cache daemon ready') !== -1) {
+            clearTimeout(timeout);
+            callReady();
+        }
+    });
 
-        // Spawn terminal
-        client.tty = Pty.spawn('python3', ['run.py'], {
+    daemon.on('exit', function (code) {
+        console.log("Cache daemon stopped with code " + code);
+        clearTimeout(timeout);
+        callReady();
+        setTimeout(function () {
+            startCacheDaemon(function () {});
+        }, CACHE_DAEMON_RESPAWN_DELAY);
+    });
+}
+
+// Spawn terminal - output is kept until a client is attached
+function spawnSession() {
+
+    const session = {
+        tty: Pty.spawn('python3', ['run.py'], {
             name: 'xterm-color',
             cols: 80,
             rows: 24,
             cwd: process.env.PWD,
             env: process.env
-        });
+        }),
+        output: [],
+        client: null,
+        started: Date.now()
+    };
 
-        client.tty.on('exit', function (code, signal) {
-            client.tty = null;
-            client.close();
+    session.tty.on('data', function (data) {
+        if (session.client) {
+            session.client.send(data);
+        } else {
+            session.output.push(data);
+        }
+    });
+
+    session.tty.on('exit', function (code, signal) {
+        const index = pool.indexOf(session);
+        if (index !== -1) {
+            pool.splice(index, 1);
+            setTimeout(fillPool, POOL_RESPAWN_DELAY);
+        }
+        if (session.client) {
+            session.client.tty = null;
+            session.client.close();
             console.log("Process killed");
-        });
+        }
+    });
+
+    return session;
+}
+
+// Start sessions until the pool is full, restart the ones idle for too long
+function fillPool() {
+
+    const now = Date.now();
+    pool.filter(function (session) {
+        return now - session.started > POOL_MAX_IDLE;
+    }).forEach(function (session) {
+        pool.splice(pool.indexOf(session), 1);
+        session.tty.kill(9);
+    });
+
+    while (pool.length < POOL_SIZE) {
+        pool.push(spawnSession());
+    }
+}
+
+// Take a session from the pool (or start a new one when the pool is
+// empty) and refill the pool in the background
+function takeSession() {
+
+    const now = Date.now();
+    let session = null;
+    while (pool.length && !session) {
+        session = pool.shift();
+        if (now - session.started > POOL_MAX_IDLE) {
+            session.tty.kill(9);
+            session = null;
+        }
+    }
+
+    setImmediate(fillPool);
+    return session || spawnSession();
+}
 
-        client.tty.on('data', function (data) {
+if (POOL_SIZE > 0) {
+    setInterval(fillPool, POOL_MAX_IDLE / 2).unref();
+}
+
+function socket() {
+
+    this.encodedecode = false;
+    this.autodestroy();
+
+    this.on('open', function (client) {
+
+        // Attach terminal and send everything it printed so far
+        const session = takeSession();
+        session.client = client;
+        client.tty = session.tty;
+        session.output.forEach(function (data) {
             client.send(data);
         });
+        session.output = [];
 
     });
 
@@ -51,10 +181,10 @@ function socket() {
 
 if (process.env.CREDS != null) {
     console.log("Creating creds.json file.");
-    fs.writeFile('creds.json', process.env.CREDS, 'utf8', function (err) {
-        if (err) {
-            console.log('Error writing file: ', err);
-            socket.emit("console_output", "Error saving credentials: " + err);
-        }
-    });
-}
\ No newline at end of file
+    // Written before the pool is filled, pooled sessions read it at startup
+    try {
+        fs.writeFileSync('creds.json', process.env.CREDS, 'utf8');
+    } catch (err) {
+        console.log('Error writing file: ', err);
+    }
+}
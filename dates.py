@@ -0,0 +1,37 @@
+# Fast decoding of expense dates - dates are stored in the sheet as
+# YYYY-MM-DD text and are decoded once into packed integers YYYYMMDD,
+# so filtering by year or month is plain integer arithmetic
+from datetime import datetime  # for dates in unexpected formats
+
+
+# Decode YYYY-MM-DD text into packed integer YYYYMMDD
+def pack_date(date_text):
+    # Fast path for dates written by the application - days after the
+    # 28th are checked by the slow path, they don't exist in every month
+    if len(date_text) == 10 and date_text[4] == '-' and date_text[7] == '-':
+        try:
+            packed_date = int(date_text[:4] + date_text[5:7] + date_text[8:])
+        except ValueError:
+            packed_date = 0
+        month, day = packed_date // 100 % 100, packed_date % 100
+        if 1 <= month <= 12 and 1 <= day <= 28:
+            return packed_date
+    # Slow path, raises ValueError for text which is not a date
+    expense_date = datetime.strptime(date_text.strip(), '%Y-%m-%d')
+    return (expense_date.year * 10000 + expense_date.month * 100
+            + expense_date.day)
+
+
+# Year of the packed date
+def packed_year(packed_date):
+    return packed_date // 10000
+
+
+# Month of the packed date
+def packed_month(packed_date):
+    return packed_date // 100 % 100
+
+
+# Packed year and month YYYYMM, for comparing whole months
+def packed_year_month(packed_date):
+    return packed_date // 100
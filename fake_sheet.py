@@ -0,0 +1,312 @@
+# Fake spreadsheet and worksheets kept in memory - used instead of Google
+# Sheets document when environment variable EXPENSE_FAKE_SHEET is set, for
+# testing without network access and credentials. The worksheets are
+# saved to the JSON file named by the variable (title -> rows), so the
+# data is kept between sessions.
+#
+# Slow and refused requests can be simulated with environment variables:
+#     EXPENSE_FAKE_LATENCY = 0.5   # seconds added to every request
+#     EXPENSE_FAKE_QUOTA = 60      # requests per minute before 429 errors
+#     EXPENSE_FAKE_ERRORS = 0.1    # share of requests failing with 503
+import json  # for reading and writing the rows file
+import os  # for reading environment variables and replacing files
+import random  # for simulated server errors
+import re  # for reading A1 ranges
+import threading  # for requests made from many threads
+import time  # for simulated latency and quota
+from collections import deque  # for times of recent requests
+
+# Header row of the expenses worksheet
+HEADER = ['Amount', 'Category', 'Date']
+
+# Columns of the worksheet, for reading A1 ranges
+COLUMN_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Spreadsheets opened in this process by the name in EXPENSE_FAKE_SHEET,
+# every open of the same name shares the data like the real document.
+# Spreadsheets kept only in memory can be put here before they are opened
+OPENED = {}
+
+
+# Response of a refused request, has the status code like the response
+# of gspread.exceptions.APIError
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+# Error of a refused request
+class FakeAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f'{status_code}: {message}')
+        self.response = FakeResponse(status_code)
+
+
+# Cell returned by find()
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+# Fake spreadsheet - has the gspread spreadsheet methods used by the
+# program. Latency, quota and errors are shared by all its worksheets
+class FakeSpreadsheet:
+    def __init__(self, path=None, latency=0, quota=0, error_rate=0,
+                 sheets=None):
+        self.path = path
+        self.latency = latency
+        self.quota = quota
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.request_times = deque()
+        # Number of calls of every method, for checking and benchmarks
+        self.calls = {}
+        self.sheets = {}
+        for title, rows in (sheets or self._load()).items():
+            self.sheets[title] = FakeWorksheet(rows, title, self)
+
+    # Fake spreadsheet configured by environment variables
+    @classmethod
+    def from_environment(cls):
+        path = os.environ['EXPENSE_FAKE_SHEET']
+        if path not in OPENED:
+            OPENED[path] = cls(
+                path=path,
+                latency=float(os.environ.get('EXPENSE_FAKE_LATENCY', 0)),
+                quota=int(os.environ.get('EXPENSE_FAKE_QUOTA', 0)),
+                error_rate=float(os.environ.get('EXPENSE_FAKE_ERRORS', 0)))
+        return OPENED[path]
+
+    def worksheet(self, title):
+        self._request('worksheet')
+        return self.sheets[title]
+
+    def worksheets(self):
+        self._request('worksheets')
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self._request('add_worksheet')
+        with self.lock:
+            self.sheets[title] = FakeWorksheet([], title, self)
+            self._save()
+        return self.sheets[title]
+
+    # Count the call, wait for the simulated latency and refuse the
+    # request when the quota is used up or a server error is simulated
+    def _request(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            now = time.monotonic()
+            while self.request_times and self.request_times[0] <= now - 60:
+                self.request_times.popleft()
+            over_quota = self.quota and len(self.request_times) >= self.quota
+            if not over_quota:
+                self.request_times.append(now)
+        if self.latency:
+            time.sleep(self.latency)
+        if over_quota:
+            raise FakeAPIError(429, 'Quota exceeded')
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeAPIError(503, 'The service is currently unavailable')
+
+    # Worksheets saved by the previous session, a list of rows is the
+    # expenses worksheet. New file has empty expenses worksheet
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as sheets_file:
+                data = json.load(sheets_file)
+        except (TypeError, OSError, ValueError):
+            data = {}
+        if isinstance(data, list):
+            data = {'expenses': data}
+        return data or {'expenses': [HEADER]}
+
+    # Save all the worksheets, called with the lock held
+    def _save(self):
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as sheets_file:
+            json.dump({title: sheet.rows
+                       for title, sheet in self.sheets.items()}, sheets_file)
+        os.replace(temp_path, self.path)
+
+
+# Fake worksheet - has the gspread worksheet methods used by the
+# program. Rows are lists of text, like get_all_values() returns them.
+# A worksheet created on its own gets its own spreadsheet without a file
+class FakeWorksheet:
+    def __init__(self, rows=None, title='expenses', spreadsheet=None,
+                 **options):
+        self.title = title
+        self.spreadsheet = spreadsheet or FakeSpreadsheet(**options)
+        self.lock = self.spreadsheet.lock
+        if rows is None:
+            rows = [HEADER]
+        self.rows = [[str(value) for value in row] for row in rows]
+        if spreadsheet is None:
+            self.spreadsheet.sheets = {title: self}
+
+    # Number of calls of every method
+    @property
+    def calls(self):
+        return self.spreadsheet.calls
+
+    def get_all_values(self):
+        self._request('get_all_values')
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+    def get_all_records(self):
+        self._request('get_all_records')
+        with self.lock:
+            header = self.rows[0]
+            return [dict(zip(header, [_number(value) for value in row]))
+                    for row in self.rows[1:]]
+
+    def get_values(self, range_name):
+        self._request('get_values')
+        with self.lock:
+            return self._read_range(range_name)
+
+    def batch_get(self, ranges):
+        self._request('batch_get')
+        with self.lock:
+            return [self._read_range(range_name) for range_name in ranges]
+
+    def find(self, query):
+        self._request('find')
+        with self.lock:
+            for row_number, row in enumerate(self.rows, start=1):
+                for col, value in enumerate(row, start=1):
+                    if value == str(query):
+                        return FakeCell(row_number, col, value)
+        return None
+
+    def append_row(self, values, **kwargs):
+        self._request('append_row')
+        with self.lock:
+            return self._append([values])
+
+    def append_rows(self, values, **kwargs):
+        self._request('append_rows')
+        with self.lock:
+            return self._append(values)
+
+    def insert_row(self, values, index=1, **kwargs):
+        self._request('insert_row')
+        with self.lock:
+            self.rows.insert(index - 1, [str(value) for value in values])
+            self._save()
+
+    def delete_rows(self, start_index, end_index=None):
+        self._request('delete_rows')
+        with self.lock:
+            del self.rows[start_index - 1:end_index or start_index]
+            self._save()
+
+    # Sort rows of the range by the columns of the specs, (column, 'asc'
+    # or 'des'). Text is compared like in Google Sheets - ignoring case,
+    # with empty cells last
+    def sort(self, *specs, range=None):
+        self._request('sort')
+        with self.lock:
+            first_row, _ = _range_start(range or 'A2')
+            last_row = int(range.rpartition(':')[2][1:]) if range \
+                else len(self.rows)
+            rows = self.rows[first_row - 1:last_row]
+            for col, order in reversed(specs):
+                filled = [row for row in rows if _cell(row, col)]
+                filled.sort(key=lambda row: _cell(row, col).lower(),
+                            reverse=order == 'des')
+                rows = filled + [row for row in rows if not _cell(row, col)]
+            self.rows[first_row - 1:last_row] = rows
+            self._save()
+
+    def update_cell(self, row, col, value):
+        self._request('update_cell')
+        with self.lock:
+            self._write(row, col, [[value]])
+            self._save()
+
+    def update(self, range_name, values, **kwargs):
+        self._request('update')
+        with self.lock:
+            row, col = _range_start(range_name)
+            self._write(row, col, values)
+            self._save()
+
+    def batch_update(self, data, **kwargs):
+        self._request('batch_update')
+        with self.lock:
+            for update in data:
+                row, col = _range_start(update['range'])
+                self._write(row, col, update['values'])
+            self._save()
+
+    def _request(self, method):
+        self.spreadsheet._request(method)
+
+    # Add rows after the last row and return the range they were written
+    # to, like the response of the Sheets API append request
+    def _append(self, values):
+        first_row = len(self.rows) + 1
+        self.rows.extend([str(value) for value in row] for row in values)
+        self._save()
+        width = max([len(row) for row in values] + [1])
+        updated_range = (f"'{self.title}'!A{first_row}:"
+                         f"{COLUMN_LETTERS[width - 1]}{len(self.rows)}")
+        return {'spreadsheetId': 'fake',
+                'updates': {'updatedRange': updated_range,
+                            'updatedRows': len(values)}}
+
+    # Rows of an A1 range such as A5:C or A5:C10, missing cells are left
+    # out like in the Sheets API
+    def _read_range(self, range_name):
+        match = re.fullmatch(r"(?:.*!)?([A-Z])(\d+)(?::([A-Z])(\d*))?",
+                             range_name)
+        first_col = COLUMN_LETTERS.index(match.group(1))
+        last_col = COLUMN_LETTERS.index(match.group(3) or match.group(1))
+        first_row = int(match.group(2))
+        last_row = int(match.group(4) or len(self.rows))
+        values = [row[first_col:last_col + 1]
+                  for row in self.rows[first_row - 1:last_row]]
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    # Write values starting at the cell, new rows are added when needed
+    def _write(self, row, col, values):
+        for row_offset, row_values in enumerate(values):
+            while len(self.rows) < row + row_offset:
+                self.rows.append([])
+            target = self.rows[row + row_offset - 1]
+            for col_offset, value in enumerate(row_values):
+                while len(target) < col + col_offset:
+                    target.append('')
+                target[col + col_offset - 1] = str(value)
+
+    def _save(self):
+        self.spreadsheet._save()
+
+
+# Row and column of the first cell of an A1 range
+def _range_start(range_name):
+    match = re.match(r"(?:.*!)?([A-Z])(\d+)", range_name)
+    return int(match.group(2)), COLUMN_LETTERS.index(match.group(1)) + 1
+
+
+# Text of the cell in the column, empty when the row is shorter
+def _cell(row, col):
+    return row[col - 1] if len(row) >= col else ''
+
+
+# Numbers in get_all_records() are returned as numbers
+def _number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
@@ -0,0 +1,255 @@
+# Import expenses from a CSV file (for example a bank export) into
+# the Google Sheets document - into the expenses worksheet, or with
+# EXPENSE_STORAGE=partitioned into the worksheet of the year of every
+# expense (see partitions.py).
+#
+# The file is read row by row and valid expenses are written in large
+# chunks with one bulk append for every worksheet, so memory use doesn't
+# depend on the size of the file. After every chunk the progress is
+# saved next to the CSV file, and running the same command again
+# continues from there. Before a chunk is sent it's recorded in the
+# progress file as pending - when the import stopped while it was sent,
+# the rows which aren't in the sheet yet are sent from there, so no
+# expense is imported twice.
+#
+# Usage:
+#     python3 import_expenses.py bank.csv --amount-column Amount \
+#         --category-column Category --date-column Date
+import argparse  # for reading command line arguments
+import csv  # for reading CSV files
+import json  # for reading and writing the progress file
+import os  # for removing the progress file when import is done
+import sys  # for interacting with the system
+from datetime import datetime  # for reading dates in other formats
+from partitions import PartitionedStore, expense_year  # for the\
+# worksheets of the years
+from sheets import EXPENSES_WORKSHEET, open_expenses_spreadsheet  # for\
+# Google Sheets document
+from store import STORAGE_BACKEND  # for the configured storage backend
+from validation import parse_amount, parse_category, parse_date  # for\
+# checking expenses with the same rules as add_expense
+
+# Number of expenses sent to Google Sheets document in one request
+CHUNK_SIZE = 5000
+
+
+# Read command line arguments
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Import expenses from a CSV file into the '
+                    'Google Sheets document.')
+    parser.add_argument('csv_file', help='path to the CSV file')
+    parser.add_argument('--amount-column', default='Amount',
+                        help='column with expense amount (default: Amount)')
+    parser.add_argument('--category-column', default='Category',
+                        help='column with expense category '
+                             '(default: Category)')
+    parser.add_argument('--date-column', default='Date',
+                        help='column with expense date (default: Date)')
+    parser.add_argument('--date-format', default='%Y-%m-%d',
+                        help='format of dates in the file, for example '
+                             '%%d/%%m/%%Y (default: %%Y-%%m-%%d)')
+    parser.add_argument('--delimiter', default=',',
+                        help='column delimiter (default: ,)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f'expenses written in one request '
+                             f'(default: {CHUNK_SIZE})')
+    return parser.parse_args(argv)
+
+
+# Check one line of the CSV file and return it as a row for
+# Google Sheets document
+def convert_row(line, arguments):
+    amount = parse_amount(line[arguments.amount_column] or '')
+    category = parse_category(line[arguments.category_column] or '')
+    date_input = (line[arguments.date_column] or '').strip()
+    if arguments.date_format != '%Y-%m-%d':
+        try:
+            date_input = datetime.strptime(
+                date_input, arguments.date_format
+            ).strftime('%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f'Incorrect date format. Please use '
+                             f'{arguments.date_format}.')
+    date = parse_date(date_input)
+    return [int(amount), category, str(date)]
+
+
+# Read number of the last imported line from the progress file. A file
+# which can't be read stops the import, starting again from the first
+# line would import the expenses twice
+def load_progress(progress_path):
+    try:
+        with open(progress_path, encoding='utf-8') as progress_file:
+            return json.load(progress_file)
+    except FileNotFoundError:
+        return {'line': 0, 'imported': 0, 'rejected': 0, 'rejected_size': 0}
+    except (OSError, ValueError):
+        sys.exit(f'Progress file {progress_path} can\'t be read. Remove it '
+                 f'to import the file from the first line.')
+
+
+# Save number of the last imported line to the progress file - write to
+# temporary file first and then replace the old one, so an interrupted
+# save never breaks the progress file
+def save_progress(progress_path, progress):
+    temp_path = f'{progress_path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as progress_file:
+        json.dump(progress, progress_file)
+    os.replace(temp_path, progress_path)
+
+
+# Worksheets the expenses go to - returns a function which splits
+# a chunk into blocks of (worksheet title, rows). With
+# EXPENSE_STORAGE=partitioned every year goes to its own worksheet,
+# which is created when it's missing
+def open_destination(spreadsheet, backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        sys.exit('Expenses are read from the SQLite database '
+                 '(EXPENSE_STORAGE=sqlite), expenses imported into Google '
+                 'Sheets wouldn\'t be shown. Import them with '
+                 'EXPENSE_STORAGE=sheets into an empty sheet and copy them '
+                 'with python3 sqlite_store.py.')
+    if backend != 'partitioned':
+        return lambda chunk: [(EXPENSES_WORKSHEET, chunk)] if chunk else []
+
+    partitions = PartitionedStore(spreadsheet)
+    try:
+        partitions.find_worksheets()
+    except RuntimeError as error:
+        sys.exit(str(error))
+
+    def split_by_year(chunk):
+        rows_by_year = {}
+        for row in chunk:
+            rows_by_year.setdefault(expense_year(row[2]), []).append(row)
+        return [(partitions.partition_worksheet(year).title, rows)
+                for year, rows in sorted(rows_by_year.items())]
+    return split_by_year
+
+
+# Write one chunk of expenses and the lines rejected in it, and
+# remember how far the import got. The chunk is saved as pending first
+def flush_chunk(spreadsheet, destination, chunk, rejected, line_number,
+                progress, progress_path, rejected_file):
+    progress['pending'] = {
+        'line': line_number, 'rejected': rejected,
+        'blocks': [{'worksheet': title, 'rows': rows}
+                   for title, rows in destination(chunk)]}
+    save_progress(progress_path, progress)
+    rejected_file.writelines(rejected)
+    rejected_file.flush()
+    for block in progress['pending']['blocks']:
+        spreadsheet.worksheet(block['worksheet']).append_rows(block['rows'])
+    finish_chunk(progress, rejected_file)
+    save_progress(progress_path, progress)
+    print(f'Imported {progress["imported"]} expenses '
+          f'(line {line_number})')
+
+
+# Count the pending chunk as imported
+def finish_chunk(progress, rejected_file):
+    pending = progress.pop('pending')
+    progress['imported'] += sum(len(block['rows'])
+                                for block in pending['blocks'])
+    progress['rejected'] += len(pending['rejected'])
+    progress['line'] = pending['line']
+    progress['rejected_size'] = rejected_file.tell()
+
+
+# Finish the chunk which was sent when the previous run stopped - its
+# rejected lines are written again, and its blocks which aren't in
+# their worksheets yet are sent
+def resume_chunk(spreadsheet, progress, rejected_file):
+    rejected_size = progress.setdefault('rejected_size', rejected_file.tell())
+    rejected_file.truncate(rejected_size)
+    rejected_file.seek(rejected_size)
+    pending = progress.get('pending')
+    if pending is None:
+        return
+    rejected_file.writelines(pending['rejected'])
+    rejected_file.flush()
+    for block in pending['blocks']:
+        worksheet = spreadsheet.worksheet(block['worksheet'])
+        if not block_uploaded(worksheet, block['rows']):
+            worksheet.append_rows(block['rows'])
+    finish_chunk(progress, rejected_file)
+
+
+# Are the rows in the worksheet - looks for the first and last of them
+# the right number of rows apart, from the end of the worksheet, as rows
+# of other sessions may have been appended after them
+def block_uploaded(worksheet, block):
+    first = [str(value) for value in block[0]]
+    last = [str(value) for value in block[-1]]
+    count = len(block)
+    rows = [(list(row) + [''] * 3)[:3]
+            for row in worksheet.get_values('A2:C')]
+    for start in range(len(rows) - count, -1, -1):
+        if rows[start] == first and rows[start + count - 1] == last:
+            return True
+    return False
+
+
+# Import expenses from the CSV file
+def import_expenses(spreadsheet, arguments):
+    progress_path = f'{arguments.csv_file}.progress'
+    rejected_path = f'{arguments.csv_file}.rejected'
+    resuming = os.path.exists(progress_path)
+    progress = load_progress(progress_path)
+    destination = open_destination(spreadsheet)
+
+    with open(arguments.csv_file, newline='', encoding='utf-8-sig') \
+            as csv_file, \
+            open(rejected_path, 'a' if resuming else 'w',
+                 encoding='utf-8') as rejected_file:
+        resume_chunk(spreadsheet, progress, rejected_file)
+        save_progress(progress_path, progress)
+        if progress['line']:
+            print(f'Resuming import after line {progress["line"]}')
+        reader = csv.DictReader(csv_file, delimiter=arguments.delimiter)
+        columns = [arguments.amount_column, arguments.category_column,
+                   arguments.date_column]
+        missing = [name for name in columns
+                   if name not in (reader.fieldnames or [])]
+        if missing:
+            sys.exit(f'Column(s) not found in {arguments.csv_file}: '
+                     f'{", ".join(missing)}')
+
+        chunk = []
+        rejected = []
+        line_number = 0
+        for line_number, line in enumerate(reader, start=1):
+            # Skip lines imported by the previous run
+            if line_number <= progress['line']:
+                continue
+            try:
+                chunk.append(convert_row(line, arguments))
+            except ValueError as error:
+                rejected.append(f'line {line_number}: {error}\n')
+            if len(chunk) + len(rejected) >= arguments.chunk_size:
+                flush_chunk(spreadsheet, destination, chunk, rejected,
+                            line_number, progress, progress_path,
+                            rejected_file)
+                chunk = []
+                rejected = []
+        flush_chunk(spreadsheet, destination, chunk, rejected,
+                    max(line_number, progress['line']), progress,
+                    progress_path, rejected_file)
+
+    print(f'\nImport finished: {progress["imported"]} expenses imported, '
+          f'{progress["rejected"]} lines rejected')
+    if progress['rejected']:
+        print(f'Rejected lines are listed in {rejected_path}')
+    os.remove(progress_path)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.chunk_size < 1:
+        sys.exit('Chunk size has to be a positive number.')
+    import_expenses(open_expenses_spreadsheet(), arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Write journal - new and edited expenses are written to this local
+# append-only file first, so the user doesn't wait for Google Sheets.
+# The store sends them to the sheet in the background and marks them
+# done. Entries not marked done (for example after a crash) are sent
+# again when the next session starts.
+#
+# Every line is one JSON entry:
+#     {"seq": 1, "op": "add", "first_id": 41, "rows": [[12, "Food", ...]]}
+#     {"seq": 2, "op": "update", "id": 7, "changes": {"1": 15},
+#      "old": ["12", "Food", "2024-03-05"]}
+#     {"done": [1, 2]}
+import json  # for reading and writing journal entries
+import os  # for reading environment variables and syncing the file
+
+try:
+    import fcntl  # for making sure only one process uses the journal
+except ImportError:
+    # Windows - the journal isn't locked
+    fcntl = None
+
+# Location of the journal file, can be changed with environment variable
+JOURNAL_PATH = os.environ.get('EXPENSE_JOURNAL_PATH',
+                              'expenses_journal.jsonl')
+
+
+class WriteJournal:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        # seq -> entry of the entries not sent to the sheet yet, in order
+        self.entries = {}
+        self.next_seq = 1
+        self.lock_file = None
+
+    # Lock the journal for this process - returns False when another
+    # running session uses it, entries of a running session must not be
+    # sent again by this one
+    def acquire(self):
+        if fcntl is None:
+            return True
+        lock_file = open(f'{self.path}.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Lock is held until the process ends
+        self.lock_file = lock_file
+        return True
+
+    # Read entries which were not marked done by the previous sessions
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as journal_file:
+                lines = journal_file.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Line cut short by a crash while it was written - the
+                # user wasn't told the expense was saved
+                continue
+            if 'done' in entry:
+                for seq in entry['done']:
+                    self.entries.pop(seq, None)
+            else:
+                self.entries[entry['seq']] = entry
+                self.next_seq = max(self.next_seq, entry['seq'] + 1)
+        # Write the file again with the pending entries only, so a line
+        # cut short doesn't spoil the line appended after it
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as journal_file:
+            for entry in self.entries.values():
+                journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temp_path, self.path)
+
+    # Add an entry and make sure it's on disk before returning
+    def record(self, entry):
+        entry = dict(entry, seq=self.next_seq)
+        self.next_seq += 1
+        self._append(entry)
+        self.entries[entry['seq']] = entry
+        return entry
+
+    # Entries not sent to the sheet yet, oldest first
+    def pending(self):
+        return list(self.entries.values())
+
+    # Mark entries sent to the sheet - the file is emptied when nothing
+    # is left to send, so it doesn't grow
+    def mark_done(self, entries):
+        for entry in entries:
+            self.entries.pop(entry['seq'], None)
+        if self.entries:
+            self._append({'done': [entry['seq'] for entry in entries]})
+        else:
+            with open(self.path, 'w', encoding='utf-8'):
+                pass
+
+    # Append one line and flush it to disk
+    def _append(self, entry):
+        with open(self.path, 'a', encoding='utf-8') as journal_file:
+            journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
@@ -0,0 +1,197 @@
+# Session metrics - when environment variable EXPENSE_METRICS names a
+# file, every Sheets request, menu operation and startup phase of the
+# session is appended to it as one JSON line, so the files of many
+# sessions can be put together and searched for slow requests:
+#     {"session": "812-1760000000", "type": "sheets", "name": "get_values",
+#      "seconds": 0.21, "kind": "read", "rows": 3, "attempt": 0,
+#      "status": "ok", "operation": "month_statement", "at": 12.5}
+#     {"session": "812-1760000000", "type": "operation",
+#      "name": "month_statement", "seconds": 6.4, "input_seconds": 6.1,
+#      "calls": 1, "rows": 3, "at": 12.7}
+#     {"session": "812-1760000000", "type": "phase", "name": "authorize",
+#      "seconds": 0.35, "at": 0.9}
+# The last line of a session has its totals ("type": "session").
+# Time spent waiting for the user to type is in input_seconds, so the
+# time the program worked is seconds - input_seconds.
+#
+# When the variable isn't set nothing is measured, callers check
+# ENABLED before measuring anything.
+#
+# Summary of the slowest requests and operations of a metrics file:
+#     python3 metrics.py expenses_metrics.jsonl
+import atexit  # for writing the totals when the session ends
+import builtins  # for measuring time spent waiting for the user
+import json  # for writing and reading metric lines
+import os  # for reading environment variables
+import sys  # for interacting with the system
+import threading  # for requests made from many threads
+import time  # for measuring time
+from contextlib import contextmanager  # for measuring blocks of code
+
+PATH = os.environ.get('EXPENSE_METRICS')
+ENABLED = bool(PATH)
+
+# Time when this module was imported, and the id of this session
+START = time.perf_counter()
+SESSION = f'{os.getpid()}-{int(time.time())}'
+
+# Sheets methods which return rows
+ROW_READS = ('get_all_values', 'get_all_records', 'get_values')
+
+LOCK = threading.Lock()
+METRICS_FILE = None
+
+# Menu operation running now, with the requests made and the time spent
+# waiting for the user while it runs
+CURRENT = {'operation': None, 'calls': 0, 'rows': 0, 'input_seconds': 0}
+
+# Totals of the session
+TOTALS = {'calls': 0, 'rows': 0, 'errors': 0}
+
+
+# Append one metric line to the metrics file
+def record(record_type, name, seconds, **fields):
+    line = {'session': SESSION, 'type': record_type, 'name': name,
+            'seconds': round(seconds, 6), **fields,
+            'at': round(time.perf_counter() - START, 3)}
+    global METRICS_FILE
+    with LOCK:
+        if METRICS_FILE is None:
+            METRICS_FILE = open(PATH, 'a', encoding='utf-8', buffering=1)
+        METRICS_FILE.write(json.dumps(line) + '\n')
+
+
+# Send one Sheets request and record how long it took and how many rows
+# it transferred
+def measure_request(kind, attempt, function, *args, **kwargs):
+    name = getattr(function, '__name__', str(function))
+    started = time.perf_counter()
+    status = 'ok'
+    result = None
+    try:
+        result = function(*args, **kwargs)
+        return result
+    except Exception as error:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', type(error).__name__)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        rows = row_count(name, args, result)
+        with LOCK:
+            CURRENT['calls'] += 1
+            CURRENT['rows'] += rows
+            TOTALS['calls'] += 1
+            TOTALS['rows'] += rows
+            TOTALS['errors'] += status != 'ok'
+        record('sheets', name, seconds, kind=kind, rows=rows,
+               attempt=attempt, status=status,
+               operation=CURRENT['operation'])
+
+
+# Rows read or written by one Sheets request
+def row_count(name, args, result):
+    if result is not None and name in ROW_READS:
+        return len(result)
+    if result is not None and name == 'batch_get':
+        return sum(len(values) for values in result)
+    if name in ('append_rows', 'batch_update'):
+        return len(args[0])
+    if name in ('append_row', 'insert_row', 'update_cell'):
+        return 1
+    return 0
+
+
+# Record one menu operation - requests made while it runs (also by
+# background threads) are counted with it
+@contextmanager
+def operation(name):
+    if not ENABLED:
+        yield
+        return
+    with LOCK:
+        CURRENT.update(operation=name, calls=0, rows=0, input_seconds=0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        with LOCK:
+            fields = {key: CURRENT[key]
+                      for key in ('input_seconds', 'calls', 'rows')}
+            CURRENT['operation'] = None
+        fields['input_seconds'] = round(fields['input_seconds'], 6)
+        record('operation', name, seconds, **fields)
+
+
+# Measure time spent waiting for the user in input(), so it can be told
+# apart from the time the program works
+def watch_input():
+    if not ENABLED:
+        return
+    original_input = builtins.input
+
+    def timed_input(*args):
+        started = time.perf_counter()
+        try:
+            return original_input(*args)
+        finally:
+            with LOCK:
+                CURRENT['input_seconds'] += time.perf_counter() - started
+    builtins.input = timed_input
+
+
+# Totals of the session, written when it ends
+def finish():
+    record('session', SESSION, time.perf_counter() - START, **TOTALS)
+
+
+if ENABLED:
+    atexit.register(finish)
+
+
+# Read metric lines of the files, lines cut short are skipped
+def read_metrics(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as metrics_file:
+            for line in metrics_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+# Print number, total and slowest times of every kind of request,
+# operation and phase, the slowest in total first. Operations are
+# measured without the time spent waiting for the user
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        sys.exit('Usage: python3 metrics.py METRICS_FILE...')
+    groups = {}
+    sessions = set()
+    for line in read_metrics(paths):
+        sessions.add(line['session'])
+        if line['type'] == 'session':
+            continue
+        seconds = line['seconds'] - line.get('input_seconds', 0)
+        group = groups.setdefault((line['type'], line['name']),
+                                  {'times': [], 'rows': 0, 'errors': 0})
+        group['times'].append(seconds)
+        group['rows'] += line.get('rows', 0)
+        group['errors'] += line.get('status', 'ok') != 'ok'
+
+    print(f'{len(sessions)} sessions\n')
+    print(f'{"Type":<10}{"Name":<24}{"Count":>7}{"Total s":>10}'
+          f'{"Mean ms":>10}{"p95 ms":>10}{"Rows":>10}{"Errors":>8}')
+    for (record_type, name), group in sorted(
+            groups.items(), key=lambda item: -sum(item[1]['times'])):
+        times = sorted(group['times'])
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f'{record_type:<10}{name:<24}{len(times):>7}'
+              f'{sum(times):>10.2f}{sum(times) / len(times) * 1000:>10.1f}'
+              f'{p95 * 1000:>10.1f}{group["rows"]:>10}{group["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
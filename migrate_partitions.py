@@ -0,0 +1,87 @@
+# Migrate expenses from the single expenses worksheet into one worksheet
+# per year (see partitions.py).
+#
+# Every year gets a new worksheet filled with one bulk append per chunk.
+# The expenses worksheet is left as it is, so nothing is lost when the
+# migration is stopped - delete the new partition worksheets and run it
+# again. Rows without a valid date or amount are listed and not copied.
+#
+# Usage:
+#     python3 migrate_partitions.py [--dry-run]
+# and then set environment variable EXPENSE_STORAGE=partitioned
+import argparse  # for reading command line arguments
+import sys  # for interacting with the system
+from partitions import (HEADER, LEGACY_WORKSHEET, expense_year,
+                        find_partitions, partition_title)  # for the\
+# partition worksheets
+from sheets import open_expenses_spreadsheet  # for Google Sheets document
+
+# Number of expenses sent to Google Sheets document in one request
+CHUNK_SIZE = 5000
+
+
+# Read command line arguments
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        description='Copy expenses from the expenses worksheet into one '
+                    'worksheet per year.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the number of expenses of '
+                             'every year')
+    return parser.parse_args(argv)
+
+
+# Group rows of the expenses worksheet by year, return rows by year and
+# worksheet row numbers of the rows which can't be copied
+def group_by_year(rows):
+    rows_by_year = {}
+    invalid = []
+    for row_number, row in enumerate(rows, start=2):
+        row = (list(row) + ['', '', ''])[:3]
+        if not any(row):
+            continue
+        try:
+            amount = int(row[0])
+        except ValueError:
+            amount = None
+        year = expense_year(row[2])
+        if amount is None or not year:
+            invalid.append(row_number)
+            continue
+        rows_by_year.setdefault(year, []).append([amount, row[1], row[2]])
+    return rows_by_year, invalid
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    spreadsheet = open_expenses_spreadsheet()
+
+    existing = find_partitions(spreadsheet)
+    if existing and not arguments.dry_run:
+        titles = ', '.join(partition_title(year) for year in sorted(existing))
+        sys.exit(f'Partition worksheets already exist ({titles}). '
+                 f'Delete them to migrate again.')
+
+    rows = spreadsheet.worksheet(LEGACY_WORKSHEET).get_all_values()[1:]
+    rows_by_year, invalid = group_by_year(rows)
+
+    for year in sorted(rows_by_year):
+        year_rows = rows_by_year[year]
+        print(f'{partition_title(year)}: {len(year_rows)} expenses')
+        if arguments.dry_run:
+            continue
+        worksheet = spreadsheet.add_worksheet(
+            partition_title(year), rows=len(year_rows) + 1, cols=len(HEADER))
+        worksheet.append_rows([HEADER])
+        for start in range(0, len(year_rows), CHUNK_SIZE):
+            worksheet.append_rows(year_rows[start:start + CHUNK_SIZE])
+
+    if invalid:
+        print(f'Not copied, invalid amount or date in rows: '
+              f'{", ".join(str(row_number) for row_number in invalid)}')
+    if not arguments.dry_run:
+        print('Done. Set EXPENSE_STORAGE=partitioned to use the partitions.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+# Year-partitioned store - the expenses are kept in one worksheet per
+# year (expenses_2023, expenses_2024, ...) of the Google Sheets
+# document, so a statement for one year reads only the rows of that
+# year. Every partition is a store.LocalStore with its own replica and
+# write journal, loaded when a report needs its year. Reports of many
+# years load their partitions at the same time.
+#
+# Select it with environment variable EXPENSE_STORAGE=partitioned.
+# Expenses from the single expenses worksheet are copied into the
+# partitions with:
+#     python3 migrate_partitions.py
+import os  # for naming the files of the partitions
+import re  # for finding the partition worksheets
+import threading  # for loading partitions from many threads
+from concurrent.futures import ThreadPoolExecutor  # for loading many\
+# partitions at the same time
+from datetime import datetime  # for the partition of the current year
+from journal import JOURNAL_PATH, WriteJournal  # for writes not sent\
+# to the sheet yet
+from replica import REPLICA_PATH, decode_date  # for the replica files\
+# and the year of an expense
+from store import LocalStore  # for the expenses of one year
+
+# Header row of a new partition worksheet
+HEADER = ['Amount', 'Category', 'Date']
+
+# Title of the worksheet of one year, and of the worksheet used before
+# the expenses were partitioned
+PARTITION_TITLE = 'expenses_{year}'
+PARTITION_PATTERN = re.compile(r'expenses_(\d{4})')
+LEGACY_WORKSHEET = 'expenses'
+
+# Most partitions loaded at the same time
+MAX_LOADING = 8
+
+
+# Title of the worksheet of the year
+def partition_title(year):
+    return PARTITION_TITLE.format(year=year)
+
+
+# Worksheets of the partitions by year
+def find_partitions(spreadsheet):
+    partitions = {}
+    for worksheet in spreadsheet.worksheets():
+        match = PARTITION_PATTERN.fullmatch(worksheet.title)
+        if match:
+            partitions[int(match.group(1))] = worksheet
+    return partitions
+
+
+# File of one partition - expenses_replica.json becomes
+# expenses_replica_2024.json
+def partition_path(path, year):
+    root, extension = os.path.splitext(path)
+    return f'{root}_{year}{extension}'
+
+
+# Expense ids are made of the year of the partition and the id of the
+# row in the partition, for example '2024:17'
+def expense_id(year, row_id):
+    return f'{year}:{row_id}'
+
+
+def split_expense_id(row_id):
+    year, _, partition_id = row_id.partition(':')
+    return int(year), int(partition_id)
+
+
+# Year of the expense date (YYYY-MM-DD text)
+def expense_year(date_text):
+    return decode_date(str(date_text)) // 10000
+
+
+class PartitionedStore:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        # year -> worksheet of every partition in the spreadsheet
+        self.worksheets = {}
+        # year -> loaded LocalStore
+        self.partitions = {}
+        # Only one thread loads or creates partitions at a time
+        self.lock = threading.RLock()
+
+    # Find the partitions and load the one of the current year, other
+    # years are loaded when they are used
+    def load(self):
+        self.find_worksheets()
+        self._load_partitions([datetime.today().year])
+
+    # Find the partition worksheets - expenses left in the single
+    # expenses worksheet have to be migrated first
+    def find_worksheets(self):
+        self.worksheets = find_partitions(self.spreadsheet)
+        if not self.worksheets:
+            self._check_migrated()
+
+    # Find partitions created by other sessions and download rows added
+    # to the loaded ones. Returns dates of the new rows, or None when
+    # a partition was downloaded again or a new one was found
+    def refresh(self):
+        with self.lock:
+            years = set(self.worksheets)
+            self.worksheets.update(find_partitions(self.spreadsheet))
+            new_partition = set(self.worksheets) != years
+            partitions = list(self.partitions.values())
+        dates = []
+        for partition in partitions:
+            partition_dates = partition.refresh()
+            if partition_dates is None:
+                new_partition = True
+            else:
+                dates.extend(partition_dates)
+        return None if new_partition else dates
+
+    # Send writes of all the loaded partitions to the sheet
+    def flush(self):
+        for partition in list(self.partitions.values()):
+            partition.flush()
+
+    # Add new expenses to the partitions of their years, partitions of
+    # new years are created
+    def add_expenses(self, rows):
+        rows_by_year = {}
+        for row in rows:
+            rows_by_year.setdefault(expense_year(row[2]), []).append(row)
+        for year, year_rows in rows_by_year.items():
+            self._partition(year, create=True).add_expenses(year_rows)
+
+    # Save all changes of one expense - changes map column number
+    # (1 - 3) to the new value. When the date moves the expense to
+    # another year, it's added to the partition of that year and
+    # deleted from its old one
+    def update_expense(self, row_id, changes):
+        year, partition_id = split_expense_id(row_id)
+        partition = self._partition(year)
+        if partition is None:
+            raise KeyError(row_id)
+        if 3 not in changes or expense_year(changes[3]) == year:
+            partition.update_expense(partition_id, changes)
+            return
+
+        with partition.lock:
+            replica = partition.replica
+            row = list(replica.rows[replica.row_number(partition_id) - 2])
+        for column, value in changes.items():
+            row[column - 1] = value
+        self.add_expenses([row])
+        partition.delete_expense(partition_id)
+
+    # Expenses from the chosen month and year as dictionaries
+    def month_records(self, year, month):
+        partition = self._partition(year)
+        if partition is None:
+            return []
+        records = partition.month_records(year, month)
+        for record in records:
+            record['id'] = expense_id(year, record['id'])
+        return records
+
+    # Category totals for the chosen year, from its partition only
+    def year_totals(self, year):
+        partition = self._partition(year)
+        return partition.year_totals(year) if partition else {}
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        partition = self._partition(year)
+        return partition.month_totals(year, month) if partition else {}
+
+    # Category totals for every year with expenses, all the partitions
+    # are loaded at the same time
+    def totals_by_year(self):
+        partitions = self._load_partitions(self.worksheets)
+        totals = {}
+        for year in sorted(partitions):
+            totals.update(partitions[year].totals_by_year())
+        return totals
+
+    # Category totals of many periods at once - years, or [year, month]
+    # pairs for months. Partitions of the years are loaded at the same
+    # time
+    def period_totals(self, periods):
+        years = [period[0] if isinstance(period, (list, tuple)) else period
+                 for period in periods]
+        partitions = self._load_partitions(years)
+        return [partitions[year].period_totals([period])[0]
+                if year in partitions else {}
+                for year, period in zip(years, periods)]
+
+    # Category totals from the start date to the end date (both
+    # included, YYYY-MM-DD text), summed over the partitions of the
+    # years in the range
+    def range_totals(self, start, end):
+        years = range(int(start[:4]), int(end[:4]) + 1)
+        partitions = self._load_partitions(years)
+        totals = {}
+        for year in sorted(partitions):
+            for category, amount in partitions[year].range_totals(
+                    start, end).items():
+                totals[category] = totals.get(category, 0) + amount
+        return totals
+
+    # Worksheet of the partition of the year, created when it's missing.
+    # For writing to a partition without loading it (see
+    # import_expenses.py) - sessions which have the partition loaded
+    # download the new rows when they refresh
+    def partition_worksheet(self, year):
+        with self.lock:
+            if year not in self.worksheets:
+                self._create_partition(year)
+            return self.worksheets[year]
+
+    # Loaded partition of the year, None when the year has no partition.
+    # With create, a missing partition is created
+    def _partition(self, year, create=False):
+        with self.lock:
+            if create and year not in self.worksheets:
+                self._create_partition(year)
+            return self._load_partitions([year]).get(year)
+
+    # Load partitions of the years which have one, at the same time,
+    # return loaded partitions of the years by year
+    def _load_partitions(self, years):
+        with self.lock:
+            years = set(year for year in years if year in self.worksheets)
+            missing = [year for year in years if year not in self.partitions]
+            if len(missing) == 1:
+                self.partitions[missing[0]] = self._open(missing[0])
+            elif missing:
+                with ThreadPoolExecutor(min(len(missing),
+                                            MAX_LOADING)) as executor:
+                    loaded = executor.map(self._open, missing)
+                    self.partitions.update(zip(missing, loaded))
+            return {year: self.partitions[year] for year in years}
+
+    # Open and load the store of one partition, with its own replica
+    # and journal files
+    def _open(self, year):
+        partition = LocalStore(
+            self.worksheets[year],
+            WriteJournal(partition_path(JOURNAL_PATH, year)),
+            replica_path=partition_path(REPLICA_PATH, year))
+        partition.load()
+        return partition
+
+    # Add the worksheet of a new year - when another session created it
+    # at the same time, its worksheet is used. The header is written to
+    # the first row, which is safe to write again
+    def _create_partition(self, year):
+        try:
+            worksheet = self.spreadsheet.add_worksheet(
+                partition_title(year), rows=1000, cols=len(HEADER))
+        except Exception:
+            self.worksheets.update(find_partitions(self.spreadsheet))
+            if year not in self.worksheets:
+                raise
+            return
+        worksheet.batch_update([{'range': 'A1:C1', 'values': [HEADER]}])
+        self.worksheets[year] = worksheet
+
+    # Expenses left in the single expenses worksheet would be missing
+    # from the reports, so they have to be migrated first
+    def _check_migrated(self):
+        titles = [worksheet.title
+                  for worksheet in self.spreadsheet.worksheets()]
+        if LEGACY_WORKSHEET not in titles:
+            return
+        legacy = self.spreadsheet.worksheet(LEGACY_WORKSHEET)
+        if legacy.get_values('A2:C2'):
+            raise RuntimeError('Expenses are not partitioned by year yet, '
+                               'run python3 migrate_partitions.py first.')
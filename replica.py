@@ -0,0 +1,369 @@
+# Local replica of the expenses worksheet - keeps a copy of the Google
+# Sheets document on disk, so reports don't have to download the whole
+# sheet every time they are run
+import json  # for reading and writing the replica file
+import os  # for reading environment variables and replacing files
+import re  # for reading the range of appended rows
+from datetime import datetime, timedelta  # for tracking sync times
+from dates import pack_date, packed_year_month  # for decoding dates
+
+# Location of the replica file, can be changed with environment variable
+REPLICA_PATH = os.environ.get('EXPENSES_REPLICA_PATH',
+                              'expenses_replica.json')
+
+# After this time the whole sheet is downloaded again, so changes made
+# directly in the Google Sheets document are picked up as well
+FULL_SYNC_INTERVAL = timedelta(hours=24)
+
+# Edits log of a replica - every session which changes rows already in
+# the sheet (edits and deletes) adds one line to it. A session which
+# finds lines it hasn't seen downloads the whole sheet again, because
+# rows it has could have changed. Rows added at the end are found by
+# the incremental sync and don't need a line
+EDITS_SUFFIX = '.edits'
+
+# Number of columns used by the expenses worksheet (Amount, Category, Date)
+COLUMNS = 3
+COLUMN_LETTERS = 'ABC'
+
+
+# Local replica - holds every expense row (without the header row) in the
+# same format as returned by get_all_values(). Row at position i in
+# self.rows lives in row i + 2 of the worksheet.
+# Every row also gets a stable id (self.ids[i]), and self.row_numbers
+# maps the id to the worksheet row, so an expense can be found again
+# without searching the sheet even when rows are inserted before it.
+# When the whole sheet is downloaded again, rows keep their ids by their
+# values, not by their position. Other sessions can still move rows, so
+# edits check the row holds the values they expect before writing it
+# (see upload_cells()).
+# Dates are decoded once into packed integers YYYYMMDD (self.dates[i],
+# 0 when the cell doesn't hold a valid date), so rows can be filtered
+# by year and month without parsing the date text again.
+# The replica file is shared by the sessions of one computer, only the
+# session which holds the write journal saves it (see store.py) - others
+# keep their copy in memory, so a session never overwrites the file with
+# rows it doesn't know about
+class LocalReplica:
+    def __init__(self, worksheet, path=REPLICA_PATH):
+        self.worksheet = worksheet
+        self.path = path
+        self.edits_path = f'{path}{EDITS_SUFFIX}'
+        self.rows = []
+        self.ids = []
+        self.dates = []
+        self.row_numbers = {}
+        self.next_id = 1
+        self.full_synced_at = None
+        # Size of the edits log when the rows were downloaded, with the
+        # lines added by this session
+        self.edits_seen = 0
+        self.saving = True
+
+    # Read replica saved by the previous session, if there is any
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as replica_file:
+                data = json.load(replica_file)
+        except (OSError, ValueError):
+            return
+        self.rows = data.get('rows', [])
+        self.ids = data.get('ids', [])
+        self.next_id = data.get('next_id', 1)
+        self.edits_seen = data.get('edits_seen', 0)
+        if len(self.ids) != len(self.rows):
+            # Replica saved without ids - number rows from the start
+            self.ids = list(range(1, len(self.rows) + 1))
+            self.next_id = len(self.rows) + 1
+        self._index_rows()
+        self.dates = [decode_date(row[2]) for row in self.rows]
+        if data.get('full_synced_at'):
+            self.full_synced_at = datetime.fromisoformat(
+                data['full_synced_at'])
+
+    # Write replica to disk - write to temporary file first and then
+    # replace the old one, so an interrupted save never breaks the replica
+    def save(self):
+        if not self.saving:
+            return
+        data = {
+            'full_synced_at': (self.full_synced_at.isoformat()
+                               if self.full_synced_at else None),
+            'edits_seen': self.edits_seen,
+            'next_id': self.next_id,
+            'ids': self.ids,
+            'rows': self.rows,
+        }
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as replica_file:
+            json.dump(data, replica_file)
+        os.replace(temp_path, self.path)
+
+    # Bring replica up to date with the worksheet - download only rows
+    # added since the last sync, starting with the last row the replica
+    # has. The whole sheet is downloaded when the replica is empty or
+    # older than FULL_SYNC_INTERVAL, when another session has edited
+    # rows (see EDITS_SUFFIX), when full is set and when the last row
+    # doesn't match the sheet any more (rows were deleted or moved)
+    def sync(self, full=False):
+        now = datetime.now()
+        edits_size = self._edits_size()
+        if (full or self.full_synced_at is None
+                or now - self.full_synced_at > FULL_SYNC_INTERVAL
+                or edits_size != self.edits_seen):
+            self._full_sync(now, edits_size)
+        elif not self.rows:
+            self._add_rows(self._clean(self.worksheet.get_values('A2:C')))
+        else:
+            rows = self._clean(
+                self.worksheet.get_values(f'A{len(self.rows) + 1}:C'))
+            if rows and rows[0] == self.rows[-1]:
+                self._add_rows(rows[1:])
+            else:
+                self._full_sync(now, edits_size)
+        self.save()
+
+    # Expenses from the chosen month and year as dictionaries, amounts
+    # which aren't whole numbers are given as the text of the cell
+    def month_records(self, year, month):
+        year_month = year * 100 + month
+        return [
+            {'id': self.ids[position],
+             'Amount': decode_amount(row[0], row[0]),
+             'Category': row[1], 'Date': row[2]}
+            for position, row in enumerate(self.rows)
+            if packed_year_month(self.dates[position]) == year_month
+        ]
+
+    # Worksheet row of the expense with the given id
+    def row_number(self, row_id):
+        return self.row_numbers[row_id]
+
+    # Add expenses at the end of the replica, return ids of the new
+    # rows. The worksheet is updated separately with upload_rows(), and
+    # the replica is saved when the rows are sent (see store.py)
+    def add_rows(self, rows):
+        return self._add_rows(rows)
+
+    # Write expenses at the end of the worksheet with one bulk append,
+    # return the worksheet row of the first one (None when the response
+    # doesn't tell). Other sessions may have appended rows since the
+    # last sync, so it can be below the end of the replica
+    def upload_rows(self, rows):
+        return appended_row(self.worksheet.append_rows(rows))
+
+    # Rows of the worksheet from first_row to last_row (to the end of
+    # the sheet when it's None), to check what the worksheet holds there
+    def download_rows(self, first_row, last_row=None):
+        range_name = f'A{first_row}:C{last_row}' if last_row \
+            else f'A{first_row}:C'
+        return self._clean(self.worksheet.get_values(range_name))
+
+    # Put rows appended to the worksheet by other sessions into the
+    # replica, starting at the given worksheet row - rows below move
+    # down, so their index entries move as well. Saved with the rows of
+    # this session, which are sent at the same time
+    def insert_rows(self, rows, row_number):
+        position = row_number - 2
+        rows = [[str(value) for value in row] for row in rows]
+        row_ids = list(range(self.next_id, self.next_id + len(rows)))
+        self.next_id += len(rows)
+        self.rows[position:position] = rows
+        self.ids[position:position] = row_ids
+        self.dates[position:position] = [decode_date(row[2]) for row in rows]
+        self._index_rows()
+
+    # Delete one expense from the worksheet and the replica - rows below
+    # move one row up, so their index entries move as well. The row is
+    # checked in the sheet first like in upload_cells(), a row which
+    # isn't there any more isn't deleted. Returns False when the row
+    # wasn't where the replica has it
+    def delete_row(self, row_id):
+        row_number = self.row_numbers[row_id]
+        position = row_number - 2
+        edit = (self.rows[position], {})
+        sheet_row = row_number
+        if [self.rows[position]] != self.download_rows(row_number,
+                                                       row_number):
+            sheet_row = self._locate({row_id: edit},
+                                     self.row_numbers)[row_id]
+        if sheet_row is not None:
+            self.worksheet.delete_rows(sheet_row)
+            self._note_edit()
+        del self.rows[position]
+        del self.ids[position]
+        del self.dates[position]
+        self._index_rows()
+        self.save()
+        return sheet_row == row_number
+
+    # Update cells of one row in the replica - changes map column
+    # number (1 - 3) to value. The worksheet is updated separately
+    # with upload_cells(), and the replica is saved when it is
+    def set_cells(self, row_number, changes):
+        for column, value in changes.items():
+            self.rows[row_number - 2][column - 1] = str(value)
+        self.dates[row_number - 2] = decode_date(self.rows[row_number - 2][2])
+
+    # Update cells of many rows in the worksheet with one batched
+    # request - edits map row id to the values the row had before the
+    # edit (None when they aren't known) and the changes of the row.
+    # The rows are read back first with one request. A row which holds
+    # other values was moved or changed by another session - it's looked
+    # up in the whole sheet by its old values, and its edit is dropped
+    # when it isn't there any more, so rows of others are never written
+    # over. Returns False when rows were moved or dropped, the replica
+    # then has to be downloaded again
+    def upload_cells(self, edits):
+        row_numbers = {row_id: self.row_numbers[row_id] for row_id in edits}
+        checked = [row_id for row_id, (old, _) in edits.items()
+                   if old is not None]
+        moved = []
+        if checked:
+            values = self.worksheet.batch_get([
+                f'A{row_numbers[row_id]}:C{row_numbers[row_id]}'
+                for row_id in checked])
+            moved = [row_id for row_id, rows in zip(checked, values)
+                     if self._clean(rows)[:1] not in _expected(*edits[row_id])]
+        if moved:
+            row_numbers.update(self._locate(
+                {row_id: edits[row_id] for row_id in moved},
+                row_numbers))
+            for row_id in moved:
+                if row_numbers[row_id] is None:
+                    del row_numbers[row_id]
+        data = [
+            {'range': f'{COLUMN_LETTERS[column - 1]}{row_numbers[row_id]}',
+             'values': [[value]]}
+            for row_id, (_, changes) in sorted(
+                edits.items(), key=lambda item: row_numbers.get(item[0], 0))
+            if row_id in row_numbers
+            for column, value in sorted(changes.items())
+        ]
+        if data:
+            self.worksheet.batch_update(data)
+            self._note_edit()
+        return not moved
+
+    # Download the whole sheet - rows which are still in the sheet keep
+    # their ids (rows with the same values in the same order), new and
+    # changed rows get new ones
+    def _full_sync(self, now, edits_size):
+        rows = self._clean(self.worksheet.get_all_values()[1:])
+        old_ids = {}
+        for row_id, row in zip(self.ids, self.rows):
+            old_ids.setdefault(tuple(row), []).append(row_id)
+        self.rows = []
+        self.ids = []
+        self.dates = []
+        for row in rows:
+            same_rows = old_ids.get(tuple(row))
+            if same_rows:
+                self.rows.append(row)
+                self.ids.append(same_rows.pop(0))
+                self.dates.append(decode_date(row[2]))
+            else:
+                self._add_rows([row])
+        self._index_rows()
+        self.full_synced_at = now
+        self.edits_seen = edits_size
+
+    # Worksheet rows of edited rows moved by other sessions, found in the
+    # whole sheet by their values before (or after) the edit - the row
+    # nearest to where the replica has it is taken. None for rows which
+    # aren't in the sheet any more
+    def _locate(self, edits, row_numbers):
+        sheet_rows = self._clean(self.worksheet.get_all_values()[1:])
+        taken = set()
+        located = {}
+        for row_id, edit in edits.items():
+            expected = _expected(*edit)
+            candidates = [position + 2
+                          for position, row in enumerate(sheet_rows)
+                          if [row] in expected
+                          and position + 2 not in taken]
+            located[row_id] = min(
+                candidates, default=None,
+                key=lambda row_number: abs(row_number - row_numbers[row_id]))
+            taken.add(located[row_id])
+        return located
+
+    # Size of the edits log, 0 when no session has edited rows yet
+    def _edits_size(self):
+        try:
+            return os.path.getsize(self.edits_path)
+        except OSError:
+            return 0
+
+    # Tell other sessions that rows already in the sheet were changed.
+    # Lines of this session are counted as seen, so only edits of others
+    # make it download the whole sheet. Saved with the next save()
+    def _note_edit(self):
+        line = f'{os.getpid()}\n'
+        with open(self.edits_path, 'a', encoding='utf-8') as edits_file:
+            edits_file.write(line)
+        self.edits_seen += len(line)
+
+    # Add rows at the end of the replica and give them new ids
+    def _add_rows(self, rows):
+        row_ids = []
+        for row in rows:
+            row_id = self.next_id
+            self.next_id += 1
+            self.rows.append([str(value) for value in row])
+            self.ids.append(row_id)
+            self.dates.append(decode_date(self.rows[-1][2]))
+            self.row_numbers[row_id] = len(self.rows) + 1
+            row_ids.append(row_id)
+        return row_ids
+
+    # Rebuild the index from row ids to worksheet rows
+    def _index_rows(self):
+        self.row_numbers = {
+            row_id: position + 2 for position, row_id in enumerate(self.ids)
+        }
+
+    # Make sure every row has all the columns and drop empty rows
+    # from the end of the range, so positions still match sheet rows
+    def _clean(self, rows):
+        rows = [(list(row) + [''] * COLUMNS)[:COLUMNS] for row in rows]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+
+# Values of an edited row in the sheet which are fine to write - as
+# [row] lists, the row before the edit or with the edit already written
+def _expected(old, changes):
+    old = [str(value) for value in old]
+    new = list(old)
+    for column, value in changes.items():
+        new[column - 1] = str(value)
+    return [[old], [new]]
+
+
+# First worksheet row written by append_rows(), read from the range in
+# its response ('expenses'!A6:C7), None when the response doesn't have it
+def appended_row(response):
+    if not isinstance(response, dict):
+        return None
+    updated_range = response.get('updates', {}).get('updatedRange', '')
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    return int(match.group(1)) if match else None
+
+
+# Whole number of the amount text, the default when the cell holds
+# something else (a fraction, text typed into the sheet or nothing)
+def decode_amount(amount_text, default=None):
+    try:
+        return int(amount_text)
+    except (TypeError, ValueError):
+        return default
+
+
+# Packed date YYYYMMDD of the date text, 0 when it isn't a valid date
+def decode_date(date_text):
+    try:
+        return pack_date(date_text)
+    except ValueError:
+        return 0
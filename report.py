@@ -0,0 +1,222 @@
+# Command line reports - statements, comparisons and new expenses
+# without interactive prompts, for scripts and scheduled jobs.
+#
+# Every command accepts many periods (or expenses), the expenses are
+# loaded once for all of them. Results are printed as JSON or CSV.
+#
+# Usage:
+#     python3 report.py year 2023 2024
+#     python3 report.py month 2024-01 2024-02 --format csv
+#     python3 report.py compare-years 2023:2024
+#     python3 report.py compare-months 2024-01:2024-02 2024-02:2024-03
+#     python3 report.py add 12 Food 2024-03-05 40 Gifts 2024-03-06
+import argparse  # for reading command line arguments
+import csv  # for CSV output
+import json  # for JSON output
+import sys  # for interacting with the system
+from datetime import datetime  # for checking years and months
+from validation import parse_amount, parse_category, parse_date  # for\
+# checking new expenses with the same rules as add_expense
+
+# Columns of the records printed by every command
+STATEMENT_FIELDS = ['period', 'category', 'amount']
+COMPARE_FIELDS = ['first', 'second', 'category', 'first_amount',
+                  'second_amount', 'change_percent']
+ADD_FIELDS = ['amount', 'category', 'date']
+
+
+# Check year argument - between 1900 and the current year
+def year_argument(text):
+    try:
+        year = int(text)
+    except ValueError:
+        year = 0
+    current_year = datetime.today().year
+    if year < 1900 or year > current_year:
+        raise argparse.ArgumentTypeError(
+            f'invalid year {text!r}, use a number between 1900 '
+            f'and {current_year}')
+    return year
+
+
+# Check month argument YYYY-MM, return (year, month)
+def month_argument(text):
+    year_text, _, month_text = text.partition('-')
+    try:
+        month = int(month_text)
+    except ValueError:
+        month = 0
+    if month < 1 or month > 12:
+        raise argparse.ArgumentTypeError(
+            f'invalid month {text!r}, use YYYY-MM')
+    return year_argument(year_text), month
+
+
+# Check pair of periods FIRST:SECOND, each checked by period_argument
+def pair_argument(period_argument):
+    def parse_pair(text):
+        first, separator, second = text.partition(':')
+        if not separator:
+            raise argparse.ArgumentTypeError(
+                f'invalid pair {text!r}, use FIRST:SECOND')
+        return period_argument(first), period_argument(second)
+    return parse_pair
+
+
+# Read command line arguments
+def parse_arguments(argv):
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--format', choices=['json', 'csv'], default='json',
+                        help='output format (default: json)')
+
+    parser = argparse.ArgumentParser(
+        description='Expense reports without interactive prompts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('year', parents=[output],
+                                  help='category totals for years')
+    command.add_argument('periods', nargs='+', type=year_argument,
+                         metavar='YEAR')
+
+    command = commands.add_parser('month', parents=[output],
+                                  help='category totals for months')
+    command.add_argument('periods', nargs='+', type=month_argument,
+                         metavar='YYYY-MM')
+
+    command = commands.add_parser('compare-years', parents=[output],
+                                  help='compare pairs of years')
+    command.add_argument('pairs', nargs='+',
+                         type=pair_argument(year_argument),
+                         metavar='YEAR:YEAR')
+
+    command = commands.add_parser('compare-months', parents=[output],
+                                  help='compare pairs of months')
+    command.add_argument('pairs', nargs='+',
+                         type=pair_argument(month_argument),
+                         metavar='YYYY-MM:YYYY-MM')
+
+    command = commands.add_parser('add', parents=[output],
+                                  help='add expenses')
+    command.add_argument('expenses', nargs='+',
+                         metavar='AMOUNT CATEGORY DATE',
+                         help='any number of expenses, three values each')
+    return parser.parse_args(argv)
+
+
+# Check new expenses given as AMOUNT CATEGORY DATE triples, all of them
+# are checked before anything is saved
+def convert_expenses(values):
+    if len(values) % 3:
+        raise ValueError('Every expense needs three values: '
+                         'AMOUNT CATEGORY DATE.')
+    return [[parse_amount(values[i]), parse_category(values[i + 1]),
+             str(parse_date(values[i + 2]))]
+            for i in range(0, len(values), 3)]
+
+
+# Connect to the shared cache daemon, or when it isn't running, open the
+# configured storage backend and load the expenses once
+def open_data():
+    from cache_daemon import connect_to_daemon  # for the shared cache
+    from store import open_store  # for the configured storage backend
+
+    store = connect_to_daemon()
+    if store is None:
+        store = open_store()
+        store.load()
+    return store
+
+
+# Period as text - 2024 for years, 2024-03 for months
+def period_name(period):
+    if isinstance(period, tuple):
+        return f'{period[0]}-{period[1]:02d}'
+    return str(period)
+
+
+# Statement records - total of the period first, then every category,
+# totals of all the periods are read from the store at once
+def statement_records(store, periods):
+    records = []
+    for period, totals in zip(periods, store.period_totals(periods)):
+        records.append({'period': period_name(period), 'category': 'Total',
+                        'amount': sum(totals.values())})
+        for category, amount in totals.items():
+            records.append({'period': period_name(period),
+                            'category': category, 'amount': amount})
+    return records
+
+
+# Comparison records - totals of both periods and the change from the
+# first to the second in percent (empty when the first total is 0)
+def compare_records(store, pairs):
+    periods = [period for pair in pairs for period in pair]
+    all_totals = store.period_totals(periods)
+    records = []
+    for index, (first, second) in enumerate(pairs):
+        first_totals = all_totals[2 * index]
+        second_totals = all_totals[2 * index + 1]
+        rows = [('Total', sum(first_totals.values()),
+                 sum(second_totals.values()))]
+        for category in dict.fromkeys([*first_totals, *second_totals]):
+            rows.append((category, first_totals.get(category, 0),
+                         second_totals.get(category, 0)))
+        for category, first_amount, second_amount in rows:
+            change = None
+            if first_amount:
+                change = round((second_amount - first_amount)
+                               / first_amount * 100, 2)
+            records.append({'first': period_name(first),
+                            'second': period_name(second),
+                            'category': category,
+                            'first_amount': first_amount,
+                            'second_amount': second_amount,
+                            'change_percent': change})
+    return records
+
+
+# Print the records as JSON list of objects or CSV with header
+def write_records(records, fields, output_format, stream=sys.stdout):
+    if output_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields,
+                                lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        json.dump(records, stream, indent=2)
+        stream.write('\n')
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+
+    if arguments.command == 'add':
+        try:
+            rows = convert_expenses(arguments.expenses)
+        except ValueError as error:
+            sys.exit(str(error))
+        store = open_data()
+        store.add_expenses(rows)
+        # Expenses are sent now, the background flusher ends with the
+        # process
+        try:
+            store.flush()
+        except Exception as error:
+            sys.exit(f'Expenses were not sent to Google Sheets ({error}). '
+                     f'They are kept in the journal and will be sent '
+                     f'next time the program starts.')
+        records = [dict(zip(ADD_FIELDS, row)) for row in rows]
+        write_records(records, ADD_FIELDS, arguments.format)
+        return
+
+    store = open_data()
+    if arguments.command in ('year', 'month'):
+        write_records(statement_records(store, arguments.periods),
+                      STATEMENT_FIELDS, arguments.format)
+    else:
+        write_records(compare_records(store, arguments.pairs),
+                      COMPARE_FIELDS, arguments.format)
+
+
+if __name__ == '__main__':
+    main()
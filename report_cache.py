@@ -0,0 +1,204 @@
+# Report cache - keeps computed statements of this session, so the same
+# or an overlapping statement asked for again is answered without asking
+# the store. Has the same methods as store.LocalStore and wraps the
+# stores which see every change of the data (local or partitioned) -
+# not the cache daemon, SQLite or the sorted sheet, which other
+# sessions change without this cache knowing.
+#
+# Totals are kept for every period (year or month) on its own, so
+# a comparison of 2023 and 2024 also answers the statement of 2024.
+# The least recently used entries are dropped when the cache is full.
+# An entry is dropped only when a new or edited expense (or a row
+# downloaded by refresh) has a date in the period the entry covers.
+import copy  # for giving callers their own copy of cached results
+import json  # for cache keys of arguments with lists
+import os  # for reading environment variables
+import threading  # for requests made from many threads
+from collections import OrderedDict  # for least recently used order
+from replica import decode_date  # for comparing dates with periods
+
+# Number of cached statements, can be changed with environment variable,
+# 0 turns the cache off
+REPORT_CACHE_SIZE = int(os.environ.get('EXPENSE_REPORT_CACHE_SIZE', '128'))
+
+# Packed dates (YYYYMMDD) covered by totals of every year
+ALL_DATES = (0, 99999999)
+
+
+class ReportCache:
+    def __init__(self, store, size=REPORT_CACHE_SIZE):
+        self.store = store
+        self.size = size
+        # key -> (packed date ranges covered by the entry, result), the
+        # least recently used first
+        self.entries = OrderedDict()
+        # id -> date of the expenses returned by month_records, to find
+        # the period of an edited expense
+        self.dates_by_id = {}
+        self.lock = threading.RLock()
+        # Counts invalidations - results computed while entries were
+        # dropped (by a refresh in the background) may be out of date,
+        # so they aren't kept
+        self.generation = 0
+        # Number of answers from the cache and from the store
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        self.store.load()
+
+    # Download rows added by others - entries of their periods are
+    # dropped, or all of them when the store can't tell what changed
+    def refresh(self):
+        dates = self.store.refresh()
+        with self.lock:
+            self._invalidate(dates)
+
+    def flush(self):
+        self.store.flush()
+
+    def add_expenses(self, rows):
+        self.store.add_expenses(rows)
+        with self.lock:
+            self._invalidate([row[2] for row in rows])
+
+    # Save changes of one expense - entries of its old and new period
+    # are dropped, or all of them when its old date isn't known
+    def update_expense(self, row_id, changes):
+        with self.lock:
+            old_date = self.dates_by_id.get(row_id)
+        self.store.update_expense(row_id, changes)
+        with self.lock:
+            if old_date is None:
+                self._invalidate(None)
+            else:
+                self._invalidate([old_date, changes.get(3, old_date)])
+
+    # Expenses from the chosen month and year as dictionaries, always
+    # from the store - they are edited by their ids, which the store
+    # has to check
+    def month_records(self, year, month):
+        records = self.store.month_records(year, month)
+        with self.lock:
+            for record in records:
+                self.dates_by_id[record['id']] = record['Date']
+        return records
+
+    # Category totals for the chosen year
+    def year_totals(self, year):
+        return self.period_totals([year])[0]
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        return self.period_totals([(year, month)])[0]
+
+    # Category totals for every year with expenses, they also answer
+    # the statements of the years
+    def totals_by_year(self):
+        with self.lock:
+            generation = self.generation
+        totals = self._cached(('totals_by_year',), [ALL_DATES],
+                              self.store.totals_by_year)
+        with self.lock:
+            if generation != self.generation:
+                return totals
+            for year, year_totals in totals.items():
+                self._store(('period', year), [_period_dates(year)],
+                            year_totals)
+        return totals
+
+    # Category totals of many periods at once - years, or [year, month]
+    # pairs for months. Only the periods which aren't cached are asked
+    # from the store, with one call
+    def period_totals(self, periods):
+        if self.size <= 0:
+            return self.store.period_totals(periods)
+        periods = [tuple(period) if isinstance(period, (list, tuple))
+                   else period for period in periods]
+        with self.lock:
+            missing = list(dict.fromkeys(
+                period for period in periods
+                if _key('period', period) not in self.entries))
+            generation = self.generation
+        if missing:
+            all_totals = self.store.period_totals(missing)
+            with self.lock:
+                self.misses += len(missing)
+                if generation != self.generation:
+                    return self.store.period_totals(periods)
+                for period, totals in zip(missing, all_totals):
+                    self._store(('period', period), [_period_dates(period)],
+                                totals)
+        results = []
+        with self.lock:
+            for period in periods:
+                key = _key('period', period)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    results.append(copy.deepcopy(self.entries[key][1]))
+                else:
+                    # Cache is too small for all the periods
+                    return self.store.period_totals(periods)
+            self.hits += len(periods) - len(missing)
+        return results
+
+    # Category totals from the start date to the end date
+    def range_totals(self, start, end):
+        return self._cached(('range_totals', start, end),
+                            [(decode_date(start), decode_date(end))],
+                            lambda: self.store.range_totals(start, end))
+
+    # Cached result of the key, computed by the function when it isn't
+    # in the cache
+    def _cached(self, key, covered, compute):
+        with self.lock:
+            entry = self.entries.get(_key(*key))
+            if entry is not None:
+                self.entries.move_to_end(_key(*key))
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            generation = self.generation
+        result = compute()
+        with self.lock:
+            self.misses += 1
+            if generation == self.generation:
+                self._store(key, covered, result)
+        return copy.deepcopy(result)
+
+    # Add an entry and drop the least recently used ones over the size
+    def _store(self, key, covered, result):
+        self.entries[_key(*key)] = (covered, result)
+        self.entries.move_to_end(_key(*key))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    # Drop entries covering any of the dates, all entries when dates is
+    # None
+    def _invalidate(self, dates):
+        self.generation += 1
+        self.dates_by_id = {}
+        if dates is None:
+            self.entries.clear()
+            return
+        packed_dates = [decode_date(str(date_text)) for date_text in dates]
+        packed_dates = [packed for packed in packed_dates if packed]
+        for key, (covered, _) in list(self.entries.items()):
+            if any(low <= packed <= high for low, high in covered
+                   for packed in packed_dates):
+                del self.entries[key]
+
+
+# Cache key of the operation and its arguments
+def _key(*parts):
+    return json.dumps(parts)
+
+
+# Packed dates covered by the totals of a year or (year, month) period
+def _period_dates(period):
+    if isinstance(period, tuple):
+        return _month_dates(*period)
+    return period * 10000 + 101, period * 10000 + 1231
+
+
+def _month_dates(year, month):
+    return year * 10000 + month * 100 + 1, year * 10000 + month * 100 + 31
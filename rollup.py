@@ -0,0 +1,89 @@
+# Rollup of expenses - category totals for every year and every month,
+# built once from all the rows and then kept up to date when expenses
+# are added or edited, so statements don't have to scan all the rows
+from dates import pack_date, packed_year, packed_month  # for reading\
+# year and month of expenses
+from replica import decode_amount  # for reading amounts of expenses
+
+
+class ExpenseRollup:
+    def __init__(self):
+        # year -> {category: amount}
+        self.years = {}
+        # (year, month) -> {category: amount}
+        self.months = {}
+        # (year, month, category) -> number of expenses, used to remove
+        # a category from the statements when its last expense is moved
+        self.counts = {}
+
+    # Build the rollup from the expense table - totals of all the
+    # (year, month, category) groups come from one vectorized group-by
+    def build(self, table):
+        self.years = {}
+        self.months = {}
+        self.counts = {}
+        for year, month, category, amount, count in table.group_by_month():
+            self.counts[(year, month, category)] = count
+            year_totals = self.years.setdefault(year, {})
+            year_totals[category] = year_totals.get(category, 0) + amount
+            self.months.setdefault((year, month), {})[category] = amount
+
+    # Add one expense row (amount, category, date) to the totals,
+    # rows without a valid date (packed date 0) or a whole number
+    # amount are skipped, like in the expense table
+    def add(self, row, packed_date=None):
+        amount = decode_amount(row[0])
+        if packed_date == 0 or amount is None:
+            return
+        year, month = self._period(row[2], packed_date)
+        category = row[1]
+        key = (year, month, category)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        year_totals = self.years.setdefault(year, {})
+        year_totals[category] = year_totals.get(category, 0) + amount
+        month_totals = self.months.setdefault((year, month), {})
+        month_totals[category] = month_totals.get(category, 0) + amount
+
+    # Remove one expense row (amount, category, date) from the totals
+    def remove(self, row, packed_date=None):
+        amount = decode_amount(row[0])
+        if packed_date == 0 or amount is None:
+            return
+        year, month = self._period(row[2], packed_date)
+        category = row[1]
+        key = (year, month, category)
+        self.counts[key] -= 1
+
+        self.years[year][category] -= amount
+        self.months[(year, month)][category] -= amount
+
+        # Drop the category when there are no expenses left for it
+        if self.counts[key] == 0:
+            del self.counts[key]
+            del self.months[(year, month)][category]
+            if not self.months[(year, month)]:
+                del self.months[(year, month)]
+            if not any((year, other_month, category) in self.counts
+                       for other_month in range(1, 13)):
+                del self.years[year][category]
+                if not self.years[year]:
+                    del self.years[year]
+
+    # Category totals for the chosen year
+    def year_totals(self, year):
+        return dict(self.years.get(year, {}))
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        return dict(self.months.get((year, month), {}))
+
+    # Category totals for every year with expenses
+    def totals_by_year(self):
+        return {year: dict(totals) for year, totals in self.years.items()}
+
+    # Year and month of the expense date
+    def _period(self, date_text, packed_date=None):
+        if packed_date is None:
+            packed_date = pack_date(str(date_text))
+        return packed_year(packed_date), packed_month(packed_date)
@@ -1,65 +1,121 @@
 # Importing necessary libraries/modules
+import timing  # for startup timing, imported first to time everything
+import metrics  # for recording menu operations in the session metrics
 from datetime import datetime  # for working with dates and times
-import gspread  # for interacting with Google Sheets API
-from google.oauth2.service_account import Credentials  # for\
-# authorizing access to Google Sheets API
-import pyfiglet  # for printing ASCII art
 import time  # for pausing the program execution for some time
 import sys  # for interacting with the system
-import os
-import json
+import threading  # for loading expenses in the background
+from banner import BANNER  # for printing ASCII art
+from validation import (CATEGORIES, parse_amount, parse_date,
+                        parse_date_range, parse_months,
+                        parse_years)  # for checking expense details
+# entered by the user
 
 # Printing ASCII art banner
-ascii_banner = pyfiglet.figlet_format("Personal\nExpense\nTracker")
-print(ascii_banner)
-
-# Define the required Google API scopes
-SCOPE = [
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-    ]
-
-# Load the credentials from the JSON file and authorize access
-# to the required scopes
-if "GOOGLE_CREDS_JSON" in os.environ:
-    # ✅ Production / Heroku – creds from Config Var
-    service_account_info = json.loads(os.environ["GOOGLE_CREDS_JSON"])
-    CREDS = Credentials.from_service_account_info(service_account_info)
-else:
-    # ✅ Local development – fallback to creds.json file
-    CREDS = Credentials.from_service_account_file("creds.json")
-SCOPED_CREDS = CREDS.with_scopes(SCOPE)
-
-# Authorize access to the Google Sheets document
-# using the authorized credentials
-GSPREAD_CLIENT = gspread.authorize(SCOPED_CREDS)
-SHEET = GSPREAD_CLIENT.open('personal-expense-tracker')
-EXPENSES = SHEET.worksheet('expenses')
-
-# Define the expense categories
-CATEGORIES = [
-    'Housing',
-    'Transportation',
-    'Food',
-    'Utilities',
-    'Clothing',
-    'Healthcare',
-    'Insurance',
-    'Supplies',
-    'Personal',
-    'Debt',
-    'Retirement',
-    'Education',
-    'Savings',
-    'Gifts',
-    'Entertainment'
-]
+print(BANNER)
+timing.mark('banner printed')
+
+# Expenses data - loaded in the background, so the menu is shown
+# right away and the user can start typing while Google Sheets
+# document is opened. STORE is either the shared cache daemon or
+# a local store of expenses (see store.py)
+STORE = None
+DATA_READY = threading.Event()
+DATA_ERROR = None
+DATA_LOADED_AT = None
+
+# Rows added by others are downloaded in the background when the user
+# picks a menu option, at most once in this number of seconds
+PREFETCH_INTERVAL = 30
+
+# Number of periods shown side by side in the matrix of many periods
+MATRIX_COLUMNS = 4
+
+
+# Load data function - connect to the shared cache daemon, or when it
+# isn't running, open the configured storage backend (Google Sheets
+# document or SQLite database) and load the expenses
+def load_data():
+    global STORE, DATA_ERROR, DATA_LOADED_AT
+    try:
+        # Heavy modules are imported here, in the background thread
+        with timing.phase('import modules'):
+            from cache_daemon import connect_to_daemon
+            from report_cache import ReportCache
+            from store import STORAGE_BACKEND, open_store
+
+        with timing.phase('connect to cache daemon'):
+            store = connect_to_daemon()
+
+        if store is None:
+            # Authorize access to the Google Sheets document and open
+            # the worksheet with expenses, or open the database
+            with timing.phase('open storage'):
+                store = open_store()
+
+            # Load the local replica and download only the rows added
+            # since the last session, or create the database tables
+            with timing.phase('load expenses'):
+                store.load()
+
+            # Statements asked for again are answered from the report
+            # cache. The SQLite database and the sorted sheet are changed
+            # by other sessions without telling this one, so they are
+            # asked every time
+            if STORAGE_BACKEND not in ('sqlite', 'sorted'):
+                store = ReportCache(store)
+
+        STORE = store
+        DATA_LOADED_AT = time.monotonic()
+    except Exception as error:
+        DATA_ERROR = error
+    finally:
+        DATA_READY.set()
+
+
+# Refresh data function - download rows added by others since the
+# data was loaded. Data loaded before is still used when it fails
+def refresh_data():
+    global DATA_LOADED_AT
+    try:
+        with timing.phase('refresh expenses'):
+            STORE.refresh()
+    except Exception:
+        pass
+    finally:
+        DATA_LOADED_AT = time.monotonic()
+        DATA_READY.set()
+
+
+# Prefetch function - called when the user picks a menu option, starts
+# the refresh in the background, so it runs while the user types the
+# year, month or expense details
+def prefetch():
+    if not DATA_READY.is_set() or STORE is None:
+        # Data is still loading or couldn't be loaded
+        return
+    if time.monotonic() - DATA_LOADED_AT < PREFETCH_INTERVAL:
+        return
+    DATA_READY.clear()
+    threading.Thread(target=refresh_data, daemon=True).start()
 
 
-# Add expense function - add new expense and update it with Google
-# Sheets document
-def add_expense():
+# Wait for data function - called before expenses are used, returns
+# at once when the data is already loaded or refreshed
+def wait_for_data():
+    if not DATA_READY.is_set():
+        print('\nLoading expenses...')
+        DATA_READY.wait()
+    if DATA_ERROR is not None:
+        raise DATA_ERROR
+
+
+threading.Thread(target=load_data, daemon=True).start()
+
+
+# Choose category function - display category options and
+# prompt user for the index of the category
+def choose_category():
     # Display category options to the user
     print('')
     print(f'{"Index":<6}{"Category":<15}')
@@ -80,51 +136,114 @@ def add_expense():
                 print(f"Invalid index. Please enter a number"
                       f" between 1 and {len(CATEGORIES)}")
                 continue
-            break
+            return CATEGORIES[category_index]
         except ValueError:
             print('Invalid index. Please enter a valid number.')
             continue
 
-    # Get expense details
-    # Get amount only with numbers and change it to integers
+
+# Enter amount function - get amount only with numbers
+# and change it to integers
+def enter_amount(prompt):
     while True:
-        amount_input = input('\nEnter expense amount: ')
+        amount_input = input(prompt)
         if not amount_input:
             continue
         try:
-            amount = round(float(amount_input))
-            if amount <= 0:
-                print('Invalid amount. Please enter a positive number.')
-                continue
-            break
-        except ValueError:
-            print('Invalid amount. Please enter a valid number.')
-            continue
+            return parse_amount(amount_input)
+        except ValueError as error:
+            print(error)
+
 
-    # Get expense date
+# Enter date function - get expense date in the past or today
+def enter_date(prompt):
     while True:
-        date_input = input('\nEnter expense date (YYYY-MM-DD): ')
+        date_input = input(prompt)
         if not date_input:
             continue
         try:
-            date = datetime.strptime(date_input, '%Y-%m-%d').date()
-            if date > date.today():
-                print('Invalid date. Please enter a date in the past or today')
-                continue
-            break
-        except ValueError:
-            print("Incorrect date format. Please enter a valid"
-                  " date in the format YYYY-MM-DD.")
-            continue
+            return parse_date(date_input)
+        except ValueError as error:
+            print(error)
+
+
+# Enter expense function - prompt user for category, amount and date
+# of a new expense and return it as a row for Google Sheets document
+def enter_expense():
+    category = choose_category()
+
+    # Get expense details
+    amount = enter_amount('\nEnter expense amount: ')
+    date = enter_date('\nEnter expense date (YYYY-MM-DD): ')
+
+    return [int(amount), category, str(date)]
 
-    # Write expense to Google Sheets document
-    row = [int(amount), CATEGORIES[category_index], str(date)]
-    EXPENSES.append_row(row)
-    print('\nExpense added successfully\n')
+
+# Save expenses function - write new expenses, returns False when the
+# connection to the cache daemon was lost while they were sent, so it
+# isn't known whether they were saved
+def save_expenses(rows):
+    wait_for_data()
+    try:
+        STORE.add_expenses(rows)
+        return True
+    except ConnectionError:
+        print('\nThe connection was lost while the expenses were saved. '
+              'Please check the statement before adding them again.\n')
+        return False
+
+
+# Add expense function - add new expense and update it with Google
+# Sheets document
+def add_expense():
+    row = enter_expense()
+
+    # Write expense to Google Sheets document and the local replica
+    if save_expenses([row]):
+        print('\nExpense added successfully\n')
 
     # Ask user whether they want to add another
     # expense or return to the main menu
-    go_back_add_expense()
+    return go_back('add_expense')
+
+
+# Add expenses in batch function - user enters many expenses, they are
+# kept locally until the batch is saved and then written to Google
+# Sheets document with one bulk append
+def add_expense_batch():
+    pending_expenses = []
+    while True:
+        pending_expenses.append(enter_expense())
+
+        # Display pending expenses in a table format
+        print(f'\nPending expenses ({len(pending_expenses)}):')
+        print(f'{"Index":<10}{"Amount":<10}{"Category":<20}{"Date":<10}')
+        for i, expense in enumerate(pending_expenses):
+            print(f'{i+1:<10}{expense[0]:<10}{expense[1]:<20}{expense[2]:<10}')
+
+        # Ask user whether they want to add another expense to the batch,
+        # save the batch or discard it
+        while True:
+            choice = input('\nWould you like to add another expense, '
+                           'save or discard the batch? (a / s / d) ')
+            if choice.lower() in ['a', 's', 'd']:
+                break
+            print('Invalid choice. Please enter a (add), '
+                  's (save) or d (discard).')
+
+        if choice.lower() == 's':
+            # Write all pending expenses with one request
+            if save_expenses(pending_expenses):
+                print(f'\n{len(pending_expenses)} expenses added '
+                      f'successfully\n')
+            break
+        elif choice.lower() == 'd':
+            print('\nBatch discarded\n')
+            break
+
+    # Ask user whether they want to add another
+    # batch or return to the main menu
+    return go_back('add_expense_batch')
 
 
 # Edit expense function - edit expense and update
@@ -142,6 +261,7 @@ def edit_expense():
             print(f'Invalid year. Please enter a number'
                   f' between 1900 and {current_year} ')
 
+    wait_for_data()
     while True:
         max_month = 12 if year < current_year else datetime.today().month
         try:
@@ -150,11 +270,7 @@ def edit_expense():
                 raise ValueError()
             # Check if there is any expense for the selected month
             chosen_date = datetime(year, month, 1)
-            filtered_expenses = [
-                expense for expense in EXPENSES.get_all_records()
-                if (datetime.strptime(expense['Date'], '%Y-%m-%d').date()
-                    .replace(day=1) == chosen_date.date())
-            ]
+            filtered_expenses = STORE.month_records(year, month)
             if len(filtered_expenses) == 0:
                 print(f'There are no expenses for '
                       f'{chosen_date.strftime("%B %Y")}.'
@@ -202,480 +318,58 @@ def edit_expense():
     # Get the selected expense details
     selected_expense = filtered_expenses[expense_index-1]
 
-    # Display the selected expense details
-    print('\nSelected expense details:')
-    print(f'Category: {selected_expense["Category"]}')
-    print(f'Amount: {selected_expense["Amount"]}')
-    print(f'Date: {selected_expense["Date"]}')
-
-    # Prompt user to edit the expense details
+    # Collect changes of the selected expense - they are saved
+    # together when user doesn't want to edit more parameters
+    changes = {}
     while True:
-        try:
+        # Display the selected expense details
+        print('\nSelected expense details:')
+        print(f'Category: {selected_expense["Category"]}')
+        print(f'Amount: {selected_expense["Amount"]}')
+        print(f'Date: {selected_expense["Date"]}')
+
+        # Prompt user to choose what to edit
+        while True:
             edit_choice = input('\nWould you like to edit the category, '
                                 'amount or date? (c / a / d) ')
-            if edit_choice.lower() not in ['c', 'a', 'd']:
-                raise ValueError()
-            break
-        except ValueError:
+            if edit_choice.lower() in ['c', 'a', 'd']:
+                break
             print('Invalid choice. Please enter c '
                   '(category), a (amount) or d (date).')
 
-    if edit_choice.lower() == 'c':
-        # Display category options to the user
-        print('')
-        print(f'{"Index":<6}{"Category":<15}')
-        for i, category in enumerate(CATEGORIES):
-            print(f"{i+1:<6}{category:<15}")
-
-        # Prompt user for new category index
-        while True:
-            category_index_input = input(
-                f"\nEnter the index of the new expense category "
-                f"(1 - {len(CATEGORIES)}): ")
-            if not category_index_input:
-                continue
-            try:
-                category_index = int(category_index_input) - 1
-                if category_index < 0 or category_index >= len(CATEGORIES):
-                    print(f"Invalid index. Please enter a number "
-                          f"between 1 and {len(CATEGORIES)}")
-                    continue
-                break
-            except ValueError:
-                print('Invalid index. Please enter a valid number.')
-                continue
-        # Update the category for the selected expense
-        selected_expense["Category"] = CATEGORIES[category_index]
-        row_index = EXPENSES.find(selected_expense["Date"]).row
-        EXPENSES.update_cell(row_index, 2, selected_expense["Category"])
-        print('Category updated successfully')
+        if edit_choice.lower() == 'c':
+            selected_expense["Category"] = choose_category()
+            changes[2] = selected_expense["Category"]
+        elif edit_choice.lower() == 'a':
+            selected_expense["Amount"] = enter_amount(
+                '\nEnter new expense amount: ')
+            changes[1] = selected_expense["Amount"]
+        else:
+            selected_expense["Date"] = str(enter_date(
+                '\nEnter new expense date (YYYY-MM-DD): '))
+            changes[3] = selected_expense["Date"]
 
         # Ask if user wants to edit more parameters
         while True:
             more_choice = input('\nDo you want to edit more '
                                 'parameters for this expense? (y/n) ')
-            if more_choice.lower() == 'y':
-                # Prompt user to choose what to edit
-                while True:
-                    try:
-                        edit_choice = input(
-                            '\nWould you like to edit the '
-                            'category, amount or date? (c / a / d) '
-                        )
-                        if edit_choice.lower() not in ['c', 'a', 'd']:
-                            raise ValueError()
-                        break
-                    except ValueError:
-                        print('Invalid choice. Please enter c '
-                              '(category), a (amount) or d (date).')
-                # Code for editing category, amount or date
-                # Display the selected expense details
-                print('\nSelected expense details:')
-                print(f'Category: {selected_expense["Category"]}')
-                print(f'Amount: {selected_expense["Amount"]}')
-                print(f'Date: {selected_expense["Date"]}')
-
-                if edit_choice.lower() == 'c':
-                    # Display category options to the user
-                    print('')
-                    print(f'{"Index":<6}{"Category":<15}')
-                    for i, category in enumerate(CATEGORIES):
-                        print(f"{i+1:<6}{category:<15}")
-
-                    # Prompt user for new category index
-                    while True:
-                        category_index_input = input(
-                            f"\nEnter the index of the new expense "
-                            f"category (1 - {len(CATEGORIES)}): "
-                        )
-                        if not category_index_input:
-                            continue
-                        try:
-                            category_index = int(category_index_input) - 1
-                            if category_index < 0 or category_index \
-                                    >= len(CATEGORIES):
-                                print(f"Invalid index. Please enter a number "
-                                      f"between 1 and {len(CATEGORIES)}")
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid index. '
-                                  'Please enter a valid number.')
-                            continue
-                    # Update the category for the selected expense
-                    selected_expense["Category"] = CATEGORIES[category_index]
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 2, selected_expense["Category"]
-                    )
-                    print('Category updated successfully')
-
-                elif edit_choice.lower() == 'a':
-                    # Get new amount
-                    while True:
-                        amount_input = input('\nEnter new expense amount: ')
-                        if not amount_input:
-                            continue
-                        try:
-                            amount = round(float(amount_input))
-                            if amount <= 0:
-                                print('Invalid amount. '
-                                      'Please enter a positive number.')
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid amount. '
-                                  'Please enter a valid number.')
-                            continue
-
-                    # Update the amount for the selected expense
-                    selected_expense["Amount"] = amount
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 1, selected_expense["Amount"]
-                    )
-                    print('Amount updated successfully')
-
-                elif edit_choice.lower() == 'd':
-                    # Get new date
-                    while True:
-                        date_input = input(
-                            '\nEnter new expense date (YYYY-MM-DD): '
-                        )
-                        if not date_input:
-                            continue
-                        try:
-                            date = datetime.strptime(
-                                date_input, '%Y-%m-%d'
-                            ).date()
-                            if date > date.today():
-                                print('Invalid date. '
-                                      'Please enter a date '
-                                      'in the past or today')
-                                continue
-                            break
-                        except ValueError:
-                            print("Incorrect date format. Please enter "
-                                  "a valid date in the format YYYY-MM-DD.")
-                            continue
-
-                    # Update the date for the selected expense
-                    # Get the row index for the selected expense
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    # Update the date for the selected expense
-                    selected_expense["Date"] = str(date)
-                    EXPENSES.update_cell(
-                        row_index, 3, selected_expense["Date"]
-                    )
-                    print('Date updated successfully')
-
-            elif more_choice.lower() == 'n':
-                break
-            else:
-                print('Invalid choice. Please enter y (yes) or n (no).')
-
-    elif edit_choice.lower() == 'a':
-        # Get new amount
-        while True:
-            amount_input = input('\nEnter new expense amount: ')
-            if not amount_input:
-                continue
-            try:
-                amount = round(float(amount_input))
-                if amount <= 0:
-                    print('Invalid amount. Please enter a positive number.')
-                    continue
-                break
-            except ValueError:
-                print('Invalid amount. Please enter a valid number.')
-                continue
-
-        # Update the amount for the selected expense
-        selected_expense["Amount"] = amount
-        row_index = EXPENSES.find(selected_expense["Date"]).row
-        EXPENSES.update_cell(row_index, 1, selected_expense["Amount"])
-        print('Amount updated successfully')
-
-        # Ask if user wants to edit more parameters
-        while True:
-            more_choice = input(
-                '\nDo you want to edit more parameters '
-                'for this expense? (y/n) ')
-            if more_choice.lower() == 'y':
-                # Prompt user to choose what to edit
-                while True:
-                    try:
-                        edit_choice = input(
-                            '\nWould you like to edit the category, '
-                            'amount or date? (c / a / d) ')
-                        if edit_choice.lower() not in ['c', 'a', 'd']:
-                            raise ValueError()
-                        break
-                    except ValueError:
-                        print('Invalid choice. Please enter c '
-                              '(category), a (amount) or d (date).')
-                # Code for editing category, amount or date
-                # Display the selected expense details
-                print('\nSelected expense details:')
-                print(f'Category: {selected_expense["Category"]}')
-                print(f'Amount: {selected_expense["Amount"]}')
-                print(f'Date: {selected_expense["Date"]}')
-
-                if edit_choice.lower() == 'c':
-                    # Display category options to the user
-                    print('')
-                    print(f'{"Index":<6}{"Category":<15}')
-                    for i, category in enumerate(CATEGORIES):
-                        print(f"{i+1:<6}{category:<15}")
-
-                    # Prompt user for new category index
-                    while True:
-                        category_index_input = input(
-                            f"\nEnter the index of the new expense category "
-                            f"(1 - {len(CATEGORIES)}): "
-                        )
-                        if not category_index_input:
-                            continue
-                        try:
-                            category_index = int(category_index_input) - 1
-                            if category_index < 0 or category_index \
-                                    >= len(CATEGORIES):
-                                print(f"Invalid index. "
-                                      f"Please enter a number between 1 "
-                                      f"and {len(CATEGORIES)}")
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid index. '
-                                  'Please enter a valid number.')
-                            continue
-                    # Update the category for the selected expense
-                    selected_expense["Category"] = CATEGORIES[category_index]
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 2, selected_expense["Category"]
-                    )
-                    print('Category updated successfully')
-
-                elif edit_choice.lower() == 'a':
-                    # Get new amount
-                    while True:
-                        amount_input = input('\nEnter new expense amount: ')
-                        if not amount_input:
-                            continue
-                        try:
-                            amount = round(float(amount_input))
-                            if amount <= 0:
-                                print('Invalid amount. '
-                                      'Please enter a positive number.')
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid amount. '
-                                  'Please enter a valid number.')
-                            continue
-
-                    # Update the amount for the selected expense
-                    selected_expense["Amount"] = amount
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 1, selected_expense["Amount"]
-                    )
-                    print('Amount updated successfully')
-
-                elif edit_choice.lower() == 'd':
-                    # Get new date
-                    while True:
-                        date_input = input(
-                            '\nEnter new expense date (YYYY-MM-DD): '
-                        )
-                        if not date_input:
-                            continue
-                        try:
-                            date = datetime.strptime(
-                                date_input, '%Y-%m-%d'
-                            ).date()
-                            if date > date.today():
-                                print('Invalid date. '
-                                      'Please enter a date in the past '
-                                      'or today')
-                                continue
-                            break
-                        except ValueError:
-                            print("Incorrect date format. "
-                                  "Please enter a valid date in the "
-                                  "format YYYY-MM-DD.")
-                            continue
-
-                    # Update the date for the selected expense
-                    # Get the row index for the selected expense
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    # Update the date for the selected expense
-                    selected_expense["Date"] = str(date)
-                    EXPENSES.update_cell(
-                        row_index, 3, selected_expense["Date"]
-                    )
-                    print('Date updated successfully')
-
-            elif more_choice.lower() == 'n':
-                break
-            else:
-                print('Invalid choice. Please enter y (yes) or n (no).')
-
-    elif edit_choice.lower() == 'd':
-        # Get new date
-        while True:
-            date_input = input('\nEnter new expense date (YYYY-MM-DD): ')
-            if not date_input:
-                continue
-            try:
-                date = datetime.strptime(date_input, '%Y-%m-%d').date()
-                if date > date.today():
-                    print('Invalid date. '
-                          'Please enter a date in the past or today')
-                    continue
+            if more_choice.lower() in ['y', 'n']:
                 break
-            except ValueError:
-                print("Incorrect date format. "
-                      "Please enter a valid date in the format YYYY-MM-DD.")
-                continue
-
-        # Update the date for the selected expense
-        # Get the row index for the selected expense
-        row_index = EXPENSES.find(selected_expense["Date"]).row
-        # Update the date for the selected expense
-        selected_expense["Date"] = str(date)
-        EXPENSES.update_cell(row_index, 3, selected_expense["Date"])
-        print('Date updated successfully')
+            print('Invalid choice. Please enter y (yes) or n (no).')
+        if more_choice.lower() == 'n':
+            break
 
-        # Ask if user wants to edit more parameters
-        while True:
-            more_choice = input(
-                '\nDo you want to edit more '
-                'parameters for this expense? (y/n) '
-            )
-            if more_choice.lower() == 'y':
-                # Prompt user to choose what to edit
-                while True:
-                    try:
-                        edit_choice = input(
-                            '\nWould you like to edit the '
-                            'category, amount or date? (c / a / d) '
-                        )
-                        if edit_choice.lower() not in ['c', 'a', 'd']:
-                            raise ValueError()
-                        break
-                    except ValueError:
-                        print('Invalid choice. Please enter '
-                              'c (category), a (amount) or d (date).')
-                # Code for editing category, amount or date
-                # Display the selected expense details
-                print('\nSelected expense details:')
-                print(f'Category: {selected_expense["Category"]}')
-                print(f'Amount: {selected_expense["Amount"]}')
-                print(f'Date: {selected_expense["Date"]}')
-
-                if edit_choice.lower() == 'c':
-                    # Display category options to the user
-                    print('')
-                    print(f'{"Index":<6}{"Category":<15}')
-                    for i, category in enumerate(CATEGORIES):
-                        print(f"{i+1:<6}{category:<15}")
-
-                    # Prompt user for new category index
-                    while True:
-                        category_index_input = input(
-                            f"\nEnter the index of the new expense "
-                            f"category (1 - {len(CATEGORIES)}): "
-                        )
-                        if not category_index_input:
-                            continue
-                        try:
-                            category_index = int(category_index_input) - 1
-                            if category_index < 0 or category_index \
-                                    >= len(CATEGORIES):
-                                print(f"Invalid index. Please enter a number "
-                                      f"between 1 and {len(CATEGORIES)}")
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid index. '
-                                  'Please enter a valid number.')
-                            continue
-                    # Update the category for the selected expense
-                    selected_expense["Category"] = CATEGORIES[category_index]
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 2, selected_expense["Category"]
-                    )
-                    print('Category updated successfully')
-
-                elif edit_choice.lower() == 'a':
-                    # Get new amount
-                    while True:
-                        amount_input = input('\nEnter new expense amount: ')
-                        if not amount_input:
-                            continue
-                        try:
-                            amount = round(float(amount_input))
-                            if amount <= 0:
-                                print('Invalid amount. '
-                                      'Please enter a positive number.')
-                                continue
-                            break
-                        except ValueError:
-                            print('Invalid amount. '
-                                  'Please enter a valid number.')
-                            continue
-
-                    # Update the amount for the selected expense
-                    selected_expense["Amount"] = amount
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    EXPENSES.update_cell(
-                        row_index, 1, selected_expense["Amount"]
-                    )
-                    print('Amount updated successfully')
-
-                elif edit_choice.lower() == 'd':
-                    # Get new date
-                    while True:
-                        date_input = input(
-                            '\nEnter new expense date (YYYY-MM-DD): '
-                        )
-                        if not date_input:
-                            continue
-                        try:
-                            date = datetime.strptime(
-                                date_input, '%Y-%m-%d'
-                            ).date()
-                            if date > date.today():
-                                print('Invalid date. Please enter '
-                                      'a date in the past or today')
-                                continue
-                            break
-                        except ValueError:
-                            print("Incorrect date format. Please enter "
-                                  "a valid date in the format YYYY-MM-DD.")
-                            continue
-
-                    # Update the date for the selected expense
-                    # Get the row index for the selected expense
-                    row_index = EXPENSES.find(selected_expense["Date"]).row
-                    # Update the date for the selected expense
-                    selected_expense["Date"] = str(date)
-                    EXPENSES.update_cell(
-                        row_index, 3, selected_expense["Date"]
-                    )
-                    print('Date updated successfully')
-
-            elif more_choice.lower() == 'n':
-                break
-            else:
-                print('Invalid choice. Please enter y (yes) or n (no).')
+    # Save all changes of the selected expense with one request
+    try:
+        STORE.update_expense(selected_expense["id"], changes)
+        print('\nExpense updated successfully')
+    except KeyError:
+        print('\nThe expense was changed or deleted by someone else '
+              'and was not updated. Please select it again.')
 
     # Ask user whether they want to edit
     # another expense or return to the main menu
-    go_back_edit_expense()
+    return go_back('edit_expense')
 
 
 # Year statement function - user can see how much
@@ -696,29 +390,9 @@ def year_statement():
             print(f'Invalid year. Please enter a '
                   f'number between 1900 and {current_year} ')
 
-    # Read expenses form Google Sheets document
-    # Retrieve all rows of expenses from the sheet, except the header row
-    all_rows = EXPENSES.get_all_values()[1:]
-
-    # Calculate total expenses for the chosen year
-    total_expenses = {}
-
-    # Iterate over all the rows in the sheet
-    for row in all_rows:
-        # Parse the date of the expense from the row
-        expense_date = datetime.strptime(row[2], '%Y-%m-%d')
-
-        # Check if the expense was made in the chosen year
-        if expense_date.year == year:
-            # Get the category and amount of the expense from the row
-            category = row[1]
-            amount = int(row[0])
-
-            # Add the amount to the total for the category
-            if category in total_expenses:
-                total_expenses[category] += amount
-            else:
-                total_expenses[category] = amount
+    # Read total expenses for the chosen year from the store
+    wait_for_data()
+    total_expenses = STORE.year_totals(year)
 
     # Print total expenses for all categories
     # Calculate the total expenses for the chosen
@@ -749,15 +423,10 @@ def year_statement():
 
     if choice.lower() == 'y':
         # If the user wants to see the expenses for
-        # another year, call the function recursively
-        year_statement()
-    else:
-        # Otherwise, return to the previous menu
-        return
-
-    # Ask user whether they want to see another year
-    # statement or return to the main menu
-    go_back_exp_year()
+        # another year, show this statement again
+        return 'year_statement'
+    # Otherwise, return to the main menu
+    return 'menu'
 
 
 # Month statement function - user can see how much
@@ -800,29 +469,10 @@ def month_statement():
             print(f'Invalid month. Please enter a '
                   f'number between 1 and {max_month}. ')
 
-    # Read expenses from Google Sheets document
-    # Retrieve all rows of expenses from the sheet, except the header row
-    all_rows = EXPENSES.get_all_values()[1:]
-
-    # Calculate total expenses for all categories in the chosen month and year
-    total_expenses = {}
-
-    # Iterate over all the rows in the sheet
-    for row in all_rows:
-        # Parse the date of the expense from the row
-        expense_date = datetime.strptime(row[2], '%Y-%m-%d')
-
-        # Check if the expense was made in the chosen month and year
-        if expense_date.year == year and expense_date.month == month:
-            # Get the category and amount of the expense from the row
-            category = row[1]
-            amount = int(row[0])
-
-            # Add the amount to the total for the category
-            if category in total_expenses:
-                total_expenses[category] += amount
-            else:
-                total_expenses[category] = amount
+    # Read total expenses for all categories in the chosen
+    # month and year from the store
+    wait_for_data()
+    total_expenses = STORE.month_totals(year, month)
 
     # Print total expenses for all categories
     # Calculate the total expenses for the chosen month
@@ -850,16 +500,59 @@ def month_statement():
         except ValueError:
             print('Invalid choice. Please enter y (yes) or n (no).')
 
-    # If the user chose 'y', call the corresponding function
-    # to show the statement for another year or month
+    # If the user chose 'y', show the statement
+    # for another year and month
     if choice.lower() == 'y':
-        month_statement()
-    else:
-        return
+        return 'month_statement'
+    return 'menu'
+
+
+# Range statement function - user can see expenses with category
+# details for any date range, such as a fiscal year or a quarter
+def range_statement():
+    # Prompt user for the date range
+    while True:
+        try:
+            start, end = parse_date_range(input(
+                '\nEnter date range (e.g. 2023-04-06 to 2024-04-05) '
+                'or quarter (e.g. 2024-Q1): '))
+            break
+        except ValueError as error:
+            print(error)
+
+    # Read total expenses for all categories in the chosen
+    # date range from the store
+    wait_for_data()
+    total_expenses = STORE.range_totals(str(start), str(end))
+
+    # Calculate the total expenses for the chosen date range
+    # by summing up the expenses in all categories
+    total_range_expense = sum(total_expenses.values())
+
+    # Print the total expenses for all categories in the chosen range
+    print(f"\nTotal expenses for all categories "
+          f"from {start} to {end}: ${total_range_expense}\n")
+
+    # Print the expenses for each category
+    for category, amount in total_expenses.items():
+        print(f"{category}: ${amount}")
+        print('')
+
+    # Ask user if they want to see statement for another range
+    while True:
+        try:
+            choice = input('\nDo you want to see another statement? (y/n) ')
 
-    # Ask user whether they want to see another month
-    # statement or return to the main menu
-    go_back_exp_month()
+            # Validate user input - choice should be 'y' (yes) or 'n' (no)
+            if choice.lower() not in ['y', 'n']:
+                raise ValueError()
+            break
+        except ValueError:
+            print('Invalid choice. Please enter y (yes) or n (no).')
+
+    if choice.lower() == 'y':
+        return 'range_statement'
+    return 'menu'
 
 
 # Compare year expenses - user can compare two expenses
@@ -907,39 +600,19 @@ def compare_year_expenses():
     # Show user picked first date
     print(f'\nSecond year to compare: {year2}')
 
-    # Read expenses form Google Sheets document
-    all_rows = EXPENSES.get_all_values()[1:]
-
-    # Calculate total expenses for for each year and for each category
-    expenses_by_year_category = {}
-    total_expenses_by_year = {}
-
-    # Iterate over all the rows in the sheet
-    for row in all_rows:
-        # Parse the date of the expense from the row
-        expense_date = datetime.strptime(row[2], '%Y-%m-%d')
-        year = expense_date.year
-        category = row[1]
-
-        # Add the year to the expenses_by_year_category
-        # and total_expenses_by_year dictionaries if it
-        # doesn't already exist
-        if year not in expenses_by_year_category:
-            expenses_by_year_category[year] = {}
-            total_expenses_by_year[year] = 0
-
-        # Add the amount of the expense to the total
-        # for the year and the category
-        if category in expenses_by_year_category[year]:
-            expenses_by_year_category[year][category] += int(row[0])
-        else:
-            expenses_by_year_category[year][category] = int(row[0])
-
-        total_expenses_by_year[year] += int(row[0])
+    # Read total expenses for each category of the two years
+    # from the store
+    wait_for_data()
+    expenses_by_year_category = dict(zip(
+        (year1, year2), STORE.period_totals([year1, year2])))
+    total_expenses_by_year = {
+        year: sum(totals.values())
+        for year, totals in expenses_by_year_category.items()
+    }
 
     # Compare expenses by category by category for the two years
-    if year1 in expenses_by_year_category \
-            and year2 in expenses_by_year_category:
+    if expenses_by_year_category[year1] \
+            and expenses_by_year_category[year2]:
         # Print the total expenses for each of the two years
         print(f"\nTotal expenses in {year1}: ${total_expenses_by_year[year1]}")
         print(f"Total expenses in {year2}: ${total_expenses_by_year[year2]}\n")
@@ -981,16 +654,11 @@ def compare_year_expenses():
         except ValueError:
             print('Invalid choice. Please enter y (yes) or n (no).')
 
-    # Recurse if the user wants to see another year's statement,
-    # else return to the main menu
+    # Compare again if the user wants to see another year's
+    # statement, else return to the main menu
     if choice.lower() == 'y':
-        compare_year_expenses()
-    else:
-        return
-
-    # Ask user whether they want to compare another
-    # years or return to the main menu
-    go_back_compare_year()
+        return 'compare_year_expenses'
+    return 'menu'
 
 
 # Compare month expenses - user can compare two expenses
@@ -1059,29 +727,15 @@ def compare_month_expenses():
     # Show user picked first date
     print(f'\nSecond date to compare: {year2}/{month2}')
 
-    # Read expenses from Google Sheets document
-    all_rows = EXPENSES.get_all_values()[1:]
-
-    # Calculate total expense for both months
+    # Read total expense for both months from the store at once
+    wait_for_data()
+    totals1, totals2 = STORE.period_totals([(year1, month1),
+                                            (year2, month2)])
     expenses_by_month = {}
-    for row in all_rows:
-        expense_date = datetime.strptime(row[2], '%Y-%m-%d')
-        year = expense_date.year
-        month = expense_date.month
-        if year == year1 and month == month1:
-            category = row[1]
-            amount = int(row[0])
-            if category in expenses_by_month:
-                expenses_by_month[category][0] += amount
-            else:
-                expenses_by_month[category] = [amount, 0]
-        elif year == year2 and month == month2:
-            category = row[1]
-            amount = int(row[0])
-            if category in expenses_by_month:
-                expenses_by_month[category][1] += amount
-            else:
-                expenses_by_month[category] = [0, amount]
+    for category, amount in totals1.items():
+        expenses_by_month[category] = [amount, 0]
+    for category, amount in totals2.items():
+        expenses_by_month.setdefault(category, [0, 0])[1] = amount
 
     # Print total expenses for both months
     total_month1_expenses = sum([expenses_by_month[category][0]
@@ -1114,84 +768,93 @@ def compare_month_expenses():
 
     # Ask user whether they want to compare another
     # months or return to the main menu
-    go_back_compare_month()
+    return go_back('compare_month_expenses')
 
 
-# Function ask user if user want to go back to
-# the menu or stays and add another expense
-def go_back_add_expense():
+# Compare many periods function - user can compare any number of years
+# or months, such as every year on record or the last 12 months
+def compare_periods():
+    # Prompt user for years or months
     while True:
-        try:
-            choice = input('\nDo you want to go back to the main menu? (y/n) ')
-            if choice.lower() not in ['y', 'n']:
-                raise ValueError()
+        kind = input('\nWould you like to compare years or months? '
+                     '(y / m) ')
+        if kind.lower() in ['y', 'm']:
             break
-        except ValueError:
-            print('Invalid choice. Please enter y (yes) or n (no).')
+        print('Invalid choice. Please enter y (years) or m (months).')
 
-    if choice.lower() == 'y':
-        main()
-    else:
-        add_expense()
-
-
-# Function ask user if user want to go back to
-# the menu or stays and edit another expense
-def go_back_edit_expense():
     while True:
         try:
-            choice = input('\nDo you want to go back to the main menu? (y/n) ')
-            if choice.lower() not in ['y', 'n']:
-                raise ValueError()
+            if kind.lower() == 'y':
+                periods_input = input(
+                    '\nEnter years separated by spaces, or "all" '
+                    'for every year with expenses: ')
+                if periods_input.strip().lower() == 'all':
+                    wait_for_data()
+                    periods = sorted(STORE.totals_by_year())
+                else:
+                    periods = parse_years(periods_input)
+            else:
+                periods = parse_months(input(
+                    '\nEnter months (YYYY-MM) separated by spaces, or '
+                    'number of last months (e.g. 12): '))
             break
-        except ValueError:
-            print('Invalid choice. Please enter y (yes) or n (no).')
-
-    if choice.lower() == 'y':
-        main()
+        except ValueError as error:
+            print(error)
+
+    # Read totals of all the periods from the store at once
+    wait_for_data()
+    totals = STORE.period_totals(periods)
+    if kind.lower() == 'y':
+        names = [str(year) for year in periods]
     else:
-        edit_expense()
+        names = [f'{year}/{month}' for year, month in periods]
 
+    print('\nExpenses by category, with change from the previous period:')
+    print_period_matrix(names, totals)
 
-# Function ask user if user want to go back to the
-# menu or stays and see another year statement
-def go_back_exp_year():
-    while True:
-        try:
-            choice = input('\nDo you want to go back to the main menu? (y/n) ')
-            if choice.lower() not in ['y', 'n']:
-                raise ValueError()
-            break
-        except ValueError:
-            print('Invalid choice. Please enter y (yes) or n (no).')
+    # Ask user whether they want to compare other
+    # periods or return to the main menu
+    return go_back('compare_periods')
 
-    if choice.lower() == 'y':
-        main()
-    else:
-        year_statement()
 
+# Print totals of many periods as a matrix - categories in rows and
+# periods in columns, split in blocks which fit the terminal width
+def print_period_matrix(names, totals):
+    categories = list(dict.fromkeys(category for period_totals in totals
+                                    for category in period_totals))
+    rows = [('Total', [sum(period_totals.values())
+                       for period_totals in totals])]
+    for category in categories:
+        rows.append((category, [period_totals.get(category, 0)
+                                for period_totals in totals]))
 
-# Function ask user if user want to go back to the
-# menu or stays and see another month statement
-def go_back_exp_month():
-    while True:
-        try:
-            choice = input('\nDo you want to go back to the main menu? (y/n) ')
-            if choice.lower() not in ['y', 'n']:
-                raise ValueError()
-            break
-        except ValueError:
-            print('Invalid choice. Please enter y (yes) or n (no).')
-
-    if choice.lower() == 'y':
-        main()
-    else:
-        month_statement()
-
-
-# Function ask user if user want to go back to
-# the menu or stays and compare another years
-def go_back_compare_year():
+    for first in range(0, len(names), MATRIX_COLUMNS):
+        columns = range(first, min(first + MATRIX_COLUMNS, len(names)))
+        print('')
+        print(f'{"Category":<15}'
+              + ''.join(f'{names[column]:<16}' for column in columns))
+        for label, amounts in rows:
+            print(f'{label:<15}'
+                  + ''.join(f'{matrix_cell(amounts, column):<16}'
+                            for column in columns))
+
+
+# Amount of one matrix cell with change in percent from the previous
+# period, "new" when there was nothing in the previous period
+def matrix_cell(amounts, column):
+    amount = amounts[column]
+    previous = amounts[column - 1] if column > 0 else None
+    if previous:
+        change = (amount - previous) / previous * 100
+        return f'${amount} ({change:+.0f}%)'
+    if previous == 0 and amount:
+        return f'${amount} (new)'
+    return f'${amount}'
+
+
+# Function ask user if user want to go back to the menu or
+# stays on the same screen, return the state to show next
+def go_back(state):
     while True:
         try:
             choice = input('\nDo you want to go back to the main menu? (y/n) ')
@@ -1202,67 +865,100 @@ def go_back_compare_year():
             print('Invalid choice. Please enter y (yes) or n (no).')
 
     if choice.lower() == 'y':
-        main()
-    else:
-        compare_year_expenses()
-
-
-# Function ask user if user want to go back to the
-# menu or stays and compare another months
-def go_back_compare_month():
-    while True:
+        return 'menu'
+    return state
+
+
+# Menu function - show the main menu and return the state
+# of the option picked by the user. Quit keeps number 7 it always had,
+# options added later come after it
+def menu():
+    print("Welcome to the Personal Expense Tracker!")
+    print("\n===== MENU ======")
+    print("\nPlease select an option:")
+    print("1. Add an expense")
+    print("2. Edit an expense")
+    print("3. View expenses by year")
+    print("4. View expenses by month")
+    print("5. Compare expenses by year")
+    print("6. Compare expenses by month")
+    print("7. Quit")
+    print("8. Add expenses in batch")
+    print("9. View expenses by date range")
+    print("10. Compare many years or months")
+    timing.mark('menu shown')
+
+    choice = input("\nEnter your choice (1-10): ")
+
+    # Return the state of the user's choice
+    if choice in MENU_OPTIONS:
+        return MENU_OPTIONS[choice]
+    print("Invalid choice. Please enter a number from 1 to 10.")
+    return 'menu'
+
+
+# Quit function - send expenses which are not in Google Sheets document
+# yet, say goodbye and end the program
+def quit_program():
+    if STORE is not None:
+        DATA_READY.wait()
         try:
-            choice = input('\nDo you want to go back to the main menu? (y/n) ')
-            if choice.lower() not in ['y', 'n']:
-                raise ValueError()
-            break
-        except ValueError:
-            print('Invalid choice. Please enter y (yes) or n (no).')
-
-    if choice.lower() == 'y':
-        main()
-    else:
-        compare_month_expenses()
-
-
-# Main called function, where other functions are called from main menu
+            STORE.flush()
+        except Exception:
+            print('\nSome expenses are not saved to Google Sheets yet, '
+                  'they will be saved next time the program starts.')
+    print('\nGoodbye!')
+    time.sleep(3)
+    print('\nExiting program...')
+    time.sleep(3)
+    sys.exit()
+
+
+# States of the program by menu option
+MENU_OPTIONS = {
+    '1': 'add_expense',
+    '2': 'edit_expense',
+    '3': 'year_statement',
+    '4': 'month_statement',
+    '5': 'compare_year_expenses',
+    '6': 'compare_month_expenses',
+    '7': 'quit',
+    '8': 'add_expense_batch',
+    '9': 'range_statement',
+    '10': 'compare_periods',
+}
+
+# Screen function of every state - each screen returns the state to
+# show next, so screens never call each other and the call stack
+# doesn't grow however long the program is used
+SCREENS = {
+    'menu': menu,
+    'add_expense': add_expense,
+    'edit_expense': edit_expense,
+    'year_statement': year_statement,
+    'month_statement': month_statement,
+    'compare_year_expenses': compare_year_expenses,
+    'compare_month_expenses': compare_month_expenses,
+    'add_expense_batch': add_expense_batch,
+    'range_statement': range_statement,
+    'compare_periods': compare_periods,
+    'quit': quit_program,
+}
+
+
+# Main called function - show screens one after another, starting
+# with the main menu
 def main():
+    metrics.watch_input()
+    state = 'menu'
     while True:
-        print("Welcome to the Personal Expense Tracker!")
-        print("\n===== MENU ======")
-        print("\nPlease select an option:")
-        print("1. Add an expense")
-        print("2. Edit an expense")
-        print("3. View expenses by year")
-        print("4. View expenses by month")
-        print("5. Compare expenses by year")
-        print("6. Compare expenses by month")
-        print("7. Quit")
-
-        choice = input("\nEnter your choice (1-7): ")
-
-        # Calls the appropriate function based on the user's choice
-        if choice == '1':
-            add_expense()
-        elif choice == '2':
-            edit_expense()
-        elif choice == '3':
-            year_statement()
-        elif choice == '4':
-            month_statement()
-        elif choice == '5':
-            compare_year_expenses()
-        elif choice == '6':
-            compare_month_expenses()
-        elif choice == '7':
-            print('\nGoodbye!')
-            time.sleep(3)
-            print('\nExiting program...')
-            time.sleep(3)
-            sys.exit()
-        else:
-            print("Invalid choice. Please enter a number from 1 to 7.")
+        if state not in ('menu', 'quit'):
+            prefetch()
+        with metrics.operation(state):
+            state = SCREENS[state]()
 
 
-# Main function which is only one function called when program starts
-main()
+# Main function which is only one function called when program starts,
+# the screens can also be imported and run by benchmark.py
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Connection to the Google Sheets document, shared by the main
+# program and the command line tools.
+# gspread and google-auth take a while to import, so they are imported
+# only when the connection is opened. All requests go through the
+# scheduler in sheets_scheduler.py. When environment variable
+# EXPENSE_FAKE_SHEET is set, a fake spreadsheet kept in a local file is
+# used instead (see fake_sheet.py)
+import os
+import json
+import timing  # for timing authorization in the session metrics
+from sheets_scheduler import SCHEDULER, ScheduledSpreadsheet  # for\
+# keeping requests within the quota and retrying refused ones
+from token_cache import apply_cached_token  # for reusing access tokens
+
+# Define the required Google API scopes
+SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+    ]
+
+# Name of the Google Sheets document and its worksheet with expenses
+SPREADSHEET_NAME = 'personal-expense-tracker'
+EXPENSES_WORKSHEET = 'expenses'
+
+
+# Load the credentials from the JSON file and authorize access
+# to the required scopes
+def load_credentials():
+    from google.oauth2.service_account import Credentials  # for\
+    # authorizing access to Google Sheets API
+
+    if "GOOGLE_CREDS_JSON" in os.environ:
+        # ✅ Production / Heroku – creds from Config Var
+        service_account_info = json.loads(os.environ["GOOGLE_CREDS_JSON"])
+        creds = Credentials.from_service_account_info(service_account_info)
+    else:
+        # ✅ Local development – fallback to creds.json file
+        creds = Credentials.from_service_account_file("creds.json")
+    return creds.with_scopes(SCOPE)
+
+
+# Authorize access to the Google Sheets document
+# using the authorized credentials - access token is taken from
+# the token cache shared with other sessions when it's still valid
+def open_spreadsheet():
+    import gspread  # for interacting with Google Sheets API
+
+    with timing.phase('load credentials'):
+        credentials = load_credentials()
+        apply_cached_token(credentials)
+    with timing.phase('authorize'):
+        gspread_client = gspread.authorize(credentials)
+    return SCHEDULER.run('read', gspread_client.open, SPREADSHEET_NAME)
+
+
+# Open the spreadsheet with expenses, all its requests go through
+# the scheduler
+def open_expenses_spreadsheet():
+    if os.environ.get('EXPENSE_FAKE_SHEET'):
+        from fake_sheet import FakeSpreadsheet  # for testing without\
+        # network
+        return ScheduledSpreadsheet(FakeSpreadsheet.from_environment())
+    return ScheduledSpreadsheet(open_spreadsheet())
+
+
+# Open the worksheet with expenses
+def open_expenses_worksheet():
+    return open_expenses_spreadsheet().worksheet(EXPENSES_WORKSHEET)
@@ -0,0 +1,292 @@
+# Scheduler of Google Sheets requests - every call to the Sheets API goes
+# through one scheduler per process, which
+#  - keeps the number of requests per minute within the quota (read and
+#    write requests have separate budgets, as in Google Sheets API),
+#  - retries requests refused with 429 (quota exceeded) or 5xx errors
+#    after a random delay which doubles with every attempt - writes only
+#    after 429 and 503, which are sent before the write is made,
+#  - runs identical reads made at the same time only once and gives all
+#    the callers the same result,
+#  - joins writes waiting for their turn into one batch call, when they
+#    are of the same kind (append_rows or batch_update).
+import metrics  # for recording every request when metrics are enabled
+import os  # for reading environment variables
+import random  # for random delays between retries
+import re  # for reading the range of joined appends
+import threading  # for requests made from many threads
+import time  # for measuring and waiting for the request budget
+from collections import deque  # for times of recent requests
+
+# Requests per minute, can be changed with environment variables.
+# Google Sheets API allows 60 read and 60 write requests per minute
+# for every user
+READ_QUOTA = int(os.environ.get('SHEETS_READ_QUOTA', '60'))
+WRITE_QUOTA = int(os.environ.get('SHEETS_WRITE_QUOTA', '60'))
+
+# Retries of refused requests - delay before the first retry in seconds,
+# the longest delay and the number of retries
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 32
+MAX_RETRIES = 5
+
+# HTTP status codes of requests which are worth retrying. Writes such as
+# append_rows aren't safe to send twice, and 500, 502 and 504 can come
+# after the write was saved, so writes are retried only when they were
+# refused
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+WRITE_RETRY_STATUSES = (429, 503)
+
+# Writes which can be joined into one call - their first argument is
+# a list (rows or ranges with values) and the lists are joined
+BATCHED_WRITES = ('append_rows', 'batch_update')
+
+
+# Number of requests made in the last period - tells how long to wait
+# before the next request fits into the quota
+class RequestBudget:
+    def __init__(self, quota, period=60):
+        self.quota = quota
+        self.period = period
+        self.times = deque()
+
+    # Book the next request, return seconds to wait before it's sent
+    def reserve(self, now):
+        while self.times and self.times[0] <= now - self.period:
+            self.times.popleft()
+        start = now
+        if self.quota > 0 and len(self.times) >= self.quota:
+            start = self.times[-self.quota] + self.period
+        self.times.append(start)
+        return start - now
+
+
+# One request with its result, shared by all the callers waiting for it
+class PendingRequest:
+    def __init__(self, function=None, args=(), kwargs=None):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    # Wait until the request is done, return its result or raise its error
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class SheetsScheduler:
+    def __init__(self, read_quota=READ_QUOTA, write_quota=WRITE_QUOTA):
+        self.lock = threading.Lock()
+        self.budgets = {'read': RequestBudget(read_quota),
+                        'write': RequestBudget(write_quota)}
+        self.reads_in_flight = {}
+        self.pending_writes = deque()
+        self.writing = False
+        # Number of requests sent and retried, for diagnostics
+        self.sent = 0
+        self.retried = 0
+
+    # Run one request within the budget, retry it when it's refused
+    def run(self, kind, function, *args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            with self.lock:
+                wait = self.budgets[kind].reserve(time.monotonic())
+                self.sent += 1
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if metrics.ENABLED:
+                    return metrics.measure_request(kind, attempt, function,
+                                                   *args, **kwargs)
+                return function(*args, **kwargs)
+            except Exception as error:
+                if attempt == MAX_RETRIES or not is_retryable(error, kind):
+                    raise
+            with self.lock:
+                self.retried += 1
+            # Full jitter - random delay up to the doubled limit, so
+            # sessions refused at the same time don't retry together
+            time.sleep(random.uniform(
+                0, min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempt)))
+
+    # Read - callers asking for the same read while it's running get
+    # the result of the running request
+    def read(self, function, *args):
+        # Bound methods are equal when they belong to the same worksheet
+        key = (function, args)
+        with self.lock:
+            request = self.reads_in_flight.get(key)
+            running = request is not None
+            if not running:
+                request = PendingRequest()
+                self.reads_in_flight[key] = request
+        if running:
+            return request.wait()
+
+        try:
+            request.finish(result=self.run('read', function, *args))
+        except Exception as error:
+            request.finish(error=error)
+        finally:
+            with self.lock:
+                del self.reads_in_flight[key]
+        return request.wait()
+
+    # Write - writes are sent in the order they were made. The first
+    # caller sends them, and writes of the same kind made while it waits
+    # for the API are joined into one call
+    def write(self, function, *args, **kwargs):
+        request = PendingRequest(function, args, kwargs)
+        with self.lock:
+            self.pending_writes.append(request)
+            sending = not self.writing
+            self.writing = True
+        if sending:
+            self._send_writes()
+        return request.wait()
+
+    # Send the pending writes until there are none left
+    def _send_writes(self):
+        while True:
+            with self.lock:
+                if not self.pending_writes:
+                    self.writing = False
+                    return
+                group = [self.pending_writes.popleft()]
+                while (self.pending_writes and
+                       _can_join(group[0], self.pending_writes[0])):
+                    group.append(self.pending_writes.popleft())
+
+            first = group[0]
+            args = first.args
+            if len(group) > 1:
+                # One list with the rows or ranges of all the writes
+                joined = [item for request in group
+                          for item in request.args[0]]
+                args = (joined,) + first.args[1:]
+            try:
+                result = self.run('write', first.function, *args,
+                                  **first.kwargs)
+                results = [result] * len(group)
+                if len(group) > 1 and first.function.__name__ == \
+                        'append_rows':
+                    results = _split_append(group, result)
+                for request, request_result in zip(group, results):
+                    request.finish(result=request_result)
+            except Exception as error:
+                for request in group:
+                    request.finish(error=error)
+
+
+# Writes can be joined when they call the same method of the same
+# worksheet with the same options
+def _can_join(first, second):
+    return (first.function.__name__ in BATCHED_WRITES
+            and first.function == second.function
+            and first.args[1:] == second.args[1:]
+            and first.kwargs == second.kwargs)
+
+
+# Response of every joined append - the range of its own rows within
+# the range of all the joined rows, so callers know where their rows are
+def _split_append(group, result):
+    updates = result.get('updates', {}) if isinstance(result, dict) else {}
+    match = re.fullmatch(r'(.*!)?([A-Z]+)(\d+):([A-Z]+)\d+',
+                         updates.get('updatedRange', ''))
+    if not match:
+        return [result] * len(group)
+    sheet, first_column, first_row, last_column = match.groups()
+    results = []
+    row = int(first_row)
+    for request in group:
+        count = len(request.args[0])
+        results.append(dict(result, updates=dict(
+            updates, updatedRows=count,
+            updatedRange=f'{sheet or ""}{first_column}{row}:'
+                         f'{last_column}{row + count - 1}')))
+        row += count
+    return results
+
+
+# Requests refused because of the quota or a server error are retried.
+# Reads are also retried after network errors, writes aren't, because
+# the write could have been saved before the connection was lost
+def is_retryable(error, kind):
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is not None:
+        if kind == 'write':
+            return status in WRITE_RETRY_STATUSES
+        return status in RETRY_STATUSES
+    return kind == 'read' and isinstance(error, OSError)
+
+
+# Scheduler shared by all the worksheets of this process
+SCHEDULER = SheetsScheduler()
+
+
+# Worksheet which sends all its requests through the scheduler - has
+# the worksheet methods used by the program
+class ScheduledWorksheet:
+    def __init__(self, worksheet, scheduler=SCHEDULER):
+        self.worksheet = worksheet
+        self.scheduler = scheduler
+        self.title = worksheet.title
+
+    def get_all_values(self):
+        return self.scheduler.read(self.worksheet.get_all_values)
+
+    def get_values(self, range_name):
+        return self.scheduler.read(self.worksheet.get_values, range_name)
+
+    def batch_get(self, ranges):
+        return self.scheduler.read(self.worksheet.batch_get, tuple(ranges))
+
+    def append_rows(self, rows, **kwargs):
+        return self.scheduler.write(self.worksheet.append_rows, list(rows),
+                                    **kwargs)
+
+    def batch_update(self, data, **kwargs):
+        return self.scheduler.write(self.worksheet.batch_update, list(data),
+                                    **kwargs)
+
+    def sort(self, *specs, range=None):
+        return self.scheduler.write(self.worksheet.sort, *specs,
+                                    range=range)
+
+    def delete_rows(self, start_index, end_index=None):
+        return self.scheduler.write(self.worksheet.delete_rows, start_index,
+                                    end_index)
+
+
+# Spreadsheet which sends all its requests through the scheduler - its
+# worksheets are scheduled as well
+class ScheduledSpreadsheet:
+    def __init__(self, spreadsheet, scheduler=SCHEDULER):
+        self.spreadsheet = spreadsheet
+        self.scheduler = scheduler
+
+    def worksheet(self, title):
+        return ScheduledWorksheet(
+            self.scheduler.read(self.spreadsheet.worksheet, title),
+            self.scheduler)
+
+    def worksheets(self):
+        return [ScheduledWorksheet(worksheet, self.scheduler)
+                for worksheet in self.scheduler.read(
+                    self.spreadsheet.worksheets)]
+
+    def add_worksheet(self, title, rows, cols):
+        return ScheduledWorksheet(
+            self.scheduler.write(self.spreadsheet.add_worksheet, title,
+                                 rows, cols),
+            self.scheduler)
@@ -0,0 +1,330 @@
+# Date-sorted sheet store - keeps the rows of the expenses worksheet in
+# date order, and on disk only a small index with the number of rows of
+# every month. The first and last row of a month follow from the counts
+# of the months before it, so statements download only the rows of
+# their months with one batched range request instead of the whole
+# sheet. Has the same methods as store.LocalStore.
+#
+# New rows are appended and the sheet is sorted by date with one more
+# request when they don't belong at the end, edits which change the
+# date sort it as well. Every range read also takes the row before and
+# the row after the span - when they show that the index is out of date
+# (rows added or edited by another session), the index is built again
+# from the date column.
+#
+# Select it with environment variable EXPENSE_STORAGE=sorted.
+import json  # for reading and writing the index file
+import os  # for reading environment variables and replacing files
+import threading  # for requests made from many threads
+from replica import (COLUMN_LETTERS, COLUMNS, decode_amount,
+                     decode_date)  # for reading rows and writing cells
+# of the worksheet
+
+# Location of the month index, can be changed with environment variable
+INDEX_PATH = os.environ.get('EXPENSE_MONTH_INDEX_PATH',
+                            'expenses_month_index.json')
+
+# Column of the worksheet with the dates
+DATE_COLUMN = 3
+
+
+# Sort order of the date text as in Google Sheets - empty cells last
+def sort_key(date_text):
+    return not date_text, date_text
+
+
+# Month of the date text, 'YYYY-MM'. Dates sorted as text are sorted
+# by month too, so the rows of every month are next to each other
+def month_key(date_text):
+    return date_text[:7]
+
+
+class SortedSheetStore:
+    def __init__(self, worksheet, path=INDEX_PATH):
+        self.worksheet = worksheet
+        self.path = path
+        # month key -> number of rows, in date order
+        self.counts = {}
+        # month key -> first and last worksheet row of the month
+        self.spans = {}
+        self.row_count = 0
+        self.last_date = ''
+        # worksheet row -> values of the row given out by month_records
+        self.records = {}
+        self.lock = threading.RLock()
+
+    # Read the index saved by the previous session and index the rows
+    # added to the sheet since then
+    def load(self):
+        with self.lock:
+            try:
+                with open(self.path, encoding='utf-8') as index_file:
+                    data = json.load(index_file)
+                self.counts = dict(data['counts'])
+                self.last_date = data['last_date']
+            except (OSError, ValueError, KeyError):
+                self.counts = {}
+            self._index_spans()
+            self.refresh()
+
+    # Index rows added to the end of the sheet by others (for example
+    # the CSV importer), the sheet is sorted again when they are out of
+    # date order. Returns dates of the new rows, or None when the whole
+    # sheet was indexed
+    def refresh(self):
+        with self.lock:
+            values = self.worksheet.get_values(
+                f'C{self.row_count + 2}:C')
+            if self.row_count == 0:
+                self._index_dates(_column(values))
+                return None
+            if values:
+                self._add_dates(_column(values))
+            return _column(values)
+
+    # Nothing to send, writes are sent when they are made
+    def flush(self):
+        pass
+
+    # Append new expenses with one request, and sort the sheet when
+    # they don't belong at its end
+    def add_expenses(self, rows):
+        rows = [[int(row[0]), row[1], str(row[2])] for row in rows]
+        with self.lock:
+            self.worksheet.append_rows(rows)
+            self._add_dates([row[2] for row in rows])
+
+    # Save all changes of one expense with one batched request - row_id
+    # is the worksheet row of the expense, changes map column number
+    # (1 - 3) to the new value. The row is read back first, when another
+    # session moved the expense (rows added before it sort the sheet)
+    # it is found again in its month, and KeyError is raised when it
+    # was changed or deleted. A new date moves the expense to its place,
+    # so the sheet is sorted again
+    def update_expense(self, row_id, changes):
+        with self.lock:
+            expected = self.records.pop(row_id, None)
+            row_number = row_id
+            if expected is not None:
+                row_number = self._locate(row_id, expected)
+                if row_number is None:
+                    raise KeyError(row_id)
+            self.worksheet.batch_update([
+                {'range': f'{COLUMN_LETTERS[column - 1]}{row_number}',
+                 'values': [[value]]}
+                for column, value in sorted(changes.items())
+            ])
+            if DATE_COLUMN not in changes:
+                if expected is not None:
+                    for column, value in changes.items():
+                        expected[column - 1] = str(value)
+                    self.records[row_number] = expected
+                return
+            old_key = next((key for key, (first, last) in self.spans.items()
+                            if first <= row_number <= last), None)
+            if old_key is not None:
+                self.counts[old_key] -= 1
+            new_date = str(changes[DATE_COLUMN])
+            self.counts[month_key(new_date)] = (
+                self.counts.get(month_key(new_date), 0) + 1)
+            self.last_date = max(self.last_date, new_date, key=sort_key)
+            self._sort()
+            self._index_spans()
+            self._save()
+
+    # Expenses from the chosen month and year as dictionaries, the id
+    # is the worksheet row
+    def month_records(self, year, month):
+        rows = self._read_periods([(year, month)])[0]
+        with self.lock:
+            self.records.update((row_number, list(row))
+                                for row_number, row in rows)
+        return [
+            {'id': row_number, 'Amount': decode_amount(row[0], row[0]),
+             'Category': row[1], 'Date': row[2]}
+            for row_number, row in rows
+        ]
+
+    # Category totals for the chosen year
+    def year_totals(self, year):
+        return self.period_totals([year])[0]
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        return self.period_totals([(year, month)])[0]
+
+    # Category totals for every year with expenses, from one range with
+    # all the rows
+    def totals_by_year(self):
+        rows_by_year = {}
+        for _, row in self._read([lambda key: True])[0]:
+            packed_date = decode_date(row[2])
+            if packed_date:
+                rows_by_year.setdefault(packed_date // 10000,
+                                        []).append(row)
+        return {year: _totals(rows_by_year[year])
+                for year in sorted(rows_by_year)}
+
+    # Category totals of many periods at once - years, or [year, month]
+    # pairs for months - with one batched range request
+    def period_totals(self, periods):
+        return [_totals(row for _, row in rows)
+                for rows in self._read_periods(periods)]
+
+    # Category totals from the start date to the end date (both
+    # included, YYYY-MM-DD text), the rows of the months of the range
+    # are downloaded and the days outside it left out
+    def range_totals(self, start, end):
+        rows = self._read([
+            lambda key: month_key(start) <= key <= month_key(end)])[0]
+        return _totals(row for _, row in rows if start <= row[2] <= end)
+
+    # Rows of the periods (years, or [year, month] pairs) with their
+    # worksheet rows, one list for every period
+    def _read_periods(self, periods):
+        prefixes = [f'{period[0]}-{period[1]:02d}'
+                    if isinstance(period, (list, tuple)) else f'{period}-'
+                    for period in periods]
+        return self._read([
+            lambda key, prefix=prefix: key.startswith(prefix)
+            for prefix in prefixes])
+
+    # Rows of the months chosen by every filter (function of the month
+    # key), with their worksheet rows, with one batched request. Months
+    # of one filter are next to each other in the sheet. Rows around
+    # every span are read as well - when they show the index is out of
+    # date, the index is built again and the rows read again
+    def _read(self, filters, check=True):
+        with self.lock:
+            spans = []
+            for month_filter in filters:
+                group = [self.spans[key] for key in self.counts
+                         if month_filter(key)]
+                if group:
+                    spans.append((group[0][0], group[-1][1]))
+                else:
+                    spans.append(None)
+            ranges = [f'A{first - 1}:C{last + 1}'
+                      for first, last in filter(None, spans)]
+            values = iter(self.worksheet.batch_get(ranges) if ranges else [])
+
+            results = []
+            for month_filter, span in zip(filters, spans):
+                if span is None:
+                    results.append([])
+                    continue
+                first, last = span
+                rows = _pad(next(values))
+                if check and not _matches(rows, month_filter,
+                                          last - first + 1):
+                    self._index_dates(_column(
+                        self.worksheet.get_values('C2:C')))
+                    return self._read(filters, check=False)
+                results.append(list(zip(range(first, last + 1),
+                                        rows[1:last - first + 2])))
+            return results
+
+    # Worksheet row with the expected values - the row of the expense
+    # when it still has them, otherwise the nearest row of its month
+    # with them, None when no row has them any more
+    def _locate(self, row_number, expected):
+        values = self.worksheet.get_values(f'A{row_number}:C{row_number}')
+        if _pad(values)[:1] == [expected]:
+            return row_number
+        rows = self._read([
+            lambda key: key == month_key(expected[2])])[0]
+        return min((number for number, row in rows if row == expected),
+                   default=None,
+                   key=lambda number: abs(number - row_number))
+
+    # Index all the rows of the sheet from its date column (rows from
+    # row 2 down), the sheet is sorted when they are not in date order
+    def _index_dates(self, dates):
+        self.row_count = len(dates)
+        sorted_dates = sorted(dates, key=sort_key)
+        if dates != sorted_dates:
+            self._sort()
+        self.counts = {}
+        for date_text in sorted_dates:
+            key = month_key(date_text)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.last_date = sorted_dates[-1] if sorted_dates else ''
+        self._index_spans()
+        self._save()
+
+    # Index rows added at the end of the sheet, the sheet is sorted
+    # when they are not later than the rows before them
+    def _add_dates(self, dates):
+        in_order = (dates == sorted(dates, key=sort_key)
+                    and sort_key(dates[0]) >= sort_key(self.last_date))
+        self.row_count += len(dates)
+        if not in_order:
+            self._sort()
+        for date_text in dates:
+            key = month_key(date_text)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.last_date = max([self.last_date, *dates], key=sort_key)
+        self._index_spans()
+        self._save()
+
+    # Sort the rows of the sheet by date with one request
+    def _sort(self):
+        if self.row_count > 1:
+            self.worksheet.sort((DATE_COLUMN, 'asc'),
+                                range=f'A2:C{self.row_count + 1}')
+
+    # First and last row of every month from the counts, months in
+    # date order
+    def _index_spans(self):
+        self.counts = {key: self.counts[key]
+                       for key in sorted(self.counts, key=sort_key)
+                       if self.counts[key] > 0}
+        self.spans = {}
+        first = 2
+        for key, count in self.counts.items():
+            self.spans[key] = (first, first + count - 1)
+            first += count
+        self.row_count = max(self.row_count, first - 2)
+
+    # Write the index to disk - write to temporary file first and then
+    # replace the old one, so an interrupted save never breaks the index
+    def _save(self):
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump({'counts': self.counts, 'last_date': self.last_date},
+                      index_file)
+        os.replace(temp_path, self.path)
+
+
+# Dates of the values of the date column, empty cells as empty text
+def _column(values):
+    return [row[0] if row else '' for row in values]
+
+
+# Make sure every row has all the columns
+def _pad(rows):
+    return [(list(row) + [''] * COLUMNS)[:COLUMNS] for row in rows]
+
+
+# Rows read with the row before and after a span match the index when
+# the rows of the span are from the chosen months and the rows around
+# it are not
+def _matches(rows, month_filter, count):
+    inside = rows[1:count + 1]
+    outside = [rows[0]] + rows[count + 1:count + 2]
+    return (len(inside) == count
+            and all(month_filter(month_key(row[2])) for row in inside)
+            and not any(month_filter(month_key(row[2]))
+                        for row in outside[1:])
+            and (outside[0][2] == 'Date'
+                 or not month_filter(month_key(outside[0][2]))))
+
+
+# Category totals of rows with a valid date and a whole number amount
+def _totals(rows):
+    totals = {}
+    for row in rows:
+        amount = decode_amount(row[0])
+        if decode_date(row[2]) and amount is not None:
+            totals[row[1]] = totals.get(row[1], 0) + amount
+    return totals
@@ -0,0 +1,183 @@
+# SQLite store - keeps the expenses in a local SQLite database instead
+# of Google Sheets, for large datasets and installs without network
+# access. Has the same methods as store.LocalStore. Statements are
+# aggregate queries answered from the index on date, so they don't
+# read every expense.
+#
+# Select it with environment variable EXPENSE_STORAGE=sqlite. Expenses
+# from Google Sheets can be copied into the database with:
+#     python3 sqlite_store.py
+import os  # for reading environment variables
+import sqlite3  # for the local database
+import sys  # for interacting with the system
+
+# Location of the database, can be changed with environment variable
+SQLITE_PATH = os.environ.get('EXPENSE_SQLITE_PATH', 'expenses.db')
+
+# Table columns of the worksheet columns (1 - 3) used by update_expense
+COLUMN_NAMES = {1: 'amount', 2: 'category', 3: 'date'}
+
+# Dates are kept as ISO text (YYYY-MM-DD), which sorts in date order, so
+# a year or month is a range of the date index. The date index also
+# holds category and amount, so statements are answered from the index
+# without reading the table
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS expenses (
+    id INTEGER PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS expenses_date
+    ON expenses (date, category, amount);
+CREATE INDEX IF NOT EXISTS expenses_category
+    ON expenses (category, date);
+'''
+
+
+class SQLiteStore:
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.connection = None
+
+    # Open the database and create the table and indexes when missing
+    def load(self):
+        # Data is loaded in a background thread and used in the main one
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    # Nothing to download, the database is the only copy of the data
+    def refresh(self):
+        pass
+
+    # Nothing to send, writes are saved when they are made
+    def flush(self):
+        pass
+
+    # Save new expenses (amount, category, date) in one transaction
+    def add_expenses(self, rows):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO expenses (amount, category, date) '
+                'VALUES (?, ?, ?)',
+                [(int(row[0]), row[1], str(row[2])) for row in rows])
+
+    # Save all changes of one expense - changes map column
+    # number (1 - 3) to the new value
+    def update_expense(self, row_id, changes):
+        columns = sorted(changes)
+        assignments = ', '.join(f'{COLUMN_NAMES[column]} = ?'
+                                for column in columns)
+        values = [int(changes[column]) if column == 1
+                  else str(changes[column]) for column in columns]
+        with self.connection:
+            cursor = self.connection.execute(
+                f'UPDATE expenses SET {assignments} WHERE id = ?',
+                values + [row_id])
+        if cursor.rowcount == 0:
+            raise KeyError(row_id)
+
+    # Expenses from the chosen month and year as dictionaries
+    def month_records(self, year, month):
+        start, end = _month_range(year, month)
+        cursor = self.connection.execute(
+            'SELECT id, amount, category, date FROM expenses '
+            'WHERE date >= ? AND date < ? ORDER BY id', (start, end))
+        return [{'id': row_id, 'Amount': amount, 'Category': category,
+                 'Date': date}
+                for row_id, amount, category, date in cursor]
+
+    # Category totals for the chosen year
+    def year_totals(self, year):
+        return self._category_totals(f'{year:04d}-01-01',
+                                     f'{year + 1:04d}-01-01')
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        return self._category_totals(*_month_range(year, month))
+
+    # Category totals for every year with expenses
+    def totals_by_year(self):
+        cursor = self.connection.execute(
+            'SELECT CAST(substr(date, 1, 4) AS INTEGER) AS year, category, '
+            'SUM(amount) FROM expenses GROUP BY year, category')
+        totals = {}
+        for year, category, amount in cursor:
+            totals.setdefault(year, {})[category] = amount
+        return totals
+
+    # Category totals of many periods at once - years, or [year, month]
+    # pairs for months - from one query grouped by month over the whole
+    # span of the periods
+    def period_totals(self, periods):
+        ranges = [_month_range(*period)
+                  if isinstance(period, (list, tuple))
+                  else (f'{period:04d}-01-01', f'{period + 1:04d}-01-01')
+                  for period in periods]
+        if not ranges:
+            return []
+        cursor = self.connection.execute(
+            'SELECT substr(date, 1, 7) AS month, category, SUM(amount) '
+            'FROM expenses WHERE date >= ? AND date < ? '
+            'GROUP BY month, category',
+            (min(start for start, _ in ranges),
+             max(end for _, end in ranges)))
+        month_totals = cursor.fetchall()
+        results = []
+        for start, end in ranges:
+            totals = {}
+            for month, category, amount in month_totals:
+                if start[:7] <= month < end[:7]:
+                    totals[category] = totals.get(category, 0) + amount
+            results.append(totals)
+        return results
+
+    # Category totals from the start date to the end date (both
+    # included, YYYY-MM-DD text)
+    def range_totals(self, start, end):
+        cursor = self.connection.execute(
+            'SELECT category, SUM(amount) FROM expenses '
+            'WHERE date >= ? AND date <= ? GROUP BY category', (start, end))
+        return dict(cursor.fetchall())
+
+    # Category totals of the expenses from start date up to end date
+    # (not included), both ISO text
+    def _category_totals(self, start, end):
+        cursor = self.connection.execute(
+            'SELECT category, SUM(amount) FROM expenses '
+            'WHERE date >= ? AND date < ? GROUP BY category', (start, end))
+        return dict(cursor.fetchall())
+
+
+# First day of the month and first day of the next month as ISO text
+def _month_range(year, month):
+    if month == 12:
+        return f'{year:04d}-12-01', f'{year + 1:04d}-01-01'
+    return f'{year:04d}-{month:02d}-01', f'{year:04d}-{month + 1:02d}-01'
+
+
+# Copy all the expenses from the Google Sheets document into
+# an empty database
+def main():
+    from sheets import open_expenses_worksheet  # for Google Sheets document
+    from validation import parse_date  # for checking dates of the rows
+
+    store = SQLiteStore()
+    store.load()
+    if store.connection.execute('SELECT 1 FROM expenses LIMIT 1').fetchone():
+        sys.exit(f'{store.path} already has expenses, nothing was copied')
+
+    rows = []
+    skipped = 0
+    for row in open_expenses_worksheet().get_all_values()[1:]:
+        try:
+            rows.append([int(row[0]), row[1], str(parse_date(row[2]))])
+        except (ValueError, IndexError):
+            skipped += 1
+    store.add_expenses(rows)
+    print(f'Copied {len(rows)} expenses to {store.path}, '
+          f'skipped {skipped} rows without valid amount or date')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+# Expense store - keeps the local replica, the columnar table and the
+# rollup of expenses in step. Every read and write of the program goes
+# through a store: LocalStore holds the data of the Google Sheets
+# document in this process, sqlite_store.SQLiteStore keeps it in a local
+# database, and cache_daemon.CacheClient asks the shared cache daemon
+import os  # for reading environment variables
+import threading  # for sending writes to the sheet in the background
+import time  # for waiting for more writes before they are sent
+import timing  # for timing the steps of loading
+from journal import WriteJournal  # for writes not sent to the sheet yet
+from replica import REPLICA_PATH, LocalReplica  # for the local copy of\
+# the worksheet
+from rollup import ExpenseRollup  # for precomputed category totals
+from table import ExpenseTable  # for columnar table of expenses
+
+# Storage backend, can be changed with environment variable:
+# 'sheets' for Google Sheets document, 'partitioned' for Google Sheets
+# document with one worksheet per year, 'sorted' for Google Sheets
+# document kept in date order and read by month, 'sqlite' for local
+# database
+STORAGE_BACKEND = os.environ.get('EXPENSE_STORAGE', 'sheets')
+
+# Seconds the background flusher waits after a write, so writes made
+# in the meantime are sent to the sheet together
+FLUSH_DELAY = float(os.environ.get('EXPENSE_FLUSH_DELAY', '2'))
+
+
+# Local store of the Google Sheets document. New and edited expenses
+# are written to the write journal and the replica, and the user gets
+# the confirmation at once. A background thread sends them to the
+# sheet in batches - all new rows with one append and all edited cells
+# with one batch update. The replica file is saved after they are sent,
+# not on every write - the journal is what keeps them safe, and writes
+# not in the saved replica are replayed from it after a crash
+class LocalStore:
+    def __init__(self, worksheet, journal=None, replica_path=REPLICA_PATH):
+        self.replica = LocalReplica(worksheet, replica_path)
+        self.journal = journal or WriteJournal()
+        self.table = None
+        self.rollup = None
+        # Writes are sent through the journal when this process has it,
+        # otherwise (another session uses it) straight to the sheet
+        self.journaled = False
+        # Guards the replica, journal, table and rollup against
+        # the flusher thread
+        self.lock = threading.RLock()
+        # Only one flush at a time, taken before self.lock
+        self.flush_lock = threading.RLock()
+        self.pending_writes = threading.Event()
+        # Set when the sheet has fewer rows than this session expects, the
+        # next sync downloads the whole sheet
+        self.needs_full_sync = False
+        # Dates of rows of other sessions put into the replica by a flush,
+        # returned by the next refresh()
+        self.changed_dates = []
+
+    # Load the local replica, send writes left in the journal by the
+    # previous session, download only the rows added since the last
+    # session and build table and rollup of all the expenses
+    def load(self):
+        with self.lock, timing.phase('read replica'):
+            self.replica.load()
+            self.journaled = self.journal.acquire()
+            # Only the session with the journal saves the shared replica
+            self.replica.saving = self.journaled
+            if self.journaled:
+                self.journal.load()
+                self._replay_journal()
+        with timing.phase('send journal'):
+            self.flush(check_uploaded=True)
+        with self.lock:
+            with timing.phase('sync replica'):
+                self.replica.sync(full=self.needs_full_sync)
+                self.needs_full_sync = False
+                self.changed_dates = []
+            with timing.phase('build totals'):
+                self._build()
+        if self.journaled:
+            threading.Thread(target=self._flusher, daemon=True).start()
+
+    # Download rows added to the worksheet since the last sync, the
+    # writes of this session are sent first, so the rows line up.
+    # Returns dates of the new rows (and of rows of other sessions
+    # found by flushes since the last refresh), or None when the whole
+    # sheet was downloaded again and anything could have changed
+    def refresh(self):
+        with self.flush_lock, self.lock:
+            self.flush()
+            row_count = len(self.replica.rows)
+            full_synced_at = self.replica.full_synced_at
+            self.replica.sync(full=self.needs_full_sync)
+            self.needs_full_sync = False
+            changed_dates = self.changed_dates
+            self.changed_dates = []
+            if self.replica.full_synced_at != full_synced_at:
+                # Whole sheet was downloaded again
+                self._build()
+                return None
+            new_rows = self.replica.rows[row_count:]
+            if new_rows:
+                self._add_to_totals(new_rows)
+            return changed_dates + [row[2] for row in new_rows]
+
+    # Add new expenses to the journal, replica, table and rollup, they
+    # are sent to the sheet in the background
+    def add_expenses(self, rows):
+        rows = [[int(row[0]), row[1], str(row[2])] for row in rows]
+        with self.lock:
+            expected_row = len(self.replica.rows) + 2
+            uploaded_row = None
+            if self.journaled:
+                self.journal.record({'op': 'add', 'rows': rows,
+                                     'first_id': self.replica.next_id})
+            else:
+                uploaded_row = self.replica.upload_rows(rows)
+            self.replica.add_rows(rows)
+            self._add_to_totals(rows)
+            if not self.journaled:
+                self._place_rows(uploaded_row, expected_row)
+        self.pending_writes.set()
+
+    # Save all changes of one expense - changes map column number
+    # (1 - 3) to the new value, they are sent to the sheet in the
+    # background. The values the row has now are kept with them, so
+    # the row is checked in the sheet before it's written
+    def update_expense(self, row_id, changes):
+        with self.lock:
+            row_number = self.replica.row_number(row_id)
+            old = list(self.replica.rows[row_number - 2])
+            if self.journaled:
+                self.journal.record({
+                    'op': 'update', 'id': row_id, 'old': old,
+                    'changes': {str(column): value
+                                for column, value in changes.items()}})
+            elif not self.replica.upload_cells({row_id: (old, changes)}):
+                self.needs_full_sync = True
+            self._set_cells(row_number, changes)
+        self.pending_writes.set()
+
+    # Delete one expense from the sheet at once - writes waiting in the
+    # journal are sent first, so the sheet rows match the replica. When
+    # the row was moved by another session, the next refresh downloads
+    # the whole sheet
+    def delete_expense(self, row_id):
+        with self.flush_lock, self.lock:
+            self.flush()
+            if not self.replica.delete_row(row_id):
+                self.needs_full_sync = True
+            self._build()
+
+    # Send all the writes from the journal to the sheet - new rows with
+    # one append and edited cells with one batch update. check_uploaded
+    # is used after a crash: new rows already in the sheet (at the end
+    # of the replica or below rows of other sessions) aren't sent again
+    def flush(self, check_uploaded=False):
+        with self.flush_lock:
+            with self.lock:
+                entries = self.journal.pending() if self.journaled else []
+                if not entries:
+                    return
+                new_rows, first_row, edits = self._collect(entries)
+            if new_rows and check_uploaded:
+                offset = _find_block(
+                    self.replica.download_rows(first_row),
+                    [[str(value) for value in row] for row in new_rows])
+                if offset is not None:
+                    new_rows = []
+                    self._place_rows(first_row + offset, first_row)
+            if new_rows:
+                self._place_rows(self.replica.upload_rows(new_rows),
+                                 first_row)
+            if edits and not self.replica.upload_cells(edits):
+                # Rows were moved by another session
+                self.needs_full_sync = True
+            with self.lock:
+                # Saved before the entries are marked done, so a crash in
+                # between replays them into a replica which has them
+                self.replica.save()
+                self.journal.mark_done(entries)
+
+    # Expenses from the chosen month and year as dictionaries. Readers
+    # take the lock too - the flusher can put rows of other sessions
+    # into the replica and build the table again meanwhile
+    def month_records(self, year, month):
+        with self.lock:
+            return self.replica.month_records(year, month)
+
+    # Category totals for the chosen year
+    def year_totals(self, year):
+        with self.lock:
+            return self.rollup.year_totals(year)
+
+    # Category totals for the chosen month and year
+    def month_totals(self, year, month):
+        with self.lock:
+            return self.rollup.month_totals(year, month)
+
+    # Category totals for every year with expenses
+    def totals_by_year(self):
+        with self.lock:
+            return self.rollup.totals_by_year()
+
+    # Category totals of many periods at once - years, or [year, month]
+    # pairs for months - taken from the rollup built in one pass
+    def period_totals(self, periods):
+        with self.lock:
+            return [self.rollup.month_totals(*period)
+                    if isinstance(period, (list, tuple))
+                    else self.rollup.year_totals(period)
+                    for period in periods]
+
+    # Category totals from the start date to the end date (both
+    # included, YYYY-MM-DD text), found with the date index of the table
+    def range_totals(self, start, end):
+        with self.lock:
+            return self.table.range_totals(start, end)
+
+    # Load expenses into columnar table and build category totals for
+    # every year and month once with vectorized group-by
+    def _build(self):
+        self.table = ExpenseTable.from_rows(self.replica.rows,
+                                            self.replica.dates)
+        self.rollup = ExpenseRollup()
+        self.rollup.build(self.table)
+
+    # Add rows from the end of the replica to the table and rollup
+    def _add_to_totals(self, rows):
+        packed_dates = self.replica.dates[-len(rows):]
+        self.table.append(rows, packed_dates)
+        for row, packed_date in zip(rows, packed_dates):
+            self.rollup.add(row, packed_date)
+
+    # Rows of this session were appended from uploaded_row on, but were
+    # expected at expected_row - other sessions appended rows since the
+    # last sync, and they went before them. Those rows are downloaded
+    # and put in front of them in the replica. When the sheet has fewer
+    # rows than expected, the next sync downloads the whole sheet
+    def _place_rows(self, uploaded_row, expected_row):
+        if uploaded_row is None or uploaded_row == expected_row:
+            return
+        others = []
+        if uploaded_row > expected_row:
+            others = self.replica.download_rows(expected_row,
+                                                uploaded_row - 1)
+        with self.lock:
+            if len(others) != uploaded_row - expected_row:
+                self.needs_full_sync = True
+                return
+            self.replica.insert_rows(others, expected_row)
+            self._build()
+            self.changed_dates.extend(row[2] for row in others)
+
+    # Change cells of one row in the replica, table and rollup
+    def _set_cells(self, row_number, changes):
+        position = row_number - 2
+        replica = self.replica
+        self.rollup.remove(replica.rows[position], replica.dates[position])
+        replica.set_cells(row_number, changes)
+        self.table.set_row(position, replica.rows[position],
+                           replica.dates[position])
+        self.rollup.add(replica.rows[position], replica.dates[position])
+
+    # Apply journal entries which didn't get into the saved replica
+    # before the previous session ended. Table and rollup are built
+    # after this, so only the replica is changed
+    def _replay_journal(self):
+        for entry in self.journal.pending():
+            if entry['op'] == 'add':
+                if entry['first_id'] >= self.replica.next_id:
+                    self.replica.next_id = entry['first_id']
+                    self.replica.add_rows(entry['rows'])
+            elif entry['id'] in self.replica.row_numbers:
+                self.replica.set_cells(
+                    self.replica.row_number(entry['id']),
+                    {int(column): value
+                     for column, value in entry['changes'].items()})
+
+    # New rows, worksheet row of the first new row and edits of the
+    # journal entries - edits map row id to the values the row had
+    # before its first edit and all its changes. New rows are always at
+    # the end of the replica, edits of new rows are made in them before
+    # they are sent
+    def _collect(self, entries):
+        new_rows = []
+        first_row = None
+        new_ids = {}
+        edits = {}
+        for entry in entries:
+            if entry['op'] == 'add':
+                if first_row is None:
+                    first_row = self.replica.row_number(entry['first_id'])
+                for offset, row in enumerate(entry['rows']):
+                    new_ids[entry['first_id'] + offset] = len(new_rows)
+                    new_rows.append(list(row))
+                continue
+            changes = {int(column): value
+                       for column, value in entry['changes'].items()}
+            if entry['id'] in new_ids:
+                row = new_rows[new_ids[entry['id']]]
+                for column, value in changes.items():
+                    row[column - 1] = value
+            elif entry['id'] in self.replica.row_numbers:
+                edits.setdefault(entry['id'],
+                                 (entry.get('old'), {}))[1].update(changes)
+        return new_rows, first_row, edits
+
+    # Background flusher - sends the writes a moment after they are
+    # made, failed sends are tried again after the next delay
+    def _flusher(self):
+        while True:
+            self.pending_writes.wait()
+            time.sleep(FLUSH_DELAY)
+            self.pending_writes.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.pending_writes.set()
+
+
+# Position of the block of rows in the rows, None when it isn't there
+def _find_block(rows, block):
+    for offset in range(len(rows) - len(block) + 1):
+        if rows[offset:offset + len(block)] == block:
+            return offset
+    return None
+
+
+# Open the store of the configured storage backend, the data is read
+# when load() is called
+def open_store(backend=STORAGE_BACKEND):
+    if backend == 'sheets':
+        from sheets import open_expenses_worksheet  # for Google Sheets\
+        # document
+        return LocalStore(open_expenses_worksheet())
+    if backend == 'partitioned':
+        from partitions import PartitionedStore  # for one worksheet\
+        # per year
+        from sheets import open_expenses_spreadsheet  # for Google Sheets\
+        # document
+        return PartitionedStore(open_expenses_spreadsheet())
+    if backend == 'sorted':
+        from sheets import open_expenses_worksheet  # for Google Sheets\
+        # document
+        from sorted_sheet import SortedSheetStore  # for reading only the\
+        # rows of the chosen months
+        return SortedSheetStore(open_expenses_worksheet())
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteStore  # for local database
+        return SQLiteStore()
+    raise ValueError(f'Unknown storage backend: {backend}')
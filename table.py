@@ -0,0 +1,201 @@
+# Columnar table of expenses - every column is kept in one NumPy array,
+# so totals by year, month and category are computed with vectorized
+# bincount operations instead of Python loops over all the rows
+import numpy as np  # for columnar arrays and vectorized group-by
+from replica import decode_amount  # for reading amounts of the rows
+from validation import CATEGORIES  # for category codes
+
+# Initial number of rows reserved for the arrays
+INITIAL_CAPACITY = 1024
+
+
+# Expense table - amounts (int64), category codes (uint8, position in
+# self.categories which starts with CATEGORIES) and dates as day numbers
+# (int32, days since 1970-01-01). Year and month of every row are kept
+# as separate columns too, so group-by doesn't have to decode dates.
+# Rows are in the same order as in the replica. Rows without a valid
+# date or a whole number amount are kept, but left out of all totals.
+# Year and month statements are answered by the rollup built from
+# group_by_month() (see rollup.py).
+# Date index - positions of the valid rows sorted by date, with their
+# day numbers in the same order, so a date range is found with binary
+# search. It's built on the first range query and kept up to date when
+# rows are appended in date order, other changes drop it
+class ExpenseTable:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.categories = list(CATEGORIES)
+        self.category_codes = {
+            category: code for code, category in enumerate(self.categories)
+        }
+        self.size = 0
+        self.amounts = np.zeros(capacity, dtype=np.int64)
+        self.codes = np.zeros(capacity, dtype=np.uint8)
+        self.days = np.zeros(capacity, dtype=np.int32)
+        self.years = np.zeros(capacity, dtype=np.int16)
+        self.months = np.zeros(capacity, dtype=np.int8)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.date_order = None
+        self.sorted_days = None
+
+    # Build the table from rows in the get_all_values() format and
+    # their dates decoded into packed integers YYYYMMDD
+    @classmethod
+    def from_rows(cls, rows, packed_dates):
+        table = cls(max(len(rows), INITIAL_CAPACITY))
+        size = len(rows)
+        table.size = size
+        table.codes[:size] = [table._category_code(row[1]) for row in rows]
+        packed = np.array(packed_dates, dtype=np.int64)
+        table._set_dates(slice(0, size), packed)
+        table._set_amounts(slice(0, size), rows)
+        return table
+
+    # Add expense rows at the end of the table
+    def append(self, rows, packed_dates):
+        start = self.size
+        end = start + len(rows)
+        self._reserve(end)
+        self.size = end
+        self.codes[start:end] = [self._category_code(row[1]) for row in rows]
+        self._set_dates(slice(start, end),
+                        np.array(packed_dates, dtype=np.int64))
+        self._set_amounts(slice(start, end), rows)
+        self._extend_date_index(start, end)
+
+    # Replace values of the row at the given position
+    def set_row(self, position, row, packed_date):
+        self.date_order = None
+        self.codes[position] = self._category_code(row[1])
+        self._set_dates(slice(position, position + 1),
+                        np.array([packed_date], dtype=np.int64))
+        self._set_amounts(slice(position, position + 1), [row])
+
+    # Totals of every (year, month, category) group with at least one
+    # expense, as a list of (year, month, category, amount, count)
+    def group_by_month(self):
+        valid = self.valid[:self.size]
+        if not valid.any():
+            return []
+        years = self.years[:self.size][valid].astype(np.int64)
+        months = self.months[:self.size][valid].astype(np.int64)
+        codes = self.codes[:self.size][valid].astype(np.int64)
+        amounts = self.amounts[:self.size][valid]
+
+        # One group number for every (year, month, category)
+        first_year = years.min()
+        category_count = len(self.categories)
+        groups = (((years - first_year) * 12 + months - 1)
+                  * category_count + codes)
+        counts = np.bincount(groups)
+        totals = np.bincount(groups, weights=amounts,
+                             minlength=len(counts))
+
+        result = []
+        for group in np.flatnonzero(counts):
+            period, code = divmod(int(group), category_count)
+            year_offset, month_index = divmod(period, 12)
+            result.append((int(first_year) + year_offset, month_index + 1,
+                           self.categories[code], int(round(totals[group])),
+                           int(counts[group])))
+        return result
+
+    # Category totals of the expenses from the start date to the end
+    # date (both included, YYYY-MM-DD text) - binary search in the date
+    # index and totals of the matching slice only
+    def range_totals(self, start, end):
+        if self.date_order is None:
+            self._build_date_index()
+        first = np.searchsorted(self.sorted_days, _day_number(start),
+                                side='left')
+        last = np.searchsorted(self.sorted_days, _day_number(end),
+                               side='right')
+        rows = self.date_order[first:last]
+        return self._totals(self.codes[rows], self.amounts[rows])
+
+    # Category totals of rows given by their codes and amounts
+    def _totals(self, codes, amounts):
+        totals = np.bincount(codes, weights=amounts,
+                             minlength=len(self.categories))
+        counts = np.bincount(codes, minlength=len(self.categories))
+        return {
+            self.categories[code]: int(round(totals[code]))
+            for code in np.flatnonzero(counts)
+        }
+
+    # Sort positions of the valid rows by date, rows with the same date
+    # stay in the table order
+    def _build_date_index(self):
+        positions = np.flatnonzero(self.valid[:self.size])
+        days = self.days[positions]
+        order = np.argsort(days, kind='stable')
+        self.date_order = positions[order]
+        self.sorted_days = days[order]
+
+    # Add appended rows to the date index when they don't go before the
+    # last indexed date, otherwise the index is built again when needed
+    def _extend_date_index(self, start, end):
+        if self.date_order is None:
+            return
+        positions = start + np.flatnonzero(self.valid[start:end])
+        days = self.days[positions]
+        if len(days) == 0:
+            return
+        unsorted = np.any(np.diff(days) < 0)
+        if unsorted or (len(self.sorted_days)
+                        and days[0] < self.sorted_days[-1]):
+            self.date_order = None
+            return
+        self.date_order = np.concatenate((self.date_order, positions))
+        self.sorted_days = np.concatenate((self.sorted_days, days))
+
+    # Code of the category, categories which are not in CATEGORIES
+    # (typed directly into the sheet) get new codes
+    def _category_code(self, category):
+        code = self.category_codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(category)
+            self.category_codes[category] = code
+        return code
+
+    # Fill date columns from packed dates YYYYMMDD
+    def _set_dates(self, rows, packed):
+        valid = packed > 0
+        years = packed // 10000
+        months = packed // 100 % 100
+        days_of_month = packed % 100
+        # Day number of the first day of the month plus the day of month
+        month_numbers = (years - 1970) * 12 + months - 1
+        first_days = (month_numbers.astype('datetime64[M]')
+                      .astype('datetime64[D]').astype(np.int64))
+        self.days[rows] = np.where(valid, first_days + days_of_month - 1, 0)
+        self.years[rows] = np.where(valid, years, 0)
+        self.months[rows] = np.where(valid, months, 0)
+        self.valid[rows] = valid
+
+    # Fill the amount column from the rows, rows which don't have a
+    # whole number amount are marked invalid. Called after _set_dates()
+    def _set_amounts(self, rows, expense_rows):
+        amounts = [decode_amount(row[0]) for row in expense_rows]
+        self.amounts[rows] = [amount or 0 for amount in amounts]
+        self.valid[rows] &= np.array([amount is not None
+                                      for amount in amounts], dtype=bool)
+
+    # Make sure the arrays can hold the given number of rows
+    def _reserve(self, size):
+        capacity = len(self.amounts)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('amounts', 'codes', 'days', 'years', 'months',
+                     'valid'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+
+# Day number (days since 1970-01-01) of YYYY-MM-DD text
+def _day_number(date_text):
+    return int(np.datetime64(date_text, 'D').astype(np.int64))
@@ -0,0 +1,287 @@
+# Tests of two sessions writing to one expenses worksheet through their
+# own local stores, with the fake worksheet from fake_sheet.py. Run with:
+#     python3 -m unittest test_store
+import json  # for reading the replica file
+import os  # for the files of the stores
+import socket  # for closing the connection to the cache daemon
+import tempfile  # for a directory with the files of every test
+import threading  # for serving the cache daemon
+import unittest  # for running the tests
+from cache_daemon import CacheDaemon, connect_to_daemon  # for the\
+# shared cache daemon
+from fake_sheet import HEADER, FakeWorksheet  # for the shared worksheet
+from journal import WriteJournal  # for the journal of every session
+import store as store_module  # for the delay of the background flusher
+from sorted_sheet import SortedSheetStore  # for the date-sorted sheet
+from store import LocalStore  # for the stores of the sessions
+
+
+class TwoSessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.worksheet = FakeWorksheet([
+            HEADER,
+            ['10', 'Food', '2024-03-01'],
+            ['20', 'Housing', '2024-03-02'],
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Store of one session - sessions of one computer (same name) share
+    # the replica file, and the journal is used by the first of them only
+    def open_store(self, name):
+        store = LocalStore(
+            self.worksheet,
+            WriteJournal(os.path.join(self.directory.name,
+                                      f'journal_{name}.jsonl')),
+            replica_path=os.path.join(self.directory.name,
+                                      f'replica_{name}.json'))
+        store.load()
+        return store
+
+    # Rows of the worksheet without the header
+    def sheet_rows(self):
+        return self.worksheet.rows[1:]
+
+    # Category totals of March 2024 counted from the worksheet
+    def sheet_totals(self):
+        totals = {}
+        for amount, category, date in self.sheet_rows():
+            if date.startswith('2024-03'):
+                totals[category] = totals.get(category, 0) + int(amount)
+        return totals
+
+    def test_rows_appended_by_other_session(self):
+        first = self.open_store('a')
+        second = self.open_store('b')
+        second.add_expenses([[5, 'Gifts', '2024-03-03']])
+        second.flush()
+        first.add_expenses([[7, 'Food', '2024-03-04']])
+        first.refresh()
+        second.refresh()
+
+        for store in (first, second):
+            self.assertEqual(store.replica.rows, self.sheet_rows())
+            self.assertEqual(store.month_totals(2024, 3),
+                             self.sheet_totals())
+
+    def test_edit_by_other_session_is_downloaded(self):
+        first = self.open_store('shared')
+        second = self.open_store('shared')
+        self.assertFalse(second.replica.saving)
+        row_id = second.month_records(2024, 3)[0]['id']
+        second.update_expense(row_id, {1: 15})
+        first.refresh()
+
+        self.assertEqual(first.replica.rows, self.sheet_rows())
+        self.assertEqual(first.month_totals(2024, 3), self.sheet_totals())
+
+    def test_rows_deleted_from_sheet(self):
+        store = self.open_store('a')
+        self.worksheet.delete_rows(3)
+        self.worksheet.append_rows([['30', 'Food', '2024-03-05']])
+        store.refresh()
+
+        self.assertEqual(store.replica.rows, self.sheet_rows())
+        self.assertEqual(store.month_totals(2024, 3), self.sheet_totals())
+
+    def test_edit_of_new_row_after_rows_of_other_session(self):
+        first = self.open_store('a')
+        second = self.open_store('b')
+        second.add_expenses([[5, 'Gifts', '2024-03-03']])
+        second.flush()
+        first.add_expenses([[7, 'Food', '2024-03-04']])
+        first.flush()
+        row_id = first.month_records(2024, 3)[-1]['id']
+        first.update_expense(row_id, {1: 999})
+        first.flush()
+
+        self.assertIn(['5', 'Gifts', '2024-03-03'], self.sheet_rows())
+        self.assertIn(['999', 'Food', '2024-03-04'], self.sheet_rows())
+
+    def test_edit_of_row_moved_in_sheet(self):
+        store = self.open_store('a')
+        row_id = store.month_records(2024, 3)[1]['id']
+        self.worksheet.delete_rows(2)
+        store.update_expense(row_id, {1: 999})
+        store.flush()
+
+        self.assertEqual(self.sheet_rows(), [['999', 'Housing', '2024-03-02']])
+        store.refresh()
+        self.assertEqual(store.month_totals(2024, 3), {'Housing': 999})
+
+    def test_edit_of_row_changed_by_other_session_is_dropped(self):
+        store = self.open_store('a')
+        row_id = store.month_records(2024, 3)[0]['id']
+        self.worksheet.update_cell(2, 1, '11')
+        store.update_expense(row_id, {2: 'Gifts'})
+        store.flush()
+
+        self.assertEqual(self.sheet_rows()[0], ['11', 'Food', '2024-03-01'])
+
+    def test_delete_of_row_moved_in_sheet(self):
+        store = self.open_store('a')
+        self.worksheet.append_rows([['30', 'Food', '2024-03-05']])
+        row_id = store.month_records(2024, 3)[1]['id']
+        self.worksheet.delete_rows(2)
+        store.delete_expense(row_id)
+
+        self.assertEqual(self.sheet_rows(), [['30', 'Food', '2024-03-05']])
+        store.refresh()
+        self.assertEqual(store.month_totals(2024, 3), {'Food': 30})
+
+    def test_writes_replayed_after_crash(self):
+        flush_delay = store_module.FLUSH_DELAY
+        store_module.FLUSH_DELAY = 60
+        self.addCleanup(setattr, store_module, 'FLUSH_DELAY', flush_delay)
+        store = self.open_store('a')
+        row_id = store.month_records(2024, 3)[0]['id']
+        store.add_expenses([[7, 'Food', '2024-03-04']])
+        store.update_expense(row_id, {1: 15})
+        with open(store.replica.path, encoding='utf-8') as replica_file:
+            self.assertEqual(len(json.load(replica_file)['rows']), 2)
+        # The process ends without sending the writes
+        store.journal.lock_file.close()
+        store = self.open_store('a')
+
+        self.assertEqual(self.sheet_rows(), [
+            ['15', 'Food', '2024-03-01'],
+            ['20', 'Housing', '2024-03-02'],
+            ['7', 'Food', '2024-03-04'],
+        ])
+        self.assertEqual(store.replica.rows, self.sheet_rows())
+        self.assertEqual(store.month_totals(2024, 3), self.sheet_totals())
+
+    def test_ids_kept_by_full_sync(self):
+        store = self.open_store('a')
+        records = store.month_records(2024, 3)
+        self.worksheet.delete_rows(2)
+        store.refresh()
+
+        self.assertEqual(store.month_records(2024, 3), records[1:])
+
+
+class BadCellsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.worksheet = FakeWorksheet([
+            HEADER,
+            ['10', 'Food', '2024-03-01'],
+            ['20', 'Food', '2024-00-10'],
+            ['30', 'Food', '2024-13-05'],
+            ['40', 'Food', '2023-02-29'],
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_store(self):
+        store = LocalStore(
+            self.worksheet,
+            WriteJournal(os.path.join(self.directory.name, 'journal.jsonl')),
+            replica_path=os.path.join(self.directory.name, 'replica.json'))
+        store.load()
+        return store
+
+    def test_rows_with_bad_dates_are_left_out(self):
+        store = self.open_store()
+        self.worksheet.append_rows([['50', 'Food', '2024-13-01']])
+        store.refresh()
+
+        self.assertEqual(store.totals_by_year(), {2024: {'Food': 10}})
+        self.assertEqual(store.month_totals(2025, 1), {})
+
+    def test_rows_with_bad_amounts_are_left_out(self):
+        self.worksheet.append_rows([['12.5', 'Food', '2024-03-02'],
+                                    ['', 'Food', '2024-03-03']])
+        store = self.open_store()
+        self.worksheet.append_rows([['abc', 'Food', '2024-03-04'],
+                                    ['5', 'Gifts', '2024-03-05']])
+        store.refresh()
+        row_id = store.month_records(2024, 3)[-1]['id']
+        store.update_expense(row_id, {1: 6})
+
+        self.assertEqual(store.month_totals(2024, 3),
+                         {'Food': 10, 'Gifts': 6})
+        self.assertEqual(store.range_totals('2024-03-01', '2024-03-31'),
+                         {'Food': 10, 'Gifts': 6})
+
+
+class SortedSheetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.worksheet = FakeWorksheet([
+            HEADER,
+            ['10', 'Food', '2024-03-01'],
+            ['20', 'Housing', '2024-03-05'],
+        ])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Store of one session with its own month index
+    def open_store(self, name):
+        store = SortedSheetStore(
+            self.worksheet,
+            os.path.join(self.directory.name, f'index_{name}.json'))
+        store.load()
+        return store
+
+    def test_edit_of_row_moved_by_sort(self):
+        first = self.open_store('a')
+        second = self.open_store('b')
+        row_id = first.month_records(2024, 3)[1]['id']
+        second.add_expenses([[5, 'Gifts', '2024-03-02']])
+        first.update_expense(row_id, {1: 999})
+
+        self.assertEqual(self.worksheet.rows[1:], [
+            ['10', 'Food', '2024-03-01'],
+            ['5', 'Gifts', '2024-03-02'],
+            ['999', 'Housing', '2024-03-05'],
+        ])
+
+    def test_edit_of_row_changed_by_other_session(self):
+        store = self.open_store('a')
+        row_id = store.month_records(2024, 3)[0]['id']
+        self.worksheet.update_cell(2, 1, '11')
+
+        with self.assertRaises(KeyError):
+            store.update_expense(row_id, {2: 'Gifts'})
+        self.assertEqual(self.worksheet.rows[1], ['11', 'Food', '2024-03-01'])
+
+
+class CacheDaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        store = LocalStore(
+            FakeWorksheet([HEADER, ['10', 'Food', '2024-03-01']]),
+            WriteJournal(os.path.join(self.directory.name, 'journal.jsonl')),
+            replica_path=os.path.join(self.directory.name, 'replica.json'))
+        store.load()
+        path = os.path.join(self.directory.name, 'daemon.sock')
+        self.server = CacheDaemon(store, path)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.client = connect_to_daemon(path)
+
+    def tearDown(self):
+        self.client.stream.close()
+        self.client.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_unknown_id_raises_key_error(self):
+        with self.assertRaises(KeyError):
+            self.client.update_expense(999, {1: 5})
+
+    def test_reads_after_lost_connection(self):
+        self.client.connection.shutdown(socket.SHUT_RDWR)
+
+        self.assertEqual(self.client.year_totals(2024), {'Food': 10})
+        self.assertIsNone(self.client.local)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# Startup timing - when EXPENSE_TRACKER_TIMING environment variable is
+# set, duration of every startup phase is printed to stderr, together
+# with the time since the program started. Phases are also recorded in
+# the session metrics when they are enabled (see metrics.py)
+import metrics  # for recording phases in the session metrics
+import os  # for reading environment variables
+import sys  # for printing to stderr
+import time  # for measuring time
+from contextlib import contextmanager  # for timing blocks of code
+
+ENABLED = bool(os.environ.get('EXPENSE_TRACKER_TIMING'))
+
+# Time when this module was imported - run.py imports it first
+START = time.perf_counter()
+
+
+# Print time since the program started
+def mark(event):
+    if ENABLED:
+        elapsed = (time.perf_counter() - START) * 1000
+        print(f'[timing] {event} at {elapsed:.1f} ms', file=sys.stderr)
+
+
+# Print how long the block of code took
+@contextmanager
+def phase(name):
+    if not ENABLED and not metrics.ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    yield
+    finished = time.perf_counter()
+    if metrics.ENABLED:
+        metrics.record('phase', name, finished - started)
+    if ENABLED:
+        print(f'[timing] {name}: {(finished - started) * 1000:.1f} ms '
+              f'(done at {(finished - START) * 1000:.1f} ms)',
+              file=sys.stderr)
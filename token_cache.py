@@ -0,0 +1,104 @@
+# Cache of OAuth access tokens shared by all the sessions on this machine.
+# Every session used to exchange the service account key for a new access
+# token when it started. Now the token is saved in a local file, and the
+# next sessions reuse it until shortly before it expires. A lock file
+# makes sure only one session refreshes the token at a time
+import json  # for reading and writing the cache file
+import os  # for reading environment variables and replacing files
+from contextlib import contextmanager  # for locking blocks of code
+from datetime import datetime, timedelta, timezone  # for checking\
+# token expiry
+
+try:
+    import fcntl  # for locking the cache file between sessions
+except ImportError:
+    # Windows - sessions are not locked against each other
+    fcntl = None
+
+# Location of the cache file, can be changed with environment variable
+TOKEN_CACHE_PATH = os.environ.get('EXPENSE_TRACKER_TOKEN_CACHE',
+                                  '.token_cache.json')
+
+# Token is refreshed when it expires in less than this time, so
+# a session never starts with a token about to expire
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+# Give the credentials a valid access token - taken from the cache
+# when there is one, otherwise refreshed and saved to the cache
+def apply_cached_token(credentials, path=TOKEN_CACHE_PATH):
+    key = _cache_key(credentials)
+    with _locked(path, exclusive=False):
+        if _apply_token(credentials, _read_cache(path).get(key)):
+            return
+
+    with _locked(path, exclusive=True):
+        # Another session could have refreshed the token in the meantime
+        cache = _read_cache(path)
+        if _apply_token(credentials, cache.get(key)):
+            return
+
+        from google.auth.transport.requests import Request  # for\
+        # exchanging the service account key for an access token
+        credentials.refresh(Request())
+        cache[key] = {
+            'token': credentials.token,
+            'expiry': credentials.expiry.isoformat(),
+        }
+        _write_cache(path, cache)
+
+
+# Set the token on the credentials when it's still valid long enough
+def _apply_token(credentials, entry):
+    if not entry:
+        return False
+    # google-auth keeps expiry as naive datetime in UTC
+    expiry = datetime.fromisoformat(entry['expiry'])
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    if expiry - REFRESH_MARGIN <= now:
+        return False
+    credentials.token = entry['token']
+    credentials.expiry = expiry
+    return True
+
+
+# Tokens are cached separately for every service account and scopes
+def _cache_key(credentials):
+    account = getattr(credentials, 'service_account_email', 'default')
+    scopes = ' '.join(sorted(getattr(credentials, 'scopes', None) or []))
+    return f'{account} {scopes}'
+
+
+# Read the cache file, an unreadable file counts as empty cache
+def _read_cache(path):
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Write the cache file readable only by the owner, tokens give access
+# to the Google Sheets document
+def _write_cache(path, cache):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temp_path, path)
+
+
+# Lock shared by all the sessions - many sessions can read the cache at
+# the same time, but refreshing the token needs an exclusive lock
+@contextmanager
+def _locked(path, exclusive):
+    if fcntl is None:
+        yield
+        return
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
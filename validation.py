@@ -0,0 +1,138 @@
+# Expense categories and validation rules for expense details, shared by
+# the interactive prompts and the CSV importer
+import re  # for reading quarters
+from datetime import date, datetime, timedelta  # for working with\
+# dates and times
+
+# Define the expense categories
+CATEGORIES = [
+    'Housing',
+    'Transportation',
+    'Food',
+    'Utilities',
+    'Clothing',
+    'Healthcare',
+    'Insurance',
+    'Supplies',
+    'Personal',
+    'Debt',
+    'Retirement',
+    'Education',
+    'Savings',
+    'Gifts',
+    'Entertainment'
+]
+
+
+# Check expense category name - return the name as written in
+# CATEGORIES, matching is case insensitive
+def parse_category(category_input):
+    for category in CATEGORIES:
+        if category.lower() == category_input.strip().lower():
+            return category
+    raise ValueError(f'Invalid category. Please use one of: '
+                     f'{", ".join(CATEGORIES)}.')
+
+
+# Check expense amount - only positive numbers are allowed and
+# the amount is rounded to integer
+def parse_amount(amount_input):
+    try:
+        amount = round(float(amount_input))
+    except (ValueError, OverflowError):
+        raise ValueError('Invalid amount. Please enter a valid number.')
+    if amount <= 0:
+        raise ValueError('Invalid amount. Please enter a positive number.')
+    return amount
+
+
+# Check expense date - date has to be in the past or today
+def parse_date(date_input):
+    try:
+        date = datetime.strptime(date_input.strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError("Incorrect date format. Please enter a valid"
+                         " date in the format YYYY-MM-DD.")
+    if date > date.today():
+        raise ValueError('Invalid date. Please enter a date in the past '
+                         'or today')
+    return date
+
+
+# Check date range - either two dates separated by "to", such as
+# 2023-04-06 to 2024-04-05, or a quarter such as 2024-Q1. Return first
+# and last date of the range, both included
+def parse_date_range(range_input):
+    quarter = re.fullmatch(r'(\d{4})\s*-?\s*[Qq]([1-4])',
+                           range_input.strip())
+    if quarter:
+        year = int(quarter.group(1))
+        first_month = (int(quarter.group(2)) - 1) * 3 + 1
+        start = date(year, first_month, 1)
+        if first_month == 10:
+            end = date(year, 12, 31)
+        else:
+            end = date(year, first_month + 3, 1) - timedelta(days=1)
+        return start, end
+
+    parts = range_input.lower().split(' to ')
+    if len(parts) != 2:
+        raise ValueError('Invalid range. Please enter two dates such as '
+                         '2023-04-06 to 2024-04-05, or a quarter such '
+                         'as 2024-Q1.')
+    try:
+        start, end = (datetime.strptime(part.strip(), '%Y-%m-%d').date()
+                      for part in parts)
+    except ValueError:
+        raise ValueError("Incorrect date format. Please enter valid"
+                         " dates in the format YYYY-MM-DD.")
+    if start > end:
+        raise ValueError('Invalid range. The first date has to be before '
+                         'the second date.')
+    return start, end
+
+
+# Check list of years separated by spaces - at least two years,
+# each between 1900 and the current year
+def parse_years(years_input):
+    current_year = datetime.today().year
+    try:
+        years = [int(year) for year in years_input.split()]
+    except ValueError:
+        years = []
+    if len(years) < 2 or any(year < 1900 or year > current_year
+                             for year in years):
+        raise ValueError(f'Invalid years. Please enter at least two '
+                         f'numbers between 1900 and {current_year} '
+                         f'separated by spaces.')
+    return years
+
+
+# Check list of months YYYY-MM separated by spaces, or number of last
+# months ending with the current month - return (year, month) pairs
+def parse_months(months_input):
+    today = date.today()
+    text = months_input.strip()
+    if text.isdigit():
+        count = int(text)
+        if count < 2 or count > 120:
+            raise ValueError('Invalid number of months. Please enter '
+                             'a number between 2 and 120.')
+        last = today.year * 12 + today.month - 1
+        return [(number // 12, number % 12 + 1)
+                for number in range(last - count + 1, last + 1)]
+
+    months = []
+    for month_input in text.split():
+        try:
+            month_date = datetime.strptime(month_input, '%Y-%m').date()
+        except ValueError:
+            raise ValueError('Incorrect month format. Please enter months '
+                             'in the format YYYY-MM separated by spaces.')
+        if month_date.year < 1900 or month_date > today:
+            raise ValueError('Invalid month. Please enter months from '
+                             '1900 up to the current month.')
+        months.append((month_date.year, month_date.month))
+    if len(months) < 2:
+        raise ValueError('Please enter at least two months.')
+    return months